@@ -3,13 +3,18 @@ from fastapi import FastAPI, Query, Request
 from fastapi.responses import JSONResponse
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
-import random, requests
+import asyncio, os, random, requests
 
 import urllib.parse as urlparse
 from urllib.parse import parse_qs
 
 app = FastAPI()
 
+# Fault injection: share of 500 answers, fixed latency plus a random jitter (milliseconds)
+OSM_ERROR_RATE = float(os.environ.get("OSM_ERROR_RATE", "0.09"))
+OSM_LATENCY_MS = int(os.environ.get("OSM_LATENCY_MS", "0"))
+OSM_LATENCY_JITTER_MS = int(os.environ.get("OSM_LATENCY_JITTER_MS", "0"))
+
 def get_interval_datetimes(start, end, step_time, step_unit):
     datetimes = []
     if end is None:
@@ -35,7 +40,7 @@ def get_interval_datetimes(start, end, step_time, step_unit):
 def generate_response():
     # Random distribution with weights
     request_types=['201', '500']
-    option = random.choices(request_types, weights=[0.9, 0.09], k=1)
+    option = random.choices(request_types, weights=[1 - OSM_ERROR_RATE, OSM_ERROR_RATE], k=1)
     if option == ['201']:
         st = 0
     else:
@@ -67,6 +72,10 @@ async def monitoring_data(start: datetime, match: List[str] = Query([], min_leng
         step_time = None
         step_unit = None
     
+    # Injected latency
+    if OSM_LATENCY_MS > 0 or OSM_LATENCY_JITTER_MS > 0:
+        await asyncio.sleep((OSM_LATENCY_MS + random.uniform(0, OSM_LATENCY_JITTER_MS)) / 1000.0)
+
     # Random response
     if generate_response() == '500':
       return JSONResponse(status_code=500, content={"status": "Error", "message": "Faild to connect to OSM."})
@@ -0,0 +1,76 @@
+import datetime, math, threading
+
+# Running state of one aggregation bucket, Welford's algorithm for mean and variance
+class RunningAggregate(object):
+  __slots__ = ('count', 'total', 'minimum', 'maximum', 'mean', 'm2')
+
+  def __init__(self):
+    self.count = 0
+    self.total = 0.0
+    self.minimum = None
+    self.maximum = None
+    self.mean = 0.0
+    self.m2 = 0.0
+
+  def add(self, value):
+    self.count += 1
+    self.total += value
+    if self.minimum == None or value < self.minimum:
+      self.minimum = value
+    if self.maximum == None or value > self.maximum:
+      self.maximum = value
+    delta = value - self.mean
+    self.mean += delta / self.count
+    self.m2 += delta * (value - self.mean)
+
+  # Same results as the SQL aggregate functions (NULL on empty buckets, sample STDDEV)
+  def result(self, method):
+    method = method.upper()
+    if method == 'COUNT':
+      return self.count
+    if self.count == 0:
+      return None
+    if method == 'SUM':
+      return self.total
+    if method == 'AVG':
+      return self.mean
+    if method == 'MIN':
+      return self.minimum
+    if method == 'MAX':
+      return self.maximum
+    if method == 'STDDEV':
+      return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else None
+    raise ValueError('Aggregation method ' + method + ' not supported.')
+
+# Window state per metric and bucket, a bucket ends every step_aggregation from timestamp_start
+class StreamingAggregator(object):
+  def __init__(self):
+    self.buckets = {}
+    self.lock = threading.Lock()
+
+  def add(self, metric_id, value, timestamp, timestamp_start, step_seconds):
+    elapsed = (timestamp - timestamp_start).total_seconds()
+    bucket = timestamp_start + datetime.timedelta(seconds=(int(elapsed // step_seconds) + 1) * step_seconds)
+    with self.lock:
+      windows = self.buckets.setdefault(metric_id, {})
+      state = windows.get(bucket)
+      if state == None:
+        state = windows[bucket] = RunningAggregate()
+      state.add(value)
+
+  # Bucket ending at `bucket`, buckets ending more than `keep` earlier are dropped
+  def pop(self, metric_id, bucket, keep=datetime.timedelta(0)):
+    with self.lock:
+      windows = self.buckets.get(metric_id)
+      if windows == None:
+        return None
+      state = windows.pop(bucket, None)
+      for key in [key for key in windows if key < bucket - keep]:
+        del windows[key]
+      if not windows:
+        del self.buckets[metric_id]
+      return state
+
+  def discard(self, metric_id):
+    with self.lock:
+      self.buckets.pop(metric_id, None)
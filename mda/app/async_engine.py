@@ -0,0 +1,59 @@
+import asyncio, httpx
+
+# Fetch -> transform -> publish engine running on the FastAPI event loop
+class AsyncEngine(object):
+  def __init__(self, endpoint, handler, concurrency=100, timeout=10.0):
+    self.endpoint = endpoint
+    self.handler = handler
+    self.concurrency = concurrency
+    self.timeout = timeout
+    self.loop = None
+    self.queue = None
+    self.semaphore = None
+    self.client = None
+    self.task = None
+    self.in_flight = set()
+
+  async def start(self):
+    self.loop = asyncio.get_event_loop()
+    self.queue = asyncio.Queue()
+    self.semaphore = asyncio.Semaphore(self.concurrency)
+    # Pooled keep-alive connections, at most one per in-flight request
+    limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+    self.client = httpx.AsyncClient(limits=limits, timeout=self.timeout)
+    self.task = self.loop.create_task(self.run())
+
+  async def stop(self):
+    if self.task != None:
+      self.task.cancel()
+    if self.in_flight:
+      await asyncio.wait(self.in_flight)
+    if self.client != None:
+      await self.client.aclose()
+
+  # Thread-safe and queue-like, called by the scheduler thread
+  def put(self, batch):
+    self.loop.call_soon_threadsafe(self.queue.put_nowait, batch)
+
+  def qsize(self):
+    return self.queue.qsize() if self.queue != None else 0
+
+  async def run(self):
+    while True:
+      batch = await self.queue.get()
+      await self.semaphore.acquire()
+      task = self.loop.create_task(self.handle(batch))
+      self.in_flight.add(task)
+      task.add_done_callback(self.in_flight.discard)
+
+  async def handle(self, batch):
+    try:
+      await self.handler(self, batch)
+    except Exception as e:
+      print('async_engine-> ' + str(e))
+    finally:
+      self.semaphore.release()
+
+  # Timeout of the attempt, bounded by the fetch deadline of the OSM client
+  async def fetch(self, params, timeout=None):
+    return await self.client.get(self.endpoint, params=params, timeout=timeout if timeout != None else self.timeout)
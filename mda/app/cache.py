@@ -0,0 +1,62 @@
+import hashlib, threading, time, uuid
+from collections import OrderedDict
+
+# Serialized config responses, least recently used entries evicted past max_entries.
+# Every invalidation bumps the version of the config, the ETag is built from it.
+# Entries expire after ttl seconds when the schedule is advanced by another process,
+# the body then changes without an invalidation and a digest of it is added to the ETag.
+class ConfigCache(object):
+  def __init__(self, max_entries=10000, ttl=None):
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.entries = OrderedDict()
+    self.versions = {}
+    # ETags of a previous process never match
+    self.boot = uuid.uuid4().hex[:8]
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  # (etag, body) or None
+  def get(self, config_id):
+    config_id = str(config_id)
+    with self.lock:
+      entry = self.entries.get(config_id)
+      if entry == None or (entry[2] != None and entry[2] < time.time()):
+        self.misses += 1
+        return None
+      self.entries.move_to_end(config_id)
+      self.hits += 1
+      return entry[:2]
+
+  # Read before loading the config, a put with an older version is not cached
+  def version(self, config_id):
+    config_id = str(config_id)
+    with self.lock:
+      return self.versions.get(config_id, 0)
+
+  def put(self, config_id, version, body):
+    config_id = str(config_id)
+    with self.lock:
+      tag = self.boot + '-' + str(version)
+      if self.ttl != None:
+        tag += '-' + hashlib.sha1(body.encode('utf-8')).hexdigest()[:16]
+      entry = ('"' + tag + '"', body)
+      if self.versions.get(config_id, 0) != version:
+        return entry
+      self.entries[config_id] = entry + (time.time() + self.ttl if self.ttl != None else None,)
+      self.entries.move_to_end(config_id)
+      while len(self.entries) > self.max_entries:
+        self.entries.popitem(last=False)
+        self.evictions += 1
+      return entry
+
+  def invalidate(self, config_id):
+    config_id = str(config_id)
+    with self.lock:
+      self.entries.pop(config_id, None)
+      self.versions[config_id] = self.versions.get(config_id, 0) + 1
+
+  def stats(self):
+    return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
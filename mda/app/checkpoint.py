@@ -0,0 +1,105 @@
+import threading
+import psycopg2.extras
+from .telemetry import db_commit_seconds
+
+# Disabled or deleted metrics are never overwritten by a late checkpoint
+update_schedule = "UPDATE metric SET next_run_at = v.next_run_at, next_aggregation = v.next_aggregation, status = v.status " \
+                  "FROM (VALUES %s) AS v (_id, next_run_at, next_aggregation, status) " \
+                  "WHERE metric._id = v._id AND metric.status = 1;"
+# Lease mode: rows leased by another node are not overwritten either
+update_owned_schedule = "UPDATE metric SET next_run_at = v.next_run_at, next_aggregation = v.next_aggregation, status = v.status " \
+                        "FROM (VALUES %s) AS v (_id, next_run_at, next_aggregation, status, owner) " \
+                        "WHERE metric._id = v._id AND metric.status = 1 AND metric.owner = v.owner;"
+
+# Authoritative in-memory schedule, written to the metric table in periodic batched UPDATEs
+class ScheduleCheckpoint(object):
+  def __init__(self, engine, interval=5.0, on_flush=None, owner=None):
+    self.engine = engine
+    self.interval = interval
+    # Node id in lease mode, only the rows leased by the node are written
+    self.owner = owner
+    # Called with the ids of the metrics written by a checkpoint
+    self.on_flush = on_flush
+    self.active = set()
+    self.dirty = {}
+    self.lock = threading.Lock()
+    self.flush_lock = threading.Lock()
+    self.stopped = threading.Event()
+    self.written = 0
+    self.thread = threading.Thread(target=self.run, name='mda-checkpoint')
+    self.thread.setDaemon(True)
+    self.thread.start()
+
+  def activate(self, metric_id):
+    with self.lock:
+      self.active.add(metric_id)
+
+  # Returns the state not checkpointed yet, (next_run_at, next_aggregation, status) or None
+  def deactivate(self, metric_id):
+    with self.lock:
+      self.active.discard(metric_id)
+      return self.dirty.pop(metric_id, None)
+
+  def is_active(self, metric_id):
+    return metric_id in self.active
+
+  def advance(self, metric_id, next_run_at, next_aggregation, status):
+    with self.lock:
+      if metric_id not in self.active:
+        return False
+      self.dirty[metric_id] = (next_run_at, next_aggregation, status)
+      if status == 0:
+        self.active.discard(metric_id)
+      return True
+
+  def run(self):
+    while not self.stopped.wait(self.interval):
+      # A failure must not stop the checkpoints
+      try:
+        self.flush()
+      except Exception as e:
+        print('schedule_checkpoint-> ' + str(e))
+
+  def flush(self):
+    with self.flush_lock:
+      with self.lock:
+        dirty = self.dirty
+        self.dirty = {}
+      if not dirty:
+        return
+      rows = [(str(metric_id),) + state for metric_id, state in dirty.items()]
+      query, template = update_schedule, '(%s::uuid, %s::timestamp, %s::timestamp, %s::integer)'
+      if self.owner != None:
+        rows = [row + (self.owner,) for row in rows]
+        query, template = update_owned_schedule, '(%s::uuid, %s::timestamp, %s::timestamp, %s::integer, %s)'
+      conn = None
+      try:
+        # An unreachable database fails here, the schedule is kept as for a failed write
+        conn = self.engine.raw_connection()
+        with db_commit_seconds.labels('checkpoint').time():
+          cursor = conn.cursor()
+          psycopg2.extras.execute_values(cursor, query, rows, template=template, page_size=1000)
+          conn.commit()
+        self.written += len(rows)
+        if self.on_flush != None:
+          self.on_flush(list(dirty.keys()))
+      except Exception as e:
+        print('schedule_checkpoint-> ' + str(e))
+        # Kept for the next checkpoint unless a newer state exists
+        with self.lock:
+          for metric_id, state in dirty.items():
+            if metric_id in self.active or state[2] == 0:
+              self.dirty.setdefault(metric_id, state)
+        if conn != None:
+          try:
+            conn.rollback()
+          except Exception:
+            pass
+      finally:
+        if conn != None:
+          conn.close()
+
+  def close(self):
+    self.stopped.set()
+    self.thread.join()
+    self.flush()
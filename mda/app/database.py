@@ -1,13 +1,55 @@
 from .main import *
+import re, threading
 
 engine = create_engine('postgresql+psycopg2://' + POSTGRES_USER + ':' + POSTGRES_PW + '@' + POSTGRES_URL + '/' + POSTGRES_DB, pool_size=num_fetch_threads, convert_unicode=True)
 # Create database if it does not exist.
 if not database_exists(engine.url):
   create_database(engine.url)
-db_session = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
+# Separate pool for the REST API, the fetch workers can not starve it
+api_engine = create_engine(engine.url, pool_size=API_POOL_SIZE, max_overflow=0, convert_unicode=True)
+worker_sessions = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+api_sessions = sessionmaker(autocommit=False, autoflush=False, bind=api_engine)
+
+# Sessions are per thread, the API executor threads use the API pool
+def session_factory():
+  if threading.current_thread().name.startswith('mda-api'):
+    return api_sessions()
+  return worker_sessions()
+
+db_session = scoped_session(session_factory)
+
+# Cached config responses show next_run_at, dropped once a new schedule is written
+def schedule_written(metric_ids):
+  for config_id in wait_queue.configs_of(metric_ids):
+    config_cache.invalidate(config_id)
+
+# Schedule advanced in memory, next_run_at/next_aggregation/status written in batches
+schedule_checkpoint = ScheduleCheckpoint(engine, interval=CHECKPOINT_INTERVAL, on_flush=schedule_written, owner=NODE_ID if CLUSTER_MODE == 'lease' else None)
+# Raw values are written in bulk by the write-behind buffer
+value_writer = ValueWriter(engine, max_rows=VALUE_BUFFER_ROWS, flush_rows=VALUE_FLUSH_ROWS, interval=VALUE_FLUSH_INTERVAL)
 Base = declarative_base()
 Base.query = db_session.query_property()
 
+# Continuous aggregates need the TimescaleDB extension, plain Postgres otherwise
+def timescaledb_available():
+  try:
+    with engine.connect() as conn:
+      if conn.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'timescaledb';").scalar() == None:
+        return False
+      conn.execute("CREATE EXTENSION IF NOT EXISTS timescaledb CASCADE;")
+    return True
+  except Exception as e:
+    print(e)
+    return False
+
+# Resolved backend, re-exported to main by its star import
+if AGGREGATION_BACKEND in ('auto', 'timescaledb'):
+  if timescaledb_available():
+    AGGREGATION_BACKEND = 'timescaledb'
+  else:
+    print('TimescaleDB extension not available, aggregating with plain Postgres.')
+    AGGREGATION_BACKEND = 'postgres'
+
 class Config(Base):
   __tablename__ = 'config'
   _id = Column(postgresql.UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True)
@@ -61,6 +103,9 @@ class Metric(Base):
   next_run_at = Column(DateTime, nullable=False)
   next_aggregation = Column(DateTime, nullable=True)
   status = Column(Integer, default=1)
+  # Node scheduling the metric in lease mode, until lease_expires_at unless renewed
+  owner = Column(String(256), nullable=True)
+  lease_expires_at = Column(DateTime, nullable=True)
   values = relationship("Value", cascade="all, delete")
 
   def __init__(self, metric_name, metric_type, aggregation_method, step, step_aggregation, config_id, next_run_at, next_aggregation):
@@ -84,6 +129,8 @@ class Metric(Base):
 
 class Value(Base):
   __tablename__ = 'value'
+  # Partitioned by time range (hypertable chunks with TimescaleDB), expired partitions are dropped as a whole
+  __table_args__ = {} if AGGREGATION_BACKEND == 'timescaledb' else {'postgresql_partition_by': 'RANGE (timestamp)'}
   timestamp = Column(DateTime, nullable=False, primary_key=True)
   metric_id = Column(postgresql.UUID(as_uuid=True), ForeignKey('metric._id'), primary_key=True)
   metric_value = Column(Float, nullable=False)
@@ -98,6 +145,24 @@ seconds_per_unit = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
 
 def convert_to_seconds(s):
   return int(s[:-1]) * seconds_per_unit[s[-1]]
+
+# Lease mode: metrics scheduled by this node on a config change are leased to it,
+# a previous owner drops them when its renewal misses them
+def lease_metric(row_m):
+  if CLUSTER_MODE == 'lease':
+    row_m.owner = NODE_ID
+    row_m.lease_expires_at = func.now() + datetime.timedelta(seconds=LEASE_TTL)
+
+def leased_elsewhere(row_m):
+  return CLUSTER_MODE == 'lease' and row_m.owner != None and row_m.owner != NODE_ID
+
+# Lease mode: sent with the change, the other nodes receive it once committed
+def notify_nodes(action, arguments):
+  if CLUSTER_MODE != 'lease':
+    return
+  for index in range(0, len(arguments), 100):
+    payload = action + ':' + NODE_ID + ':' + ','.join(str(argument) for argument in arguments[index:index + 100])
+    db_session.execute("SELECT pg_notify('mda_leases', :payload);", {'payload': payload})
  
 def add_config(config: Config_Model):
   global db_session
@@ -113,18 +178,69 @@ def add_config(config: Config_Model):
         sec_to_add = convert_to_seconds(metric.step_aggregation)
         aggregation = row.timestamp_start + relativedelta(seconds=sec_to_add)
       row_m = Metric(metric.metricName, metric.metricType, metric.aggregationMethod, metric.step, metric.step_aggregation, row._id, row.timestamp_start, aggregation)
+      lease_metric(row_m)
       db_session.add(row_m)
       db_session.commit()
       #Read metric
-      wait_queue.put((row_m.next_run_at, row.timestamp_start, row_m.step, row.timestamp_end, row_m._id, row_m.metric_name, row_m.metric_type, row_m.aggregation_method, row.business_id, row.kafka_topic, row.network_id, row.tenant_id, row.resource_id, row.reference_id, row_m.step_aggregation, row_m.next_aggregation, 0))
-      #if row_m.aggregation_method != None:
-      #  create_aggregate_view(row_m._id, row_m.aggregation_method, row_m.step_aggregation)
+      schedule_checkpoint.activate(row_m._id)
+      wait_queue.put(metric_job(row_m, row))
+      if row_m.aggregation_method != None and AGGREGATION_BACKEND == 'timescaledb':
+        create_aggregate_view(row_m._id, row_m.aggregation_method, row_m.step_aggregation, row.timestamp_start)
       response['metrics'].append(row_m.toString())
+    # A read during the creation may have cached it without every metric
+    config_cache.invalidate(row._id)
     return response
   except Exception as e:
     print(e)
     return -1
 
+# Configs and metrics inserted in one transaction, queued with a single scheduler operation
+def add_configs(configs):
+  global db_session
+  global wait_queue
+  try:
+    rows = []
+    for config in configs:
+      row = Config(config.businessID, config.topic, config.networkID, config.timestampStart, config.timestampEnd, config.tenantID, config.resourceID, config.referenceID)
+      # Ids known before the flush, the rows are inserted in batches
+      row._id = uuid.uuid4()
+      db_session.add(row)
+      metrics = []
+      for metric in config.metrics:
+        aggregation = None
+        if metric.step_aggregation != None:
+          sec_to_add = convert_to_seconds(metric.step_aggregation)
+          aggregation = row.timestamp_start + relativedelta(seconds=sec_to_add)
+        row_m = Metric(metric.metricName, metric.metricType, metric.aggregationMethod, metric.step, metric.step_aggregation, row._id, row.timestamp_start, aggregation)
+        row_m._id = uuid.uuid4()
+        lease_metric(row_m)
+        db_session.add(row_m)
+        metrics.append(row_m)
+      rows.append((row, metrics))
+    db_session.flush()
+    # Built before the commit expires the rows
+    responses = []
+    jobs = []
+    for row, metrics in rows:
+      response = row.toString()
+      for row_m in metrics:
+        response['metrics'].append(row_m.toString())
+        jobs.append(metric_job(row_m, row))
+      responses.append(response)
+    db_session.commit()
+    for job in jobs:
+      schedule_checkpoint.activate(job.metric.metric_id)
+    wait_queue.put_many(jobs)
+    for job in jobs:
+      metric = job.metric
+      if metric.aggregation_method != None and AGGREGATION_BACKEND == 'timescaledb':
+        create_aggregate_view(metric.metric_id, metric.aggregation_method, metric.step_aggregation, metric.config.timestamp_start)
+    return responses
+  except Exception as e:
+    db_session.rollback()
+    print(e)
+    return -1
+
 def get_config(config_id):
   try:
     config = Config.query.filter_by(_id=config_id).first()
@@ -138,32 +254,71 @@ def get_config(config_id):
     print(e)
     return -1
 
-def get_configs():
+# One page of configs ordered by id (keyset cursor), metrics loaded with a single IN query
+def get_configs(limit, cursor=None, tenant_id=None, resource_id=None, status=None):
   try:
-    configs = Config.query.all()
+    query = Config.query
+    if cursor != None:
+      query = query.filter(Config._id > cursor)
+    if tenant_id != None:
+      query = query.filter(Config.tenant_id == tenant_id)
+    if resource_id != None:
+      query = query.filter(Config.resource_id == resource_id)
+    if status != None:
+      query = query.filter(Config.status == status)
+    configs = query.order_by(Config._id).limit(limit + 1).all()
+    next_cursor = None
+    if len(configs) > limit:
+      configs = configs[:limit]
+      next_cursor = configs[-1]._id
     response = []
+    by_config = {}
     for config in configs:
       add_metrics = config.toString()
-      metrics = Metric.query.filter_by(config_id=config._id).all()
-      [add_metrics['metrics'].append(metric.toString()) for metric in metrics]
+      by_config[config._id] = add_metrics
       response.append(add_metrics)
-    return response
+    if by_config:
+      metrics = Metric.query.filter(Metric.config_id.in_(list(by_config.keys()))).all()
+      [by_config[metric.config_id]['metrics'].append(metric.toString()) for metric in metrics]
+    return response, next_cursor
   except Exception as e:
     print(e)
     return -1
 
 def delete_metric_queue(metric_id):
   global wait_queue
-  index = True
-  while(index):
-    index = False
-    for i in range(len(wait_queue.queue)):
-      if wait_queue.queue[i][4] == metric_id:
-        del wait_queue.queue[i]
-        index = True
-        break
-  return
+  global schedule_checkpoint
+  pending = schedule_checkpoint.deactivate(metric_id)
+  wait_queue.cancel(metric_id)
+  return pending
+
+# First aggregation bucket ending after `now`, buckets are aligned on timestamp_start
+def next_bucket(timestamp_start, step_aggregation, now):
+  sec_to_add = convert_to_seconds(step_aggregation)
+  elapsed = max((now - timestamp_start).total_seconds(), 0)
+  return timestamp_start + relativedelta(seconds=(int(elapsed // sec_to_add) + 1) * sec_to_add)
 
+# Metric rescheduled from now, its queued entries and pending in-memory schedule are dropped.
+# Returns the job to queue once committed (None if the config is disabled),
+# the metrics scheduled by other nodes are added to `moved`
+def restart_metric(row_m, row, now, moved):
+  global wait_queue
+  if leased_elsewhere(row_m):
+    moved.append(row_m._id)
+  schedule_checkpoint.deactivate(row_m._id)
+  wait_queue.cancel(row_m._id)
+  row_m.next_run_at = max(row.timestamp_start, now)
+  row_m.next_aggregation = None
+  if row_m.step_aggregation != None:
+    row_m.next_aggregation = next_bucket(row.timestamp_start, row_m.step_aggregation, row_m.next_run_at)
+  row_m.status = row.status
+  lease_metric(row_m)
+  if row.status == 1:
+    return metric_job(row_m, row)
+  return None
+
+# Metrics are matched by name: unchanged ones keep their id, schedule and values,
+# changed ones are updated in place and rescheduled from now, removed ones are deleted
 def update_config(config_id, config):
   global db_session
   global wait_queue
@@ -177,80 +332,147 @@ def update_config(config_id, config):
     if config.timestampEnd != None and row.timestamp_end != None and config.timestampEnd <= row.timestamp_end:
       return 2
       
-    row.updated_at = datetime.datetime.now()
+    now = datetime.datetime.now()
+    row.updated_at = now
     # Update config
+    extended = False
     if config.timestampEnd != None:
+      extended = row.timestamp_end != None and row.timestamp_end < now
       row.timestamp_end = config.timestampEnd
-    db_session.commit()
-    response = row.toString()
-    # Update metrics
-    # Delete old metrics
+      # Queued jobs share this record and see the new end
+      config_record(row._id, row.business_id, row.kafka_topic, row.network_id, row.tenant_id, row.resource_id, row.reference_id, row.timestamp_start, row.timestamp_end)
     metrics = Metric.query.filter_by(config_id=config_id).all()
-    for metric in metrics:
-      #drop_aggregate_view(metric._id, metric.aggregation_method)
-      delete_metric_queue(metric._id)
-      db_session.delete(metric)
-    
+    jobs = []
+    new_views = []
+    moved = []
     if config.metrics != None:
-      #Create new metrics
-      for metric in config.metrics:
-        aggregation = None
-        if metric.step_aggregation != None:
-          sec_to_add = convert_to_seconds(metric.step_aggregation)
-          aggregation = row.timestamp_start + relativedelta(seconds=sec_to_add)
-        row_m = Metric(metric.metricName, metric.metricType, metric.aggregationMethod, metric.step, metric.step_aggregation, row._id, row.timestamp_start, aggregation)
-        db_session.add(row_m)
-        db_session.commit()
-        response['metrics'].append(row_m.toString())
-        wait_queue.put((row_m.next_run_at, row.timestamp_start, row_m.step, row.timestamp_end, row_m._id, row_m.metric_name, row_m.metric_type, row_m.aggregation_method, row.business_id, row.kafka_topic, row.network_id, row.tenant_id, row.resource_id, row.reference_id, row_m.step_aggregation, row_m.next_aggregation, 0))
-      return response
-    return get_config(config_id)
+      current = dict((metric.metric_name, metric) for metric in metrics)
+      wanted = dict((metric.metricName, metric) for metric in config.metrics)
+      # Delete removed metrics
+      for name, metric in current.items():
+        if name in wanted:
+          continue
+        if metric.aggregation_method != None and AGGREGATION_BACKEND == 'timescaledb':
+          drop_aggregate_view(metric._id, metric.aggregation_method)
+        delete_metric_queue(metric._id)
+        aggregator.discard(metric._id)
+        if leased_elsewhere(metric):
+          moved.append(metric._id)
+        db_session.delete(metric)
+      metrics = []
+      for name, metric in wanted.items():
+        row_m = current.get(name)
+        if row_m == None:
+          #Create new metric
+          row_m = Metric(metric.metricName, metric.metricType, metric.aggregationMethod, metric.step, metric.step_aggregation, row._id, row.timestamp_start, None)
+          row_m._id = uuid.uuid4()
+          db_session.add(row_m)
+          jobs.append(restart_metric(row_m, row, now, moved))
+          if row_m.aggregation_method != None:
+            new_views.append(row_m)
+        elif (row_m.metric_type, row_m.aggregation_method, row_m.step, row_m.step_aggregation) != (metric.metricType, metric.aggregationMethod, metric.step, metric.step_aggregation):
+          # Update changed metric
+          if row_m.aggregation_method != metric.aggregationMethod or row_m.step_aggregation != metric.step_aggregation:
+            if row_m.aggregation_method != None and AGGREGATION_BACKEND == 'timescaledb':
+              drop_aggregate_view(row_m._id, row_m.aggregation_method)
+            if metric.aggregationMethod != None:
+              new_views.append(row_m)
+            aggregator.discard(row_m._id)
+          row_m.metric_type = metric.metricType
+          row_m.aggregation_method = metric.aggregationMethod
+          row_m.step = metric.step
+          row_m.step_aggregation = metric.step_aggregation
+          jobs.append(restart_metric(row_m, row, now, moved))
+        elif extended and row.status == 1:
+          # Ended with the previous timestamp end
+          jobs.append(restart_metric(row_m, row, now, moved))
+        metrics.append(row_m)
+    elif extended and row.status == 1:
+      for row_m in metrics:
+        jobs.append(restart_metric(row_m, row, now, moved))
+    db_session.flush()
+    # Built before the commit expires the rows
+    response = row.toString()
+    [response['metrics'].append(metric.toString()) for metric in metrics]
+    views = [(metric._id, metric.aggregation_method, metric.step_aggregation, row.timestamp_start) for metric in new_views]
+    # The nodes scheduling the moved metrics drop them, the others apply the new end
+    notify_nodes('drop', moved)
+    if config.timestampEnd != None:
+      notify_nodes('end', [row._id, config.timestampEnd.isoformat()])
+    db_session.commit()
+    jobs = [job for job in jobs if job != None]
+    for job in jobs:
+      schedule_checkpoint.activate(job.metric.metric_id)
+    wait_queue.put_many(jobs)
+    if config.timestampEnd != None and api_process:
+      # Records of the running metrics are held by the shard processes
+      wait_queue.update_config_end(row._id, config.timestampEnd)
+    if AGGREGATION_BACKEND == 'timescaledb':
+      for view in views:
+        create_aggregate_view(*view)
+    config_cache.invalidate(config_id)
+    return response
   except Exception as e:
+    db_session.rollback()
     print(e)
     return -1
 
-def update_next_run(metric_id):
-  global db_session
+# Scheduled job of a metric, pointing to the shared record of its config
+def metric_job(metric, config):
+  record = config_record(config._id, config.business_id, config.kafka_topic, config.network_id, config.tenant_id, config.resource_id, config.reference_id, config.timestamp_start, config.timestamp_end)
+  return ScheduledJob(metric.next_run_at, metric.next_aggregation, 0, MetricRecord(metric._id, metric.metric_name, metric.aggregation_method, metric.step, metric.step_aggregation, record))
+
+# Next tick computed from the queue item, the schedule lives in memory and is checkpointed in batches
+def update_next_run(item):
   global wait_queue
+  global schedule_checkpoint
   try:
-    metric = Metric.query.filter_by(_id=metric_id).first()
-    config = Config.query.filter_by(_id=metric.config_id).first()
+    metric = item.metric
+    if not schedule_checkpoint.is_active(metric.metric_id):
+      return 0
     sec_to_add = convert_to_seconds(metric.step)
-    old = metric.next_run_at
-    next = old + relativedelta(seconds=sec_to_add)
-    if config.timestamp_end != None and next > config.timestamp_end:
-      metric.status = 0
-      db_session.commit()
-    else:
-      metric.next_run_at = next
-      db_session.commit()
-      if metric.status == 1:
-        wait_queue.put((metric.next_run_at, config.timestamp_start, metric.step, config.timestamp_end, metric._id, metric.metric_name, metric.metric_type, metric.aggregation_method, config.business_id, config.kafka_topic, config.network_id, config.tenant_id, config.resource_id, config.reference_id, metric.step_aggregation, metric.next_aggregation, 0))
-        
+    next = item.next_run_at + relativedelta(seconds=sec_to_add)
+    next_aggregation = item.next_aggregation
     #Send aggregation
-    if next >= metric.next_aggregation:
-      update_aggregation(metric, config)
+    if next_aggregation != None and next >= next_aggregation:
+      next_aggregation = update_aggregation(item)
+    if metric.config.timestamp_end != None and next > metric.config.timestamp_end:
+      schedule_checkpoint.advance(metric.metric_id, item.next_run_at, next_aggregation, 0)
+    elif schedule_checkpoint.advance(metric.metric_id, next, next_aggregation, 1):
+      wait_queue.put(item.reschedule(next, next_aggregation))
     return 1
   except Exception as e:
     #print(e)
     return -1
 
-def update_aggregation(metric, config):
-  global db_session
+# Back to live scheduling after a catch-up, aggregation buckets with fetched samples are queued
+def resume_metric(item, next_run_at, fetched_from):
   global wait_queue
+  global schedule_checkpoint
   try:
-    # Send aggregation
-    wait_queue.put((metric.next_aggregation, config.timestamp_start, metric.step, config.timestamp_end, metric._id, metric.metric_name, metric.metric_type, metric.aggregation_method, config.business_id, config.kafka_topic, config.network_id, config.tenant_id, config.resource_id, config.reference_id, metric.step_aggregation, metric.next_aggregation, 1))
-    # Update next_aggregation
-    sec_to_add = convert_to_seconds(metric.step_aggregation)
-    next = metric.next_aggregation + relativedelta(seconds=sec_to_add)
-    metric.next_aggregation = next
-    db_session.commit()
+    metric = item.metric
+    next_aggregation = item.next_aggregation
+    while next_aggregation != None and next_run_at >= next_aggregation:
+      if next_aggregation > fetched_from:
+        wait_queue.put(ScheduledJob(next_aggregation, next_aggregation, 1, metric, item.generation))
+      next_aggregation = next_aggregation + relativedelta(seconds=convert_to_seconds(metric.step_aggregation))
+    if metric.config.timestamp_end != None and next_run_at > metric.config.timestamp_end:
+      schedule_checkpoint.advance(metric.metric_id, item.next_run_at, next_aggregation, 0)
+    elif schedule_checkpoint.advance(metric.metric_id, next_run_at, next_aggregation, 1):
+      wait_queue.put(item.reschedule(next_run_at, next_aggregation))
     return 1
   except Exception as e:
-    #print(e)
+    print(e)
     return -1
 
+def update_aggregation(item):
+  global wait_queue
+  # Send aggregation
+  wait_queue.put(item.aggregation_job())
+  # Next aggregation
+  sec_to_add = convert_to_seconds(item.metric.step_aggregation)
+  return item.next_aggregation + relativedelta(seconds=sec_to_add)
+
 def enable_config(config_id):
   global db_session
   global wait_queue
@@ -264,11 +486,15 @@ def enable_config(config_id):
     config.updated_at = datetime.datetime.now()
     add_metrics = config.toString()
     metrics = Metric.query.filter_by(config_id=config._id).all()
+    notify_nodes('drop', [metric._id for metric in metrics if leased_elsewhere(metric)])
     for metric in metrics:
       metric.status = 1
+      lease_metric(metric)
       db_session.commit()
       add_metrics['metrics'].append(metric.toString())
-      wait_queue.put((metric.next_run_at, config.timestamp_start, metric.step, config.timestamp_end, metric._id, metric.metric_name, metric.metric_type, metric.aggregation_method, config.business_id, config.kafka_topic, config.network_id, config.tenant_id, config.resource_id, config.reference_id, metric.step_aggregation, metric.next_aggregation, 0))
+      schedule_checkpoint.activate(metric._id)
+      wait_queue.put(metric_job(metric, config))
+    config_cache.invalidate(config_id)
     return add_metrics
   except Exception as e:
     print(e)
@@ -287,12 +513,19 @@ def disable_config(config_id):
     config.updated_at = datetime.datetime.now()
     add_metrics = config.toString()
     metrics = Metric.query.filter_by(config_id=config._id).all()
+    wait_queue.cancel_config(config._id)
     for metric in metrics:
       #drop_aggregate_view(metric._id, metric.aggregation_method)
+      # Last in-memory schedule of the metric, the checkpoint skips disabled metrics
+      pending = schedule_checkpoint.deactivate(metric._id)
+      if pending != None:
+        metric.next_run_at, metric.next_aggregation = pending[0], pending[1]
       metric.status = 0
       add_metrics['metrics'].append(metric.toString())
-      delete_metric_queue(metric._id)
+      aggregator.discard(metric._id)
+    notify_nodes('drop', [metric._id for metric in metrics if leased_elsewhere(metric)])
     db_session.commit()
+    config_cache.invalidate(config_id)
     return add_metrics
   except Exception as e:
     print(e)
@@ -306,66 +539,112 @@ def delete_config(config_id):
     if config == None:
       return 0
     metrics = Metric.query.filter_by(config_id=config._id).all()
+    wait_queue.cancel_config(config._id)
 
     for metric in metrics:
-      #drop_aggregate_view(metric._id, metric.aggregation_method)
-      delete_metric_queue(metric._id)
+      if metric.aggregation_method != None and AGGREGATION_BACKEND == 'timescaledb':
+        drop_aggregate_view(metric._id, metric.aggregation_method)
+      schedule_checkpoint.deactivate(metric._id)
+      aggregator.discard(metric._id)
       db_session.delete(metric)
-      
+    notify_nodes('drop', [metric._id for metric in metrics if leased_elsewhere(metric)])
+
     db_session.delete(config)
     db_session.commit()
+    config_cache.invalidate(config_id)
     return 1
   except Exception as e:
     print(e)
     return -1
 
-def load_database_metrics():
+# Metrics more than one step behind are returned for the range catch-up instead of being queued
+# Lease mode: only the metrics of metric_ids, claimed by this node
+def load_database_metrics(catch_up=False, metric_ids=None):
   global db_session
   global wait_queue
+  stale = []
   try:
+    claimed = ""
+    if metric_ids != None:
+      claimed = "AND metric._id IN (" + ",".join("'" + str(metric_id) + "'" for metric_id in metric_ids) + ") "
     result = db_session.execute("SELECT next_run_at, metric_name, metric_type, aggregation_method, step, business_id, kafka_topic, network_id, " \
                                        "tenant_id, resource_id, reference_id, timestamp_start, timestamp_end, metric._id, step_aggregation, " \
-                                       "next_aggregation " \
+                                       "next_aggregation, config._id AS config_id " \
                                 "FROM metric join config on metric.config_id = config._id " \
-                                "WHERE metric.status = 1;")
+                                "WHERE metric.status = 1 " + claimed + ";")
+    now = datetime.datetime.now()
     for row in result:
-      wait_queue.put((row['next_run_at'], row['timestamp_start'], row['step'], row['timestamp_end'], row['_id'], row['metric_name'], row['metric_type'], row['aggregation_method'], row['business_id'], row['kafka_topic'], row['network_id'], row['tenant_id'], row['resource_id'], row['reference_id'], row['step_aggregation'], row['next_aggregation'], 0))
-    return 1
+      # Owned by another shard process
+      if shard_ring != None and shard_ring.owner(row['_id']) != MDA_SHARD_INDEX:
+        continue
+      schedule_checkpoint.activate(row['_id'])
+      record = config_record(row['config_id'], row['business_id'], row['kafka_topic'], row['network_id'], row['tenant_id'], row['resource_id'], row['reference_id'], row['timestamp_start'], row['timestamp_end'])
+      item = ScheduledJob(row['next_run_at'], row['next_aggregation'], 0, MetricRecord(row['_id'], row['metric_name'], row['aggregation_method'], row['step'], row['step_aggregation'], record))
+      if catch_up and item.next_run_at + relativedelta(seconds=convert_to_seconds(item.metric.step)) <= now:
+        stale.append(item)
+      else:
+        wait_queue.put(item)
+    return stale
   except Exception as e:
     print(e)
-    return -1
+    return stale
 
 def insert_metric_value(metric_id, metric_value, timestamp):
-  global db_session
+  global value_writer
   try:
-    row = Value(timestamp, metric_id, metric_value)
-    db_session.add(row)
-    db_session.commit()
+    value_writer.add(metric_id, metric_value, timestamp)
     return 1
   except Exception as e:
     print(e)
     return -1
 
-def create_aggregate_view(metric_id, aggregation_method, step_aggregation):
-  global db_session
-  db_session.execute("CREATE VIEW \"agg_"+str(metric_id)+"_"+aggregation_method+"\" " \
-                     "WITH (timescaledb.continuous) AS " \
-                     "SELECT time_bucket(\'"+step_aggregation+"\', timestamp) AS bucket, "+aggregation_method+"(metric_value) AS aggregation " \
-                     "FROM value " \
-                     "WHERE metric_id = '"+str(metric_id)+"' " \
-                     "GROUP BY bucket;")
-  db_session.commit()
-  return
+def aggregate_view_name(metric_id, aggregation_method):
+  return "agg_"+str(metric_id)+"_"+aggregation_method.lower()
+
+# Continuous aggregate of one metric, buckets aligned with its timestamp_start
+def create_aggregate_view(metric_id, aggregation_method, step_aggregation, timestamp_start):
+  view = aggregate_view_name(metric_id, aggregation_method)
+  try:
+    # Continuous aggregates can not be created inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+      conn.execute("CREATE MATERIALIZED VIEW IF NOT EXISTS \""+view+"\" " \
+                   "WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS " \
+                   "SELECT time_bucket(interval '"+step_aggregation+"', timestamp, origin => '"+str(timestamp_start)+"'::timestamp) AS bucket, " \
+                          +aggregation_method+"(metric_value) AS aggregation " \
+                   "FROM value " \
+                   "WHERE metric_id = '"+str(metric_id)+"' " \
+                   "GROUP BY bucket WITH NO DATA;")
+      conn.execute("SELECT add_continuous_aggregate_policy('\""+view+"\"', start_offset => NULL, " \
+                   "end_offset => interval '"+step_aggregation+"', schedule_interval => interval '"+step_aggregation+"', if_not_exists => TRUE);")
+    return 1
+  except Exception as e:
+    print(e)
+    return -1
 
 def drop_aggregate_view(metric_id, aggregation_method):
-  db_session.execute("DROP VIEW IF EXISTS \"agg_"+str(metric_id)+"_"+aggregation_method+"\" CASCADE;")
-  db_session.commit()
-  return
+  try:
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+      conn.execute("DROP MATERIALIZED VIEW IF EXISTS \""+aggregate_view_name(metric_id, aggregation_method)+"\" CASCADE;")
+    return 1
+  except Exception as e:
+    print(e)
+    return -1
 
 def get_last_aggregation(metric_id, aggregation_method, bucket, step_aggregation):
   global db_session
-  #result = db_session.execute("REFRESH VIEW \"agg_"+str(metric_id)+"_"+aggregation_method+"\";" \
-  #                            "SELECT * FROM \""+str(metric_id)+"_"+aggregation_method+"\" LIMIT 1;").fetchone()
+  # Buffered values of the bucket must be written first
+  value_writer.flush()
+  if AGGREGATION_BACKEND == 'timescaledb':
+    try:
+      # Real-time continuous aggregate: materialized buckets plus the latest raw values
+      result = db_session.execute("SELECT aggregation FROM \""+aggregate_view_name(metric_id, aggregation_method)+"\" " \
+                                  "WHERE bucket = ('"+str(bucket)+"'::timestamp - interval '"+str(step_aggregation)+"');").fetchone()
+      if result == None:
+        return 0 if aggregation_method.upper() == 'COUNT' else None
+      return result[0]
+    except Exception as e:
+      # Metrics created before TimescaleDB was enabled have no view
+      db_session.rollback()
   result = db_session.execute("SELECT "+aggregation_method+"(metric_value) " \
                               "FROM value " \
                               "WHERE metric_id = '"+str(metric_id)+"' and timestamp < '"+str(bucket)+"'::timestamp " \
@@ -374,65 +653,216 @@ def get_last_aggregation(metric_id, aggregation_method, bucket, step_aggregation
 
 def create_index():
   global db_session
-  #db_session.execute("CREATE EXTENSION IF NOT EXISTS timescaledb CASCADE;" \
-  #                   "CREATE INDEX value_index ON value (timestamp ASC, metric_id);" \
-  #                   "SELECT create_hypertable('value', 'timestamp', if_not_exists => TRUE);")
   db_session.execute("CREATE INDEX value_index ON value (timestamp ASC, metric_id);")
   db_session.commit()
   return
 
-def drop_all_views():
+# Indexes of the settings listing (startup migration for existing deployments)
+def create_settings_index():
   global db_session
-  result = db_session.execute("SELECT 'DROP VIEW \"' || table_name || '\" CASCADE;' " \
-                              "FROM information_schema.views " \
-                              "WHERE table_schema NOT IN ('pg_catalog', 'information_schema') AND " \
-                                    "table_name !~ '^pg_' AND table_name LIKE 'agg_%';")
-  for row in result:
-    try:
-      db_session.execute(row[0])
-    except Exception:
-      pass
+  try:
+    db_session.execute("CREATE INDEX IF NOT EXISTS metric_config_index ON metric (config_id);")
+    db_session.execute("CREATE INDEX IF NOT EXISTS config_tenant_index ON config (tenant_id, resource_id);")
+    db_session.execute("CREATE INDEX IF NOT EXISTS metric_owner_index ON metric (owner);")
+    db_session.commit()
+  except Exception as e:
+    db_session.rollback()
+    print(e)
+  return
+
+# Lease columns of the metric table (startup migration for existing deployments)
+def migrate_metric_leases():
+  global db_session
+  try:
+    db_session.execute("ALTER TABLE IF EXISTS metric ADD COLUMN IF NOT EXISTS owner varchar(256), " \
+                                                    "ADD COLUMN IF NOT EXISTS lease_expires_at timestamp;")
+    db_session.commit()
+  except Exception as e:
+    db_session.rollback()
+    print(e)
+  return
+
+# Value table as a hypertable, chunks of VALUE_PARTITION_INTERVAL
+def create_hypertable():
+  global db_session
+  global AGGREGATION_BACKEND
+  try:
+    db_session.execute("SELECT create_hypertable('value', 'timestamp', chunk_time_interval => interval '"+VALUE_PARTITION_INTERVAL+"', " \
+                       "if_not_exists => TRUE, migrate_data => TRUE);")
+    db_session.commit()
+    return 1
+  except Exception as e:
+    # e.g. value table already partitioned by a plain Postgres deployment
+    db_session.rollback()
+    print(e)
+    print('TimescaleDB hypertable not available, aggregating with plain Postgres.')
+    AGGREGATION_BACKEND = 'postgres'
+    return -1
+
+def partition_bounds(timestamp):
+  seconds = convert_to_seconds(VALUE_PARTITION_INTERVAL)
+  epoch = datetime.datetime(1970, 1, 1)
+  start = epoch + datetime.timedelta(seconds=(int((timestamp - epoch).total_seconds()) // seconds) * seconds)
+  return start, start + datetime.timedelta(seconds=seconds)
+
+def create_value_partition(timestamp):
+  global db_session
+  start, end = partition_bounds(timestamp)
+  db_session.execute("CREATE TABLE IF NOT EXISTS \"value_p"+start.strftime("%Y%m%d%H%M%S")+"\" " \
+                     "PARTITION OF value FOR VALUES FROM ('"+str(start)+"') TO ('"+str(end)+"');")
   db_session.commit()
+  return end
+
+def get_value_partitions():
+  global db_session
+  result = db_session.execute("SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) " \
+                              "FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid " \
+                              "WHERE pg_inherits.inhparent = 'value'::regclass;")
+  partitions = []
+  for row in result:
+    bounds = re.findall(r"'([^']+)'", row[1])
+    if len(bounds) == 2:
+      partitions.append((row[0], datetime.datetime.fromisoformat(bounds[0]), datetime.datetime.fromisoformat(bounds[1])))
+  return partitions
+
+# Oldest raw sample still needed by a pending aggregation bucket
+def get_oldest_pending_sample():
+  oldest = None
+  metrics = Metric.query.filter(Metric.status == 1, Metric.aggregation_method != None, Metric.next_aggregation != None).all()
+  for metric in metrics:
+    bucket_start = metric.next_aggregation - datetime.timedelta(seconds=convert_to_seconds(metric.step_aggregation))
+    if oldest == None or bucket_start < oldest:
+      oldest = bucket_start
+  return oldest
+
+# Create the partitions ahead of time and drop the expired ones
+def maintain_value_partitions():
+  global db_session
+  try:
+    now = datetime.datetime.now()
+    cutoff = now - datetime.timedelta(seconds=convert_to_seconds(VALUE_RETENTION))
+    oldest = get_oldest_pending_sample()
+    if oldest != None and oldest < cutoff:
+      cutoff = oldest
+    if AGGREGATION_BACKEND == 'timescaledb':
+      # Chunks are created by TimescaleDB itself
+      db_session.execute("SELECT drop_chunks('value', older_than => '"+str(cutoff)+"'::timestamp);")
+      db_session.commit()
+      return 1
+    db_session.execute("CREATE TABLE IF NOT EXISTS value_default PARTITION OF value DEFAULT;")
+    db_session.commit()
+    end = now - datetime.timedelta(seconds=convert_to_seconds(VALUE_RETENTION))
+    while end <= now + datetime.timedelta(seconds=convert_to_seconds(VALUE_PARTITION_INTERVAL) * VALUE_PARTITIONS_AHEAD):
+      end = create_value_partition(end)
+    for name, start, end in get_value_partitions():
+      if end <= cutoff:
+        db_session.execute("DROP TABLE IF EXISTS \""+name+"\";")
+    db_session.execute("DELETE FROM value_default WHERE timestamp < '"+str(cutoff)+"'::timestamp;")
+    db_session.commit()
+    return 1
+  except Exception as e:
+    db_session.rollback()
+    print(e)
+    return -1
+
+# Migration of a plain value table (older deployments) to the partitioned one
+def migrate_value_table():
+  global db_session
+  try:
+    relkind = db_session.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('value');").scalar()
+    if relkind != 'r':
+      return 0
+    db_session.execute("ALTER TABLE value RENAME TO value_legacy;")
+    db_session.execute("ALTER INDEX IF EXISTS value_pkey RENAME TO value_legacy_pkey;")
+    db_session.execute("ALTER INDEX IF EXISTS value_index RENAME TO value_legacy_index;")
+    db_session.commit()
+    Value.__table__.create(bind=engine)
+    create_index()
+    maintain_value_partitions()
+    bounds = db_session.execute("SELECT MIN(timestamp), MAX(timestamp) FROM value_legacy;").fetchone()
+    if bounds[0] != None:
+      start = bounds[0]
+      while start <= bounds[1]:
+        start = create_value_partition(start)
+    db_session.execute("INSERT INTO value SELECT timestamp, metric_id, metric_value FROM value_legacy;")
+    db_session.execute("DROP TABLE value_legacy;")
+    db_session.commit()
+    return 1
+  except Exception as e:
+    db_session.rollback()
+    print(e)
+    return -1
+
+def drop_all_views():
+  try:
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+      result = conn.execute("SELECT view_name FROM timescaledb_information.continuous_aggregates " \
+                            "WHERE view_name LIKE 'agg_%';").fetchall()
+      for row in result:
+        try:
+          conn.execute("DROP MATERIALIZED VIEW IF EXISTS \""+row[0]+"\" CASCADE;")
+        except Exception:
+          pass
+  except Exception as e:
+    print(e)
   return
 
 def close_connection():
   global db_session
+  schedule_checkpoint.close()
+  value_writer.close()
   db_session.remove()
+  api_engine.dispose()
   return
   
 def reload_connection():
   global db_session
   db_session.remove()
-  db_session = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
+  db_session = scoped_session(session_factory)
   return
 
 # ----------------------------------------------------------------#
-# Reset db if env flag is True
-if RESET_DB.lower() == 'true':
-  try:
+# Schema setup and migrations run once, in the API (or single) process
+if MDA_SHARD_INDEX == None:
+  # Reset db if env flag is True
+  if RESET_DB.lower() == 'true':
     try:
+      try:
+        db_session.commit()
+        if AGGREGATION_BACKEND == 'timescaledb':
+          drop_all_views()
+        Base.metadata.drop_all(bind=engine)
+      except Exception as e:
+        print(e)
+      Base.metadata.create_all(bind=engine)
       db_session.commit()
-      #drop_all_views()
-      Base.metadata.drop_all(bind=engine)
+      create_index()
     except Exception as e:
       print(e)
-    Base.metadata.create_all(bind=engine)
-    db_session.commit()
-    create_index()
-  except Exception as e:
-    print(e)
-    sys.exit(0)
-
-# Create db if not exists
-try:
-  resp1 = Config.query.first()
-  resp2 = Metric.query.first()
-  resp2 = Value.query.first()
-except Exception as e:
+      sys.exit(0)
+
+
+  migrate_metric_leases()
+
+  # Create db if not exists
   try:
-    Base.metadata.create_all(bind=engine)
-    db_session.commit()
-    create_index()
+    resp1 = Config.query.first()
+    resp2 = Metric.query.first()
+    resp2 = Value.query.first()
   except Exception as e:
-    print(e)
-    sys.exit(0)
\ No newline at end of file
+    try:
+      Base.metadata.create_all(bind=engine)
+      db_session.commit()
+      create_index()
+    except Exception as e:
+      print(e)
+      sys.exit(0)
+
+  create_settings_index()
+
+  # Hypertable or partitioned value table (startup migration for existing deployments)
+  if AGGREGATION_BACKEND == 'timescaledb':
+    create_hypertable()
+  if AGGREGATION_BACKEND != 'timescaledb':
+    migrate_value_table()
+  maintain_value_partitions()
\ No newline at end of file
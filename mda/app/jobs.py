@@ -0,0 +1,70 @@
+import threading, weakref
+
+# One record per config, shared by every scheduled metric of the config
+class ConfigRecord(object):
+  __slots__ = ('config_id', 'business_id', 'kafka_topic', 'network_id', 'tenant_id', 'resource_id', 'reference_id',
+               'timestamp_start', 'timestamp_end', '__weakref__')
+
+  def __init__(self, config_id):
+    self.config_id = config_id
+
+# One record per metric, shared by its fetch and aggregation jobs
+class MetricRecord(object):
+  __slots__ = ('metric_id', 'metric_name', 'aggregation_method', 'step', 'step_aggregation', 'config')
+
+  def __init__(self, metric_id, metric_name, aggregation_method, step, step_aggregation, config):
+    self.metric_id = metric_id
+    self.metric_name = metric_name
+    self.aggregation_method = aggregation_method
+    self.step = step
+    self.step_aggregation = step_aggregation
+    self.config = config
+
+# Wait queue entry, ordered by next_run_at (aggregation is 1 for an aggregation job).
+# The generation is set by the wait queue, follow-up jobs keep it so that they are
+# dropped if the metric was cancelled while the job was running.
+class ScheduledJob(object):
+  __slots__ = ('next_run_at', 'next_aggregation', 'aggregation', 'metric', 'generation')
+
+  def __init__(self, next_run_at, next_aggregation, aggregation, metric, generation=None):
+    self.next_run_at = next_run_at
+    self.next_aggregation = next_aggregation
+    self.aggregation = aggregation
+    self.metric = metric
+    self.generation = generation
+
+  def __lt__(self, other):
+    return self.next_run_at < other.next_run_at
+
+  def reschedule(self, next_run_at, next_aggregation):
+    return ScheduledJob(next_run_at, next_aggregation, 0, self.metric, self.generation)
+
+  def aggregation_job(self):
+    return ScheduledJob(self.next_aggregation, self.next_aggregation, 1, self.metric, self.generation)
+
+# Shared config records, dropped with the last job pointing to them
+config_records = weakref.WeakValueDictionary()
+config_records_lock = threading.Lock()
+
+def config_record(config_id, business_id, kafka_topic, network_id, tenant_id, resource_id, reference_id, timestamp_start, timestamp_end):
+  with config_records_lock:
+    record = config_records.get(config_id)
+    if record == None:
+      record = ConfigRecord(config_id)
+      config_records[config_id] = record
+  # Updated in place, every job of the config sees the new values
+  record.business_id = business_id
+  record.kafka_topic = kafka_topic
+  record.network_id = network_id
+  record.tenant_id = tenant_id
+  record.resource_id = resource_id
+  record.reference_id = reference_id
+  record.timestamp_start = timestamp_start
+  record.timestamp_end = timestamp_end
+  return record
+
+# Timestamp end changed elsewhere (another node in lease mode), applied if the config is scheduled here
+def update_config_end(config_id, timestamp_end):
+  record = config_records.get(config_id)
+  if record != None:
+    record.timestamp_end = timestamp_end
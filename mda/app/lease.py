@@ -0,0 +1,220 @@
+import datetime, math, select, threading, time, uuid
+
+create_nodes = "CREATE TABLE IF NOT EXISTS mda_node (node_id varchar(256) PRIMARY KEY, heartbeat_at timestamp NOT NULL);"
+heartbeat = "INSERT INTO mda_node (node_id, heartbeat_at) VALUES (%s, now()) " \
+            "ON CONFLICT (node_id) DO UPDATE SET heartbeat_at = now();"
+count_nodes = "SELECT count(*) FROM mda_node WHERE heartbeat_at > now() - %s * interval '1 second';"
+count_metrics = "SELECT count(*) FROM metric WHERE status = 1;"
+# Disabled or deleted metrics are not renewed, the node owning them stops scheduling them
+renew_leases = "UPDATE metric SET lease_expires_at = now() + %s * interval '1 second' FROM config " \
+               "WHERE metric.config_id = config._id AND metric.owner = %s AND metric.status = 1 " \
+               "RETURNING metric._id, config._id, config.timestamp_end;"
+# Free or expired leases, the most overdue metrics first, rows claimed by another node are skipped
+claim_leases = "UPDATE metric SET owner = %s, lease_expires_at = now() + %s * interval '1 second' WHERE _id IN (" \
+               "SELECT _id FROM metric WHERE status = 1 AND (owner IS NULL OR lease_expires_at IS NULL OR lease_expires_at < now()) " \
+               "ORDER BY next_run_at LIMIT %s FOR UPDATE SKIP LOCKED) RETURNING _id;"
+release_leases = "UPDATE metric SET owner = NULL, lease_expires_at = NULL WHERE owner = %s AND _id = ANY(%s::uuid[]);"
+leave = "DELETE FROM mda_node WHERE node_id = %s;"
+# Changes made by a node to metrics leased by others, sent with the change (delivered on commit):
+# drop:<node>:<metric ids> metrics restarted, disabled or deleted, end:<node>:<config id>,<timestamp end>
+channel = 'mda_leases'
+listen = "LISTEN " + channel + ";"
+
+# Ownership of metrics shared by several nodes through expiring leases on the metric rows.
+# Each cycle the node heartbeats, renews its leases, and claims or releases metrics
+# to converge to its fair share (active metrics / live nodes).
+# Released metrics are stopped one cycle before their lease is given back, so the
+# ticks in flight are checkpointed before another node loads the schedule.
+# A node unable to renew stops every metric `margin` seconds before its leases can expire
+# (fenced), the leases still held once a renewal succeeds are loaded again.
+class LeaseManager(object):
+  def __init__(self, engine, node_id, ttl=30, interval=10.0, batch_size=500, margin=5.0,
+               on_claim=None, on_stop=None, on_release=None, on_lost=None, on_renew=None, on_end=None):
+    self.engine = engine
+    self.node_id = node_id
+    self.ttl = ttl
+    self.interval = interval
+    self.margin = margin
+    self.batch_size = batch_size
+    self.on_claim = on_claim
+    self.on_stop = on_stop
+    self.on_release = on_release
+    self.on_lost = on_lost
+    self.on_renew = on_renew
+    self.on_end = on_end
+    self.owned = set()
+    self.releasing = set()
+    self.nodes = 1
+    self.stopped = threading.Event()
+    self.lock = threading.Lock()
+    self.thread = None
+    self.listener = None
+    # Start (monotonic) of the last cycle whose renewal committed, the leases expire ttl seconds later at the earliest
+    self.renewed_at = None
+    self.fenced = False
+    self.fence_lock = threading.Lock()
+    self.watchdog = None
+
+  def start(self):
+    conn = self.engine.raw_connection()
+    try:
+      conn.cursor().execute(create_nodes)
+      conn.commit()
+    finally:
+      conn.close()
+    self.thread = threading.Thread(target=self.run, name='mda-lease')
+    self.thread.setDaemon(True)
+    self.thread.start()
+    self.listener = threading.Thread(target=self.listen, name='mda-lease-listener')
+    self.listener.setDaemon(True)
+    self.listener.start()
+    self.watchdog = threading.Thread(target=self.watch, name='mda-lease-watchdog')
+    self.watchdog.setDaemon(True)
+    self.watchdog.start()
+
+  def run(self):
+    while not self.stopped.is_set():
+      try:
+        self.cycle()
+      except Exception as e:
+        print('lease_manager-> ' + str(e))
+      self.stopped.wait(self.interval)
+
+  # Out of the cycle lock, a cycle stalled on the database still lets the node fence itself
+  def watch(self):
+    while not self.stopped.wait(min(1.0, self.interval)):
+      self.check()
+
+  def check(self):
+    with self.fence_lock:
+      if self.fenced or self.renewed_at == None or time.monotonic() - self.renewed_at < self.ttl - self.margin:
+        return
+      self.fenced = True
+    # Ownership is kept until the next successful renewal, only the scheduling stops
+    owned = list(self.owned)
+    print('lease_manager-> leases not renewed for ' + str(self.ttl - self.margin) + 's, ' + str(len(owned)) + ' metrics stopped')
+    if owned:
+      self.on_lost(owned)
+
+  # Connection of its own, out of the pool, waiting for the changes of the other nodes
+  def listen(self):
+    while not self.stopped.is_set():
+      conn = None
+      try:
+        conn = self.engine.raw_connection()
+        conn.detach()
+        conn.connection.autocommit = True
+        conn.cursor().execute(listen)
+        while not self.stopped.is_set():
+          if select.select([conn.connection], [], [], 1.0)[0]:
+            conn.connection.poll()
+            while conn.connection.notifies:
+              self.received(conn.connection.notifies.pop(0).payload)
+      except Exception as e:
+        print('lease_manager-> ' + str(e))
+        self.stopped.wait(self.interval)
+      finally:
+        if conn != None:
+          conn.close()
+
+  def received(self, payload):
+    action, node_id, arguments = payload.split(':', 2)
+    if node_id == self.node_id:
+      return
+    if action == 'drop':
+      self.drop([uuid.UUID(metric_id) for metric_id in arguments.split(',')])
+    elif action == 'end' and self.on_end != None:
+      config_id, timestamp_end = arguments.split(',')
+      self.on_end(uuid.UUID(config_id), datetime.datetime.fromisoformat(timestamp_end))
+
+  # Metrics restarted (now leased to the sender), disabled or deleted by another node
+  def drop(self, metric_ids):
+    with self.lock:
+      dropped = [metric_id for metric_id in metric_ids if metric_id in self.owned]
+      self.owned.difference_update(dropped)
+      self.releasing.difference_update(dropped)
+    if dropped:
+      self.on_lost(dropped)
+
+  def cycle(self):
+    with self.lock:
+      started = time.monotonic()
+      conn = self.engine.raw_connection()
+      try:
+        cursor = conn.cursor()
+        cursor.execute(heartbeat, (self.node_id,))
+        # Metrics stopped in the previous cycle, their last schedule is written before the lease is given back
+        if self.releasing:
+          released = list(self.releasing)
+          self.on_release(released)
+          cursor.execute(release_leases, (self.node_id, released))
+          self.owned.difference_update(released)
+          self.releasing = set()
+        cursor.execute(renew_leases, (self.ttl, self.node_id))
+        rows = cursor.fetchall()
+        cursor.execute(count_nodes, (self.ttl,))
+        self.nodes = max(1, cursor.fetchone()[0])
+        cursor.execute(count_metrics)
+        total = cursor.fetchone()[0]
+        conn.commit()
+        renewed = set(row[0] for row in rows)
+        with self.fence_lock:
+          fenced = self.fenced
+          self.fenced = False
+          self.renewed_at = started
+        lost = self.owned - renewed
+        self.owned = renewed
+        if fenced:
+          # Stopped by the fence: the leases not taken over meanwhile are loaded again
+          if renewed:
+            self.on_claim(list(renewed))
+        elif lost:
+          self.on_lost(list(lost))
+        self.on_renew(rows)
+        target = int(math.ceil(total / float(self.nodes)))
+        if len(self.owned) < target:
+          cursor.execute(claim_leases, (self.node_id, self.ttl, min(self.batch_size, target - len(self.owned))))
+          claimed = [row[0] for row in cursor.fetchall()]
+          conn.commit()
+          if claimed:
+            self.owned.update(claimed)
+            self.on_claim(claimed)
+        elif len(self.owned) > target:
+          # Over the fair share (a node joined): stop the excess now, release it next cycle
+          self.releasing = set(list(self.owned)[:len(self.owned) - target])
+          self.on_stop(list(self.releasing))
+      except Exception:
+        conn.rollback()
+        raise
+      finally:
+        conn.close()
+
+  # Every lease given back, the other nodes take the metrics over at their next cycle
+  def close(self):
+    self.stopped.set()
+    if self.thread != None:
+      self.thread.join()
+    if self.listener != None:
+      self.listener.join()
+    if self.watchdog != None:
+      self.watchdog.join()
+    with self.lock:
+      owned = list(self.owned)
+      self.on_stop(owned)
+      self.on_release(owned)
+      conn = self.engine.raw_connection()
+      try:
+        cursor = conn.cursor()
+        if owned:
+          cursor.execute(release_leases, (self.node_id, owned))
+        cursor.execute(leave, (self.node_id,))
+        conn.commit()
+      except Exception as e:
+        conn.rollback()
+        print('lease_manager-> ' + str(e))
+      finally:
+        conn.close()
+      self.owned = set()
+
+  def stats(self):
+    return {'node': self.node_id, 'nodes': self.nodes, 'owned': len(self.owned), 'releasing': len(self.releasing), 'fenced': self.fenced}
@@ -0,0 +1,74 @@
+import datetime, json, logging, logging.handlers, os, queue, random
+
+# One JSON object per line, extra fields of the record (status, event) included
+class JsonFormatter(logging.Formatter):
+  def format(self, record):
+    entry = {
+      "timestamp": datetime.datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+      "level": record.levelname,
+      "logger": record.name,
+      "status": getattr(record, 'status', None),
+      "event": getattr(record, 'event', None),
+      "message": record.getMessage()
+    }
+    if record.exc_info:
+      entry["exception"] = self.formatException(record.exc_info)
+    return json.dumps(entry, default=str)
+
+# Records handed to the writer thread, dropped (and counted) instead of blocking when it falls behind
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+  def __init__(self, log_queue):
+    logging.handlers.QueueHandler.__init__(self, log_queue)
+    self.dropped = 0
+
+  def enqueue(self, record):
+    try:
+      self.queue.put_nowait(record)
+    except queue.Full:
+      self.dropped += 1
+
+  # The JSON is built by the writer thread, only the arguments are merged here
+  def prepare(self, record):
+    record.msg = record.getMessage()
+    record.args = None
+    return record
+
+class LogListener(logging.handlers.QueueListener):
+  # Waits for room in a full queue, every record queued before stop() is written
+  def enqueue_sentinel(self):
+    self.queue.put(self._sentinel)
+
+# Non-blocking pipeline: loggers -> bounded queue -> listener thread -> size-rotated JSON file
+def setup_logging(path, level='INFO', max_bytes=104857600, backups=5, queue_size=10000):
+  folder = os.path.dirname(path)
+  if folder != '' and not os.path.exists(folder):
+    os.makedirs(folder)
+  file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+  file_handler.setFormatter(JsonFormatter())
+  log_queue = queue.Queue(queue_size)
+  handler = DroppingQueueHandler(log_queue)
+  root = logging.getLogger()
+  for old in list(root.handlers):
+    root.removeHandler(old)
+  root.addHandler(handler)
+  root.setLevel(level.upper())
+  listener = LogListener(log_queue, file_handler, respect_handler_level=True)
+  listener.start()
+  return handler, listener
+
+# Per-event sampling rates, e.g. "fetch=0.01,publish=0.1" (events not listed are always logged)
+def parse_sampling(value):
+  rates = {}
+  for item in value.split(','):
+    if '=' in item:
+      event, rate = item.split('=', 1)
+      rates[event.strip()] = float(rate)
+  return rates
+
+class EventSampler(object):
+  def __init__(self, rates):
+    self.rates = rates
+
+  def sampled(self, event):
+    rate = self.rates.get(event)
+    return rate == None or rate >= 1 or random.random() < rate
@@ -1,13 +1,14 @@
-from fastapi import FastAPI, Response
+from fastapi import FastAPI, Request, Response
 from starlette.status import HTTP_204_NO_CONTENT
-import uuid, random, requests, json, hashlib, os, rsa, sys, datetime, trace, time, logging
+import uuid, random, requests, requests.adapters, asyncio, functools, json, math, hashlib, os, rsa, sys, datetime, trace, time, logging, socket
 from threading import Thread
-from queue import PriorityQueue
+from queue import Queue
 from Crypto.PublicKey import RSA
 from pydantic import BaseModel
 from typing import Optional, List
 from kafka import KafkaProducer
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from sqlalchemy import *
 from sqlalchemy import create_engine
 from sqlalchemy_utils import database_exists, create_database
@@ -17,11 +18,23 @@ import sqlalchemy.dialects.postgresql as postgresql
 import psycopg2
 import psycopg2.extras
 from dateutil.relativedelta import relativedelta
-from timeloop import Timeloop
-from datetime import timedelta
-logging.basicConfig(filename='logs/'+'mda.json', level=logging.INFO, format='{ "timestamp": "%(asctime)s.%(msecs)03dZ", %(message)s}', datefmt='%Y-%m-%dT%H:%M:%S')
-logging.getLogger("uvicorn.error").setLevel(logging.CRITICAL)
-logging.getLogger("kafka").setLevel(logging.CRITICAL)
+from .scheduler import Scheduler, SchedulerQueue
+from .async_engine import AsyncEngine
+from .producer import KafkaPublisher, MemoryTransport
+from .signing import RecordSigner, BatchSigner
+from .aggregation import RunningAggregate, StreamingAggregator
+from .writer import ValueWriter
+from .checkpoint import ScheduleCheckpoint
+from .jobs import ScheduledJob, MetricRecord, config_record, update_config_end
+from .cache import ConfigCache
+from .shards import ShardRing, ShardRouter
+from .lease import LeaseManager
+from .profiling import Tracer, sample_stacks
+from .logger import setup_logging, parse_sampling, EventSampler
+from .telemetry import wait_queue_depth, metrics_queue_depth, workers, log_records_dropped, dispatch_lag, aggregation_seconds, metrics_payload, merged_payload
+from .telemetry import osm_circuit_open, osm_replay_depth, osm_replay_dropped, osm_replayed, values_buffered, values_dropped, db_commit_seconds
+from .osm_client import OSMClient, OSMError, CircuitBreaker, ReplayBuffer
+from concurrent.futures import ThreadPoolExecutor
 
 # Environment variables 
 try:
@@ -34,11 +47,118 @@ try:
   KAFKA_HOST = os.environ["KAFKA_HOST"]
   KAFKA_PORT = os.environ["KAFKA_PORT"]
   
-  #publicKeyOperator = os.environ["OPERATOR_PUBLIC_KEY"]
 except Exception as e:
   print("Environment variable does not exists.")
   sys.exit(0)
 
+# Optional: 'threads' (default) or 'asyncio'
+EXECUTION_ENGINE = os.environ.get("EXECUTION_ENGINE", "threads").lower()
+OSM_ENDPOINT = os.environ.get("OSM_ENDPOINT", "http://osm:4500/monitoringData")
+OSM_CONCURRENCY = int(os.environ.get("OSM_CONCURRENCY", "100"))
+OSM_TIMEOUT = float(os.environ.get("OSM_TIMEOUT", "10"))
+# Time budget of a tick fetch (retries included), jittered retries and a hedged second request
+# sent after OSM_HEDGE_AFTER_MS without an answer (0 disables hedging)
+OSM_DEADLINE = float(os.environ.get("OSM_DEADLINE") or OSM_TIMEOUT)
+OSM_RETRIES = int(os.environ.get("OSM_RETRIES", "2"))
+OSM_RETRY_BACKOFF_MS = int(os.environ.get("OSM_RETRY_BACKOFF_MS", "100"))
+OSM_HEDGE_AFTER_MS = int(os.environ.get("OSM_HEDGE_AFTER_MS", "0"))
+# Circuit opened after OSM_BREAKER_THRESHOLD consecutive failures, probed again after OSM_BREAKER_RESET seconds
+OSM_BREAKER_THRESHOLD = int(os.environ.get("OSM_BREAKER_THRESHOLD", "5"))
+OSM_BREAKER_RESET = float(os.environ.get("OSM_BREAKER_RESET", "30"))
+# Failed ticks fetched again every OSM_REPLAY_INTERVAL seconds, while less than CATCHUP_MAX_WINDOW old
+OSM_REPLAY_SIZE = int(os.environ.get("OSM_REPLAY_SIZE", "100000"))
+OSM_REPLAY_INTERVAL = float(os.environ.get("OSM_REPLAY_INTERVAL", "5"))
+
+# Optional: 'kafka' (default) or 'memory' (in-process stand-in broker)
+KAFKA_TRANSPORT = os.environ.get("KAFKA_TRANSPORT", "kafka").lower()
+KAFKA_LINGER_MS = int(os.environ.get("KAFKA_LINGER_MS", "5"))
+KAFKA_BATCH_SIZE = int(os.environ.get("KAFKA_BATCH_SIZE", "16384"))
+KAFKA_COMPRESSION = os.environ.get("KAFKA_COMPRESSION") or None
+
+# Operator keypair (PEM content or file path), created once if the private key file does not exist
+OPERATOR_PRIVATE_KEY = os.environ.get("OPERATOR_PRIVATE_KEY") or "keys/operator_private.pem"
+OPERATOR_PUBLIC_KEY = os.environ.get("OPERATOR_PUBLIC_KEY") or "keys/operator_public.pem"
+SIGNING_PROCESSES = int(os.environ.get("SIGNING_PROCESSES", "0"))
+# Optional: 'record' (default, one signature per record) or 'batch' (one signature per Merkle root)
+SIGNING_MODE = os.environ.get("SIGNING_MODE", "record").lower()
+SIGNING_BATCH_WINDOW_MS = int(os.environ.get("SIGNING_BATCH_WINDOW_MS", "200"))
+SIGNING_BATCH_SIZE = int(os.environ.get("SIGNING_BATCH_SIZE", "1024"))
+
+# Optional: 'postgres' (default, SQL over the value table), 'memory' (streaming window state),
+# 'timescaledb' (continuous aggregates) or 'auto' (TimescaleDB when the extension is available)
+AGGREGATION_BACKEND = os.environ.get("AGGREGATION_BACKEND", "postgres").lower()
+PERSIST_RAW_VALUES = os.environ.get("PERSIST_RAW_VALUES", "true").lower() == 'true'
+
+# Write-behind buffer of raw values
+VALUE_BUFFER_ROWS = int(os.environ.get("VALUE_BUFFER_ROWS", "50000"))
+VALUE_FLUSH_ROWS = int(os.environ.get("VALUE_FLUSH_ROWS", "1000"))
+VALUE_FLUSH_INTERVAL = float(os.environ.get("VALUE_FLUSH_INTERVAL", "1"))
+
+# Time-partitioned value table and retention of raw values
+VALUE_PARTITION_INTERVAL = os.environ.get("VALUE_PARTITION_INTERVAL", "1d")
+VALUE_PARTITIONS_AHEAD = int(os.environ.get("VALUE_PARTITIONS_AHEAD", "2"))
+VALUE_RETENTION = os.environ.get("VALUE_RETENTION", "7d")
+VALUE_MAINTENANCE_INTERVAL = int(os.environ.get("VALUE_MAINTENANCE_INTERVAL", "3600"))
+
+# Seconds between batched writes of the in-memory schedule (a restart replays at most this much)
+CHECKPOINT_INTERVAL = float(os.environ.get("CHECKPOINT_INTERVAL", "5"))
+
+# Range catch-up of the ticks missed during a downtime, at most CATCHUP_MAX_WINDOW back
+CATCHUP_ENABLED = os.environ.get("CATCHUP_ENABLED", "true").lower() == 'true'
+CATCHUP_MAX_WINDOW = os.environ.get("CATCHUP_MAX_WINDOW", "1h")
+
+# REST API database calls run on their own threads and connection pool, off the event loop
+API_THREADS = int(os.environ.get("API_THREADS", "8"))
+API_POOL_SIZE = int(os.environ.get("API_POOL_SIZE") or API_THREADS)
+# Serialized GET /settings/{config_id} responses kept in memory
+CONFIG_CACHE_SIZE = int(os.environ.get("CONFIG_CACHE_SIZE", "10000"))
+
+# Per-stage timing spans and sampled traces, can also be toggled at runtime on /admin/tracing
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "false").lower() == 'true'
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", "1000"))
+
+# Multi-process mode: metrics partitioned over MDA_SHARDS scheduler processes, the API process routes config changes
+MDA_SHARDS = int(os.environ.get("MDA_SHARDS", "1"))
+# Set by the API process in the environment of each shard process
+MDA_SHARD_INDEX = int(os.environ["MDA_SHARD_INDEX"]) if os.environ.get("MDA_SHARD_INDEX") else None
+api_process = MDA_SHARDS > 1 and MDA_SHARD_INDEX == None
+
+# Optional: 'single' (default, every active metric scheduled by this node) or 'lease'
+# (several nodes on one database, each scheduling the metrics it holds an expiring lease on)
+CLUSTER_MODE = os.environ.get("CLUSTER_MODE", "single").lower()
+NODE_ID = os.environ.get("NODE_ID") or socket.gethostname() + '-' + str(os.getpid())
+LEASE_TTL = int(os.environ.get("LEASE_TTL", "30"))
+LEASE_RENEW_INTERVAL = float(os.environ.get("LEASE_RENEW_INTERVAL", "10"))
+LEASE_BATCH_SIZE = int(os.environ.get("LEASE_BATCH_SIZE", "500"))
+# Seconds before the leases can expire at which a node unable to renew stops scheduling
+LEASE_FENCE_MARGIN = float(os.environ.get("LEASE_FENCE_MARGIN", str(min(5.0, LEASE_TTL / 3.0))))
+if CLUSTER_MODE == 'lease' and LEASE_TTL - LEASE_FENCE_MARGIN <= LEASE_RENEW_INTERVAL:
+  print("LEASE_TTL minus LEASE_FENCE_MARGIN must be longer than LEASE_RENEW_INTERVAL.")
+  sys.exit(0)
+if CLUSTER_MODE == 'lease' and MDA_SHARDS > 1:
+  print("CLUSTER_MODE=lease runs one scheduler process per node, MDA_SHARDS must be 1.")
+  sys.exit(0)
+
+# JSON log file written by a background thread, rotated by size
+LOG_FILE = os.environ.get("LOG_FILE") or "logs/mda.json"
+if MDA_SHARD_INDEX != None:
+  # One file per process, rotated independently
+  LOG_FILE = os.path.splitext(LOG_FILE)[0] + '-shard' + str(MDA_SHARD_INDEX) + os.path.splitext(LOG_FILE)[1]
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", "104857600"))
+LOG_BACKUPS = int(os.environ.get("LOG_BACKUPS", "5"))
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+# Share of the per-tick events written (fetch, publish, send), payloads are never written unless enabled
+LOG_SAMPLING = os.environ.get("LOG_SAMPLING", "fetch=0.01,publish=0.01,send=0.01")
+LOG_PAYLOADS = os.environ.get("LOG_PAYLOADS", "false").lower() == 'true'
+
+log_handler, log_listener = setup_logging(LOG_FILE, level=LOG_LEVEL, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS, queue_size=LOG_QUEUE_SIZE)
+logging.getLogger("uvicorn.error").setLevel(logging.CRITICAL)
+logging.getLogger("kafka").setLevel(logging.CRITICAL)
+logger = logging.getLogger('mda')
+log_sampler = EventSampler(parse_sampling(LOG_SAMPLING))
+
 class Metric_Model(BaseModel):
   metricName: str
   metricType: str
@@ -99,56 +219,141 @@ agg_options = ['SUM', 'AVG', 'MIN', 'MAX', 'COUNT', 'STDDEV']
 step_options = ['s', 'm', 'h', 'd', 'w']
 
 
-wait_queue = PriorityQueue()
-metrics_queue = PriorityQueue()
+if api_process:
+  wait_queue = ShardRouter(MDA_SHARDS)
+else:
+  wait_queue = SchedulerQueue()
+# Metrics owned by this shard process
+shard_ring = ShardRing(MDA_SHARDS) if MDA_SHARD_INDEX != None else None
+metrics_queue = Queue()
 num_fetch_threads = 20
-first_metric_aux = None
-update_queue_flag = False
+osm_endpoint = OSM_ENDPOINT
+osm_batch_size = 50
+# Configs per page of GET /settings (pages of the streamed full list, upper bound of `limit`)
+settings_page_size = 100
+settings_max_page_size = 1000
+settings_max_batch_size = 1000
+scheduler = None
+aggregator = StreamingAggregator()
+async_engine = None
+publish_executor = None
+# With shards or leases the schedule shown in the responses is checkpointed, and the
+# configs changed, by other processes
+config_cache = ConfigCache(max_entries=CONFIG_CACHE_SIZE, ttl=CHECKPOINT_INTERVAL if api_process or CLUSTER_MODE == 'lease' else None)
+tracer = Tracer(enabled=TRACING_ENABLED, sample_rate=TRACE_SAMPLE_RATE, max_traces=TRACE_BUFFER_SIZE)
+# Longest sampling profiler run of /admin/profile
+max_profile_seconds = 60
+api_executor = ThreadPoolExecutor(max_workers=API_THREADS, thread_name_prefix='mda-api')
+lease_manager = None
+# Replies of a shard process to the requests of the API process
+shard_replies = None
+
+# Keep-alive connections shared by the worker threads (and their hedged requests).
+# OSM requests are sent by the fetch workers, the catch-up and the replay; with hedging
+# the first request and its hedge both run on the executor, two workers per caller
+osm_callers = num_fetch_threads + 2
+osm_session = requests.Session()
+osm_session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=osm_callers * (2 if OSM_HEDGE_AFTER_MS > 0 else 1)))
+osm_client = OSMClient(osm_endpoint, osm_session, timeout=OSM_TIMEOUT, deadline=OSM_DEADLINE, retries=OSM_RETRIES, backoff=OSM_RETRY_BACKOFF_MS / 1000.0,
+                       hedge_after=OSM_HEDGE_AFTER_MS / 1000.0 if OSM_HEDGE_AFTER_MS > 0 else None,
+                       breaker=CircuitBreaker(threshold=OSM_BREAKER_THRESHOLD, reset_timeout=OSM_BREAKER_RESET), hedge_workers=2 * osm_callers)
+osm_replay = ReplayBuffer(max_entries=OSM_REPLAY_SIZE)
 
 from .database import *
 
-def info_log(status, message):
-	logging.critical('"status": "'+str(status)+'", "message": "'+message+'"')
-
-# Update first metric to read
-def update_first_metric_aux():
-  global wait_queue
-  if wait_queue.empty():
-    return None
-  aux = wait_queue.get()
-  wait_queue.put(aux)
-  return aux[0]
-  
+# Events without a status (per-tick fetch and send events, OSM payloads) are logged at INFO,
+# their volume is set by LOG_SAMPLING and LOG_PAYLOADS
+log_levels = {200: logging.INFO, 400: logging.ERROR}
+
+# Checked before building the message of a per-tick event
+def log_enabled(status, event=None):
+  return logger.isEnabledFor(log_levels.get(status, logging.INFO)) and (event == None or log_sampler.sampled(event))
+
+def info_log(status, message, event=None):
+  if log_enabled(status, event):
+    logger.log(log_levels.get(status, logging.INFO), message, extra={'status': status, 'event': event})
+
+def kafka_delivery_failed(exception):
+  info_log(400, 'Erro in kafka delivery: ' + str(exception))
+
+# Operator key loaded once, signing optionally in a process pool
+if not OPERATOR_PRIVATE_KEY.lstrip().startswith('-----BEGIN') and not os.path.exists(OPERATOR_PRIVATE_KEY):
+  info_log(200, 'No operator key at ' + os.path.abspath(OPERATOR_PRIVATE_KEY) + ', a new keypair is created')
+signer = RecordSigner(OPERATOR_PRIVATE_KEY, OPERATOR_PUBLIC_KEY, processes=SIGNING_PROCESSES)
+
+# Shared producer, connected on first use or app startup
+publisher = KafkaPublisher(MemoryTransport if KAFKA_TRANSPORT == 'memory' else KafkaProducer,
+                           on_error=kafka_delivery_failed,
+                           bootstrap_servers=[KAFKA_HOST+':'+KAFKA_PORT],
+                           value_serializer=lambda x: json.dumps(x).encode('utf-8'),
+                           api_version=(0,10,1),
+                           linger_ms=KAFKA_LINGER_MS,
+                           batch_size=KAFKA_BATCH_SIZE,
+                           compression_type=KAFKA_COMPRESSION)
+
+# Records of a topic published within the window share one signed Merkle root
+batch_signer = None
+if SIGNING_MODE == 'batch':
+  batch_signer = BatchSigner(signer, publisher.send, window=SIGNING_BATCH_WINDOW_MS / 1000.0, max_batch=SIGNING_BATCH_SIZE)
+
 def send_kafka(data, dataHash, kafka_topic):
   try:
-    payload_encoded = {k: str(v).encode('utf-8') for k, v in dataHash.items()}
-    hashData = {k: hashlib.sha256(v).hexdigest() for k,v in payload_encoded.items()}
-    #info_log(None, f'Raw Data: {data} \nHashed Data: {hashData}')
-  
-    public_key, private_key = rsa.newkeys(1024)
-  
-    dataHashEncrypt = {rsa.encrypt(k.encode(), private_key): rsa.encrypt(v.encode(), private_key) for k,v in hashData.items()}
-    #info_log(None, f'Signup Data: {dataHashEncrypt}')
-  
-    producer = KafkaProducer(bootstrap_servers=[KAFKA_HOST+':'+KAFKA_PORT], value_serializer=lambda x: json.dumps(x).encode('utf-8'), api_version=(0,10,1))
-    producer.send(kafka_topic, key=list(dataHashEncrypt.values())[0],  value=data)
-    info_log(200, f'Post metric {data["monitoringData"]["metricName"]}, from operator {data["operatorID"]}, into DL Kafka Topic {kafka_topic} [Post Time: {data["monitoringData"]["timestamp"]}]')
+    if batch_signer != None:
+      # Signed and published with the rest of the window
+      with tracer.span('batch_sign'):
+        batch_signer.add(kafka_topic, dataHash, data)
+    else:
+      # Sign the SHA-256 digest of the record with the operator key
+      with tracer.span('sign'):
+        digest, signature = signer.sign(dataHash)
+      #info_log(None, f'Raw Data: {data} \nHashed Data: {digest.hex()}')
+    
+      with tracer.span('kafka_send'):
+        publisher.send(kafka_topic, key=signature,  value=data)
+    if log_enabled(200, 'publish'):
+      logger.info(f'Post metric {data["monitoringData"]["metricName"]}, from operator {data["operatorID"]}, into DL Kafka Topic {kafka_topic} [Post Time: {data["monitoringData"]["timestamp"]}]', extra={'status': 200, 'event': 'publish'})
     return 1
   except Exception as e:
     info_log(400, 'Erro in request_orchestrator: ' + str(e))
     return 0
   
-def send_aggregation(metric_name, resourceID, referenceID, next_run_at, tenantID, businessID, networkID, kafka_topic, aggregation, metric_id, next_aggregation, step_aggregation):
+# Raw sample of an aggregated metric: streaming window state and/or value table
+def store_metric_value(metric_id, metric_value, timestamp, timestamp_start, step_aggregation):
+  if AGGREGATION_BACKEND == 'memory' and step_aggregation != None:
+    aggregator.add(metric_id, float(metric_value), timestamp, timestamp_start, convert_to_seconds(step_aggregation))
+    if not PERSIST_RAW_VALUES:
+      return 1
+  with tracer.span('insert_metric_value'):
+    return insert_metric_value(metric_id, metric_value, timestamp)
+
+def compute_aggregation(metric_id, aggregation, bucket, step_aggregation):
+  with aggregation_seconds.labels(AGGREGATION_BACKEND).time(), tracer.span('compute_aggregation'):
+    return aggregate(metric_id, aggregation, bucket, step_aggregation)
+
+def aggregate(metric_id, aggregation, bucket, step_aggregation):
+  if AGGREGATION_BACKEND == 'memory':
+    state = aggregator.pop(metric_id, bucket, keep=datetime.timedelta(seconds=convert_to_seconds(CATCHUP_MAX_WINDOW)))
+    # Buckets started before a restart are only complete in the database
+    if state != None or not PERSIST_RAW_VALUES:
+      return (state or RunningAggregate()).result(aggregation)
+  with tracer.span('get_last_aggregation'):
+    return get_last_aggregation(metric_id, aggregation, bucket, step_aggregation)
+
+def send_aggregation(metric, config, next_aggregation):
+  with tracer.span('send_aggregation'):
+    return aggregation_publish(metric, config, next_aggregation)
+
+def aggregation_publish(metric, config, next_aggregation):
   try:
-    value = get_last_aggregation(metric_id, aggregation, next_aggregation, step_aggregation)
+    value = compute_aggregation(metric.metric_id, metric.aggregation_method, next_aggregation, metric.step_aggregation)
     # Create JSON object that will be sent to DL Kafka Topic
     monitoringData = {
-      "metricName" : metric_name,
+      "metricName" : metric.metric_name,
       "metricValue" : value,
-      "resourceID" : resourceID,
-      "referenceID" : referenceID,
-      "timestamp" : str(next_run_at),
-      "aggregationMethod": aggregation
+      "resourceID" : config.resource_id,
+      "referenceID" : config.reference_id,
+      "timestamp" : str(next_aggregation),
+      "aggregationMethod": metric.aggregation_method
     }
     
     dataHash = {
@@ -156,89 +361,425 @@ def send_aggregation(metric_name, resourceID, referenceID, next_run_at, tenantID
     }
   
     data = {
-        "operatorID" : tenantID,
-        "businessID" : businessID,
-        "networkID" : networkID
+        "operatorID" : config.tenant_id,
+        "businessID" : config.business_id,
+        "networkID" : config.network_id
     }
     data["monitoringData"] = monitoringData
-    send_kafka(data, dataHash, kafka_topic)
-    print('SEND AGGREGATION-> '+str(next_run_at)+' -> '+ str(value))
+    send_kafka(data, dataHash, config.kafka_topic)
+    if log_enabled(None, 'send'):
+      logger.info('SEND AGGREGATION-> '+str(next_aggregation)+' -> '+ str(value), extra={'status': None, 'event': 'send'})
     return 1
   except Exception as e:
-    print('send_aggregation-> ' + str(e))
-    info_log(400, 'Erro in request_orchestrator: ' + str(e))
+    info_log(400, 'Erro in send_aggregation: ' + str(e))
     return 0
   
-def request_orchestrator(metric_name, resourceID, referenceID, next_run_at, tenantID, businessID, networkID, kafka_topic, aggregation, metric_id):
+def osm_request_params(metrics, next_run_at):
+  # One request for every metric of the batch: match=<metric1>&match=<metric2>&start=<ts>
+  request_params = [('match', metric.metric_name) for metric in metrics]
+  request_params.append(('start', str(next_run_at)))
+  return request_params
+
+# Ticks not fetched after the retries (or with the circuit open) are kept for a replay
+def request_orchestrator(metrics, config, next_run_at):
   try:
-    request_metric = "match="+metric_name+"&"
-    request_schedule = "start="+str(next_run_at) 
     # curl TBD to 'http://localhost:9090/api/v1/query=cpu_utilization&time=2015-07-01T20:10:51'
-    endpoint = 'http://osm:4500/monitoringData?'
-    request_url = endpoint + request_metric + request_schedule
-    response = requests.get(request_url)
-    if response.status_code != 200:
-      info_log(400, "Request to OSM not sucessful")
-      #print(f'Error: Request to OSM not successful')
-      return('Error in fetching data!', 200)
-    resp = response.text
-    json_data = json.loads(resp)
-    info_log(None, f'Response from OSM: {resp}')
-    
-    if aggregation != None:
-      #Save value in db
-      insert_metric_value(metric_id, json_data["data"]["result"][0]["values"][0][1], next_run_at)
-    else:
-      # Create JSON object that will be sent to DL Kafka Topic
-      monitoringData = {
-        "metricName" : json_data["data"]["result"][0]["metric"]["__name__"],
-        "metricValue" : json_data["data"]["result"][0]["values"][0][1],
-        "resourceID" : resourceID,
-        "referenceID" : referenceID,
-        "timestamp" : str(next_run_at)
-      }
-      
-      dataHash = {
-          "data" : monitoringData
-      }
-    
-      data = {
-          "operatorID" : tenantID,
-          "businessID" : businessID,
-          "networkID" : networkID
-      }
-      data["monitoringData"] = monitoringData
-      send_kafka(data, dataHash, kafka_topic)
-      print('SEND DATA-> '+str(next_run_at)+' -> '+ str(json_data["data"]["result"][0]["values"][0][1]))
+    with tracer.span('osm_request'):
+      response = osm_client.fetch(osm_request_params(metrics, next_run_at))
+    with tracer.span('publish_osm_response'):
+      publish_osm_response(response.text, metrics, config, next_run_at)
     return 1
+  except OSMError as e:
+    osm_fetch_failed(e, metrics, config, next_run_at)
+    return 0
   except Exception as e:
-    print('request_orchestrator-> ' + str(e))
     info_log(400, 'Erro in request_orchestrator: ' + str(e))
     return 0
 
+def osm_fetch_failed(e, metrics, config, next_run_at):
+  info_log(400, "Request to OSM not sucessful: " + str(e))
+  if e.replay:
+    osm_replay.add((metrics, config, next_run_at))
+
+# Failed ticks fetched again in order, the oldest first, until OSM fails again
+def replay_ticks():
+  while True:
+    time.sleep(OSM_REPLAY_INTERVAL)
+    earliest = datetime.datetime.now() - datetime.timedelta(seconds=convert_to_seconds(CATCHUP_MAX_WINDOW))
+    while True:
+      entry = osm_replay.pop()
+      if entry == None:
+        break
+      metrics, config, next_run_at = entry
+      # Deleted, disabled or released metrics are not replayed
+      metrics = [metric for metric in metrics if schedule_checkpoint.is_active(metric.metric_id)]
+      if not metrics:
+        osm_replay.done(entry)
+        continue
+      if next_run_at < earliest:
+        osm_replay.drop(entry)
+        continue
+      try:
+        response = osm_client.fetch(osm_request_params(metrics, next_run_at))
+      except OSMError as e:
+        if e.replay:
+          osm_replay.restore(entry)
+          break
+        osm_replay.done(entry)
+        info_log(400, "Replay of OSM request not sucessful: " + str(e))
+        continue
+      try:
+        publish_osm_response(response.text, metrics, config, next_run_at)
+        osm_replayed.inc()
+      except Exception as e:
+        info_log(400, 'Erro in replay_ticks: ' + str(e))
+      osm_replay.done(entry)
+
+# Buckets with ticks waiting for a replay are published after it, checked again every replay interval
+def aggregation_held(item):
+  if not osm_replay.pending(item.metric.metric_id, item.next_aggregation):
+    return False
+  wait_queue.put(ScheduledJob(datetime.datetime.now() + datetime.timedelta(seconds=OSM_REPLAY_INTERVAL), item.next_aggregation, 1, item.metric, item.generation))
+  scheduler.notify()
+  return True
+
+def publish_osm_response(resp, metrics, config, next_run_at):
+  with tracer.span('json_loads'):
+    json_data = json.loads(resp)
+  if LOG_PAYLOADS:
+    info_log(None, f'Response from OSM: {resp}', 'payload')
+  
+  # Fan out the returned series to each metric
+  values = {}
+  for result in json_data["data"]["result"]:
+    values[result["metric"]["__name__"]] = result["values"][0][1]
+  for metric in metrics:
+    if metric.metric_name not in values:
+      info_log(400, f'Metric {metric.metric_name} not found in OSM response')
+      continue
+    publish_metric_value(metric, values[metric.metric_name], config, next_run_at)
+
+def publish_metric_value(metric, value, config, next_run_at):
+  if metric.aggregation_method != None:
+    #Save value in db
+    store_metric_value(metric.metric_id, value, next_run_at, config.timestamp_start, metric.step_aggregation)
+  else:
+    # Create JSON object that will be sent to DL Kafka Topic
+    monitoringData = {
+      "metricName" : metric.metric_name,
+      "metricValue" : value,
+      "resourceID" : config.resource_id,
+      "referenceID" : config.reference_id,
+      "timestamp" : str(next_run_at)
+    }
+    
+    dataHash = {
+        "data" : monitoringData
+    }
+  
+    data = {
+        "operatorID" : config.tenant_id,
+        "businessID" : config.business_id,
+        "networkID" : config.network_id
+    }
+    data["monitoringData"] = monitoringData
+    send_kafka(data, dataHash, config.kafka_topic)
+    if log_enabled(None, 'send'):
+      logger.info('SEND DATA-> '+str(next_run_at)+' -> '+ str(value), extra={'status': None, 'event': 'send'})
+
+# Missed ticks after a downtime: one ranged OSM query per batch, the whole window published in bulk
+def catch_up_metrics(items):
+  now = datetime.datetime.now()
+  earliest = now - datetime.timedelta(seconds=convert_to_seconds(CATCHUP_MAX_WINDOW))
+  batches = {}
+  for item in items:
+    key = (item.next_run_at, item.metric.step, item.metric.config)
+    batches.setdefault(key, []).append(item)
+  for batch in batches.values():
+    for i in range(0, len(batch), osm_batch_size):
+      catch_up_batch(batch[i:i+osm_batch_size], now, earliest)
+  info_log(200, f'Catch-up of {len(items)} metrics finished')
+
+def catch_up_batch(batch, now, earliest):
+  next_item = batch[0]
+  config = next_item.metric.config
+  step = convert_to_seconds(next_item.metric.step)
+  start = next_item.next_run_at
+  if start < earliest:
+    # Ticks older than the backfill window are skipped
+    start = start + datetime.timedelta(seconds=math.ceil((earliest - start).total_seconds() / step) * step)
+  last = min(now, config.timestamp_end) if config.timestamp_end != None else now
+  end = start + datetime.timedelta(seconds=max(0, int((last - start).total_seconds() // step)) * step)
+  resume = start
+  if end > start:
+    metrics = [item.metric for item in batch]
+    request_params = osm_request_params(metrics, start)
+    request_params += [('end', str(end)), ('step', str(step)+'s')]
+    try:
+      response = osm_client.fetch(request_params)
+      json_data = json.loads(response.text)
+      series = {}
+      for result in json_data["data"]["result"]:
+        series[result["metric"]["__name__"]] = result["values"]
+      for metric in metrics:
+        for i, value in enumerate(series.get(metric.metric_name, [])):
+          publish_metric_value(metric, value[1], config, start + datetime.timedelta(seconds=i*step))
+      resume = end + datetime.timedelta(seconds=step)
+    except Exception as e:
+      # Live scheduling fetches the window tick by tick
+      info_log(400, 'Erro in catch_up: ' + str(e))
+      resume = start
+  for item in batch:
+    resume_metric(item, resume, start)
+
+def complete_batch(batch):
+  with tracer.span('update_next_run'):
+    for item in batch:
+      update_next_run(item)
+
+# Group due metrics sharing the same next_run_at and config into one OSM request
+def dispatch_metrics(items):
+  global metrics_queue
+  batches = {}
+  for item in items:
+    if item.aggregation == 1:
+      metrics_queue.put([item])
+      continue
+    key = (item.next_run_at, item.metric.config)
+    batch = batches.setdefault(key, [])
+    if len(batch) == osm_batch_size:
+      metrics_queue.put(batch)
+      batch = batches[key] = []
+    batch.append(item)
+  for batch in batches.values():
+    metrics_queue.put(batch)
+
 # Worker thread function
 def queue_consumer(i, q):
-  global update_queue_flag
   try:
     while True:
-      next_item = q.get()
-      info_log(None, f'Start Fetching Values of Metric: {next_item[5]} (Thread Associated: {i})')
-      
-      if next_item[16] == 1:
-        #Send aggregation
-        info_log(None, f'{datetime.datetime.now()} - UC1: Aggregating values from metric: {next_item[5]} (Step Aggregation Associated: {next_item[14]})')
-        send_aggregation(next_item[5], next_item[12], next_item[13], next_item[0], next_item[11], next_item[8], next_item[10], next_item[9], next_item[7], next_item[4], next_item[15], next_item[14])
-      else:
-        #Send metric
-        request_orchestrator(next_item[5], next_item[12], next_item[13], next_item[0], next_item[11], next_item[8], next_item[10], next_item[9], next_item[7], next_item[4])
-        info_log(None, f'{datetime.datetime.now()} - UC2: Fetching values from OSM, metric: {next_item[5]} (Step Associated: {next_item[2]}')
-        update_next_run(next_item[4])
+      batch = q.get()
+      workers.labels('busy').inc()
+      workers.labels('idle').dec()
+      next_item = batch[0]
+      dispatch_lag.observe((datetime.datetime.now() - next_item.next_run_at).total_seconds())
+      with tracer.trace('queue_consumer'):
+        fetch_logged = log_enabled(None, 'fetch')
+        if fetch_logged:
+          info_log(None, f'Start Fetching Values of Metrics: {[item.metric.metric_name for item in batch]} (Thread Associated: {i})')
+        
+        if next_item.aggregation == 1:
+          #Send aggregation
+          if fetch_logged:
+            info_log(None, f'UC1: Aggregating values from metric: {next_item.metric.metric_name} (Step Aggregation Associated: {next_item.metric.step_aggregation})')
+          if not aggregation_held(next_item):
+            send_aggregation(next_item.metric, next_item.metric.config, next_item.next_aggregation)
+        else:
+          #Send metrics
+          with tracer.span('request_orchestrator'):
+            request_orchestrator([item.metric for item in batch], next_item.metric.config, next_item.next_run_at)
+          if fetch_logged:
+            info_log(None, f'UC2: Fetching values from OSM, metrics: {[item.metric.metric_name for item in batch]}')
+          complete_batch(batch)
       
-      update_queue_flag = True
+      workers.labels('idle').inc()
+      workers.labels('busy').dec()
       q.task_done()
   except Exception as e:
     print(e)
    
+# Asyncio engine handler: non-blocking fetch, publish and database updates in the executor
+async def async_queue_consumer(engine, batch):
+  loop = asyncio.get_event_loop()
+  next_item = batch[0]
+  dispatch_lag.observe((datetime.datetime.now() - next_item.next_run_at).total_seconds())
+  if next_item.aggregation == 1:
+    #Send aggregation
+    if not aggregation_held(next_item):
+      await loop.run_in_executor(publish_executor, send_aggregation, next_item.metric, next_item.metric.config, next_item.next_aggregation)
+    return
+  #Send metrics
+  metrics = [item.metric for item in batch]
+  try:
+    try:
+      with tracer.span('osm_request'):
+        response = await osm_client.fetch_async(engine.fetch, osm_request_params(metrics, next_item.next_run_at))
+    except OSMError as e:
+      osm_fetch_failed(e, metrics, next_item.metric.config, next_item.next_run_at)
+    else:
+      await loop.run_in_executor(publish_executor, publish_osm_response, response.text, metrics, next_item.metric.config, next_item.next_run_at)
+  except Exception as e:
+    info_log(400, 'Erro in request_orchestrator: ' + str(e))
+  await loop.run_in_executor(publish_executor, complete_batch, batch)
+
+# Create upcoming value partitions and drop the expired ones
+def partition_maintenance():
+  while True:
+    time.sleep(VALUE_MAINTENANCE_INTERVAL)
+    maintain_value_partitions()
+
+# Lease mode: metrics claimed by this node, loaded from their checkpointed schedule
+def leases_claimed(metric_ids):
+  stale = load_database_metrics(catch_up=CATCHUP_ENABLED, metric_ids=metric_ids)
+  if stale:
+    catch_up = Thread(target=catch_up_metrics, args=(stale,))
+    catch_up.setDaemon(True)
+    catch_up.start()
+  scheduler.notify()
+  info_log(200, str(len(metric_ids)) + ' metric leases claimed')
+
+# Stopped one lease cycle before the release, the ticks in flight still advance the schedule
+def leases_stopping(metric_ids):
+  for metric_id in metric_ids:
+    wait_queue.cancel(metric_id)
+
+# Schedule and raw values written while the leases are still held, the next owner starts from them
+def leases_releasing(metric_ids):
+  value_writer.flush()
+  schedule_checkpoint.flush()
+  for metric_id in metric_ids:
+    schedule_checkpoint.deactivate(metric_id)
+    aggregator.discard(metric_id)
+  if metric_ids:
+    info_log(200, str(len(metric_ids)) + ' metric leases released')
+
+# Expired and taken over, or restarted, disabled or deleted by another node: the local schedule is dropped unwritten
+def leases_lost(metric_ids):
+  for metric_id in metric_ids:
+    schedule_checkpoint.deactivate(metric_id)
+    aggregator.discard(metric_id)
+    wait_queue.cancel(metric_id)
+  info_log(200, str(len(metric_ids)) + ' metric leases lost')
+
+# Timestamp end of the configs updated by another node
+def leases_renewed(rows):
+  for metric_id, config_id, timestamp_end in rows:
+    update_config_end(config_id, timestamp_end)
+
+# Queue operation routed to this shard process by the API process
+def apply_shard_command(action, argument):
+  if action == 'put' or action == 'reschedule':
+    items = argument if action == 'put' else [argument]
+    for item in items:
+      # Shared config record of this process, generation given by the local queue
+      config = item.metric.config
+      item.metric.config = config_record(config.config_id, config.business_id, config.kafka_topic, config.network_id, config.tenant_id, config.resource_id, config.reference_id, config.timestamp_start, config.timestamp_end)
+      item.generation = None
+      if action == 'reschedule':
+        wait_queue.cancel(item.metric.metric_id)
+      schedule_checkpoint.activate(item.metric.metric_id)
+    wait_queue.put_many(items)
+  elif action == 'config_end':
+    update_config_end(*argument)
+  elif action == 'request':
+    # Own thread, a profile does not hold the queue operations back
+    thread = Thread(target=answer_shard_request, args=argument)
+    thread.setDaemon(True)
+    thread.start()
+  elif action == 'cancel' or action == 'cancel_config':
+    metric_ids = [argument] if action == 'cancel' else wait_queue.metrics_of(argument)
+    for metric_id in metric_ids:
+      schedule_checkpoint.deactivate(metric_id)
+      aggregator.discard(metric_id)
+      wait_queue.cancel(metric_id)
+
+def answer_shard_request(request_id, action, argument):
+  result = None
+  try:
+    if action == 'metrics':
+      result = metrics_payload()[0].decode('utf-8')
+    elif action == 'traces':
+      result = tracer.stats()
+    elif action == 'tracing':
+      enabled, sample_rate, reset = argument
+      if reset:
+        tracer.reset()
+      tracer.configure(enabled, sample_rate)
+      result = True
+    elif action == 'profile':
+      result = sample_stacks(argument)
+  except Exception as e:
+    info_log(400, 'Erro in shard request: ' + str(e))
+  shard_replies.put((request_id, MDA_SHARD_INDEX, result))
+
+def apply_shard_commands(commands):
+  while True:
+    command = commands.get()
+    if command == None:
+      return
+    try:
+      apply_shard_command(*command)
+    except Exception as e:
+      info_log(400, 'Erro in shard command: ' + str(e))
+
+# Shard process: scheduling of the owned metrics until the API process stops it
+def run_shard(commands, replies):
+  global shard_replies
+  shard_replies = replies
+  loop = asyncio.new_event_loop()
+  asyncio.set_event_loop(loop)
+  loop.run_until_complete(startup_event())
+  loop.run_until_complete(loop.run_in_executor(None, apply_shard_commands, commands))
+  loop.run_until_complete(shutdown_event())
+
+# JSON array of every config matching the filters, one page in memory at a time
+async def stream_configs(page, filters):
+  configs, next_cursor = page
+  separator = ''
+  yield '['
+  while True:
+    for config in configs:
+      yield separator + json.dumps(jsonable_encoder(config))
+      separator = ','
+    if next_cursor == None:
+      break
+    page = await run_api(get_configs, settings_page_size, next_cursor, *filters)
+    if page == -1:
+      info_log(400, 'Error in get config in database, config list truncated.')
+      break
+    configs, next_cursor = page
+  yield ']'
+
+# REST calls writing to the database, timed with the checkpoint and value writes
+api_writes = (add_config, add_configs, update_config, enable_config, disable_config, delete_config)
+
+# Blocking database call of a REST handler, run on the API executor
+def api_call(function, *args):
+  try:
+    if function in api_writes:
+      with db_commit_seconds.labels('api').time():
+        return function(*args)
+    return function(*args)
+  finally:
+    # Connection back to the API pool
+    db_session.remove()
+
+async def run_api(function, *args):
+  loop = asyncio.get_event_loop()
+  return await loop.run_in_executor(api_executor, functools.partial(api_call, function, *args))
+
+# Positive number of seconds, minutes, hours, days or weeks ('30s', '5m'...)
+def valid_step(step):
+  try:
+    return step[-1] in step_options and convert_to_seconds(step) > 0
+  except Exception:
+    return False
+
+# Error message of an invalid config, None if valid (timestamp start defaults to now)
+def validate_config(config):
+  for metric in config.metrics:
+    if metric.aggregationMethod != None and metric.aggregationMethod.upper() not in agg_options:
+      return "Aggregation step options is "+str(agg_options)+"."
+    if not valid_step(metric.step) or (metric.step_aggregation != None and not valid_step(metric.step_aggregation)):
+      return "Step and step aggregation options is "+str(step_options)+"."
+  if config.timestampStart == None:
+    config.timestampStart = datetime.datetime.now()
+  elif config.timestampStart < datetime.datetime.now() - relativedelta(minutes=1):
+    return "Timestamp start need to be after current now."
+  if config.timestampEnd != None and config.timestampStart > config.timestampEnd:
+    return "Timestamp start need to be after timestamp end."
+  return None
+
 def validate_uuid4(uuid_string):
   try:
     uuid.UUID(uuid_string).hex
@@ -247,61 +788,113 @@ def validate_uuid4(uuid_string):
   return True
 # --------------------- START SCRIPT -----------------------------#
 # ----------------------------------------------------------------#
-# Load database metrics to wait queue
-load_database_metrics()
-
-# Update first metric to read
-first_metric_aux = update_first_metric_aux()
-
-# Set up threads to fetch the metrics
-for i in range(num_fetch_threads):
-	worker = Thread(target=queue_consumer, args=(i, metrics_queue,))
-	worker.setDaemon(True)
-	worker.start()
-
-# Check waiting metrics
-tl = Timeloop()
-logging.getLogger("timeloop").setLevel(logging.CRITICAL)
-@tl.job(interval=timedelta(seconds=1))
-def check_waiting_metrics():
-  global metrics_queue
-  global wait_queue
-  global update_queue_flag
-  global first_metric_aux
-  '''print('RUN TIMELOOP')
-  print('metrics_queue')
-  print(metrics_queue.queue)
-  print('wait_queue')
-  print(wait_queue.queue)
-  print('update_queue_flag')
-  print(update_queue_flag)
-  print('first_metric_aux')
-  print(first_metric_aux)
-  print('now')
-  print(str(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))'''
-  if update_queue_flag:
-    first_metric_aux = update_first_metric_aux()
-    update_queue_flag = False
-  if first_metric_aux != None and str(first_metric_aux) <= str(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")):
-    metrics_queue.put(wait_queue.get())
-    first_metric_aux = update_first_metric_aux()
-  return
-tl.start(block=False)
+if api_process:
+  # Metrics loaded and scheduled by the shard processes, spawned on app startup
+  scheduler = wait_queue
+elif CLUSTER_MODE == 'lease':
+  # Metrics loaded as their leases are claimed
+  scheduler = Scheduler(wait_queue, dispatch_metrics)
+  lease_manager = LeaseManager(engine, NODE_ID, ttl=LEASE_TTL, interval=LEASE_RENEW_INTERVAL, batch_size=LEASE_BATCH_SIZE, margin=LEASE_FENCE_MARGIN,
+                               on_claim=leases_claimed, on_stop=leases_stopping, on_release=leases_releasing,
+                               on_lost=leases_lost, on_renew=leases_renewed, on_end=update_config_end)
+  lease_manager.start()
+else:
+  # Load database metrics to wait queue
+  stale_metrics = load_database_metrics(catch_up=CATCHUP_ENABLED)
+  if stale_metrics:
+    catch_up = Thread(target=catch_up_metrics, args=(stale_metrics,))
+    catch_up.setDaemon(True)
+    catch_up.start()
+
+  # Dispatch every due metric as soon as its next_run_at is reached
+  scheduler = Scheduler(wait_queue, dispatch_metrics)
+
+if MDA_SHARD_INDEX == None:
+  maintenance = Thread(target=partition_maintenance)
+  maintenance.setDaemon(True)
+  maintenance.start()
+
+if not api_process:
+  replay = Thread(target=replay_ticks, name='mda-replay')
+  replay.setDaemon(True)
+  replay.start()
+
+wait_queue_depth.set_function(lambda: wait_queue.qsize())
+metrics_queue_depth.set_function(lambda: metrics_queue.qsize())
+log_records_dropped.set_function(lambda: log_handler.dropped)
+osm_circuit_open.set_function(lambda: 0 if osm_client.breaker.state == 'closed' else 1)
+osm_replay_depth.set_function(lambda: len(osm_replay))
+osm_replay_dropped.set_function(lambda: osm_replay.dropped)
+values_buffered.set_function(lambda: len(value_writer.rows))
+values_dropped.set_function(lambda: value_writer.dropped)
+
+if api_process:
+  pass
+elif EXECUTION_ENGINE == 'asyncio':
+  # Fetches run on the app event loop, started with it
+  async_engine = AsyncEngine(osm_endpoint, async_queue_consumer, concurrency=OSM_CONCURRENCY, timeout=OSM_TIMEOUT)
+  publish_executor = ThreadPoolExecutor(max_workers=num_fetch_threads, thread_name_prefix='mda-publish')
+  workers.labels('busy').set_function(lambda: len(async_engine.in_flight))
+  workers.labels('idle').set_function(lambda: OSM_CONCURRENCY - len(async_engine.in_flight))
+else:
+  workers.labels('idle').set(num_fetch_threads)
+  # Set up threads to fetch the metrics
+  for i in range(num_fetch_threads):
+    worker = Thread(target=queue_consumer, args=(i, metrics_queue,))
+    worker.setDaemon(True)
+    worker.start()
+  scheduler.start()
 
 # ----------------------- MAIN APP -------------------------------#
 # ----------------------------------------------------------------#
 
 app = FastAPI()
 
+@app.on_event("startup")
+async def startup_event():
+  global async_engine
+  global metrics_queue
+  global scheduler
+  if api_process:
+    # Spawn the shard processes
+    scheduler.start()
+    return
+  try:
+    publisher.start()
+  except Exception as e:
+    info_log(400, 'Erro in kafka producer: ' + str(e))
+  if async_engine != None:
+    await async_engine.start()
+    # Due batches go straight to the event loop
+    metrics_queue = async_engine
+    scheduler.start()
+  return
+
 @app.on_event("shutdown")
-def shutdown_event():
+async def shutdown_event():
   print('exit')
   global metrics_queue
-  global wait_queue
-  wait_queue.join()
-  metrics_queue.join()
+  global scheduler
+  scheduler.stop()
+  if async_engine != None:
+    await async_engine.stop()
+    publish_executor.shutdown()
+  else:
+    metrics_queue.join()
+  # Leases given back once the last ticks are checkpointed
+  if lease_manager != None:
+    lease_manager.close()
+  # Deliver every pending Kafka record
+  if batch_signer != None:
+    batch_signer.close()
+  publisher.close()
+  signer.close()
+  api_executor.shutdown()
+  osm_client.close()
   #Close connection db
   close_connection()
+  # Write the queued log records
+  log_listener.stop()
   return
 
 
@@ -315,42 +908,69 @@ def shutdown_event():
 														 "content": {"application/json": {
 																	 "example": {"status": "Error", "message": "Error message."}}}}})
 async def set_param(config: Config_Model):
-  global update_queue_flag
-  for metric in config.metrics:
-    if metric.aggregationMethod != None and metric.aggregationMethod.upper() not in agg_options:
-      return JSONResponse(status_code=404, content={"status": "Error", "message": "Aggregation step options is "+str(agg_options)+"."})
-    if metric.step_aggregation != None and metric.step_aggregation[-1] not in step_options and metric.step[-1] not in step_options:
-      return JSONResponse(status_code=404, content={"status": "Error", "message": "Step and step aggregation options is "+str(step_options)+"."})
-  if config.timestampStart == None:
-    config.timestampStart = datetime.datetime.now()
-  elif config.timestampStart < datetime.datetime.now() - relativedelta(minutes=1):
-    return JSONResponse(status_code=404, content={"status": "Error", "message": "Timestamp start need to be after current now."})
-  if config.timestampEnd != None and config.timestampStart > config.timestampEnd:
-    return JSONResponse(status_code=404, content={"status": "Error", "message": "Timestamp start need to be after timestamp end."})
+  message = validate_config(config)
+  if message != None:
+    return JSONResponse(status_code=404, content={"status": "Error", "message": message})
   # Save config in database
-  resp = add_config(config)
+  resp = await run_api(add_config, config)
   if resp == -1:
     return JSONResponse(status_code=404, content={"status": "Error", "message": "Error in create config in database."})
-  update_queue_flag = True
+  scheduler.notify()
   info_log(200, f'Monitoring spec successfully created by operator {config.tenantID}')
   return resp
 
+@app.post("/settings/batch", status_code=201, responses={201: {"content": {"application/json": {
+																	 "example": [{"status": "Success", "config": json_response_enable},
+																				 {"status": "Error", "message": "Error message."}]}}},
+														 404: {"model": Response_Error_Model,
+															   "content": {"application/json": {
+																		   "example": {"status": "Error", "message": "Error message."}}}}})
+async def set_params(configs: List[Config_Model]):
+  if len(configs) == 0 or len(configs) > settings_max_batch_size:
+    return JSONResponse(status_code=404, content={"status": "Error", "message": "Batch must contain between 1 and "+str(settings_max_batch_size)+" configs."})
+  # Per item results, the valid configs are saved in a single transaction
+  results = []
+  valid = []
+  for config in configs:
+    message = validate_config(config)
+    if message != None:
+      results.append({"status": "Error", "message": message})
+    else:
+      results.append(None)
+      valid.append(config)
+  if valid:
+    resp = await run_api(add_configs, valid)
+    if resp == -1:
+      return JSONResponse(status_code=404, content={"status": "Error", "message": "Error in create configs in database."})
+    created = iter(resp)
+    results = [result if result != None else {"status": "Success", "config": next(created)} for result in results]
+    scheduler.notify()
+    info_log(200, f'{len(valid)} monitoring specs successfully created in batch')
+  return results
+
 @app.get("/settings/{config_id}", responses={200: {"model": Response_Config_Model,
 												   "content": {"application/json": {
 															   "example": json_response_enable}}},
 											 404: {"model": Response_Error_Model,
 												   "content": {"application/json": {
 															   "example": {"status": "Error", "message": "Error message."}}}}})
-async def get_config_id(config_id):
+async def get_config_id(config_id, request: Request):
   # Get config by id
   if validate_uuid4(config_id) is False:
     return JSONResponse(status_code=404, content={"status": "Error", "message": "Config id invalid."})
-  resp = get_config(config_id)
-  if resp == 0:
-    return JSONResponse(status_code=404, content={"status": "Error", "message": "Config id invalid."})
-  if resp == -1:
-    return JSONResponse(status_code=404, content={"status": "Error", "message": "Error in get config in database."})
-  return resp
+  entry = config_cache.get(config_id)
+  if entry == None:
+    version = config_cache.version(config_id)
+    resp = await run_api(get_config, config_id)
+    if resp == 0:
+      return JSONResponse(status_code=404, content={"status": "Error", "message": "Config id invalid."})
+    if resp == -1:
+      return JSONResponse(status_code=404, content={"status": "Error", "message": "Error in get config in database."})
+    entry = config_cache.put(config_id, version, json.dumps(jsonable_encoder(resp)))
+  etag, body = entry
+  if request.headers.get('if-none-match') == etag:
+    return Response(status_code=304, headers={'ETag': etag})
+  return Response(content=body, media_type='application/json', headers={'ETag': etag})
 
 @app.get("/settings", responses={200: {"model": List[Response_Config_Model],
 									   "content": {"application/json": {
@@ -358,12 +978,24 @@ async def get_config_id(config_id):
 								 404: {"model": Response_Error_Model,
 									   "content": {"application/json": {
 												   "example": {"status": "Error", "message": "Error message."}}}}})
-async def get_all_configs():
+async def get_all_configs(limit: Optional[int] = None, cursor: Optional[str] = None, tenantID: Optional[str] = None, resourceID: Optional[str] = None, status: Optional[int] = None):
   # Get configs
-  resp = get_configs()
+  if cursor != None and validate_uuid4(cursor) is False:
+    return JSONResponse(status_code=404, content={"status": "Error", "message": "Cursor invalid."})
+  if limit != None and (limit < 1 or limit > settings_max_page_size):
+    return JSONResponse(status_code=404, content={"status": "Error", "message": "Limit must be between 1 and "+str(settings_max_page_size)+"."})
+  filters = (tenantID, resourceID, status)
+  resp = await run_api(get_configs, limit or settings_page_size, cursor, *filters)
   if resp == -1:
     return JSONResponse(status_code=404, content={"status": "Error", "message": "Error in get config in database."})
-  return resp
+  if limit == None:
+    # Whole list, streamed page by page
+    return StreamingResponse(stream_configs(resp, filters), media_type='application/json')
+  configs, next_cursor = resp
+  response = JSONResponse(content=jsonable_encoder(configs))
+  if next_cursor != None:
+    response.headers['X-Next-Cursor'] = str(next_cursor)
+  return response
 
 @app.put("/settings/{config_id}", responses={200: {"model": Response_Config_Model,
 												   "content": {"application/json": {
@@ -372,11 +1004,10 @@ async def get_all_configs():
 												   "content": {"application/json": {
 															   "example": {"status": "Error", "message": "Error message."}}}}})
 async def update_config_id(config_id, config: Update_Config_Model):
-  global update_queue_flag
   # Update config by id
   if validate_uuid4(config_id) is False:
     return JSONResponse(status_code=404, content={"status": "Error", "message": "Config id invalid."})
-  resp = update_config(config_id, config)
+  resp = await run_api(update_config, config_id, config)
   if resp == 0:
     return JSONResponse(status_code=404, content={"status": "Error", "message": "Config id invalid."})
   if resp == 1:
@@ -385,7 +1016,7 @@ async def update_config_id(config_id, config: Update_Config_Model):
     return JSONResponse(status_code=404, content={"status": "Error", "message": "Timestamp end must be superior to the actual."})
   if resp == -1:
     return JSONResponse(status_code=404, content={"status": "Error", "message": "Error in update config in database."})
-  update_queue_flag = True
+  scheduler.notify()
   info_log(200, f'Monitoring spec {config_id} successfully updated')
   return resp
 
@@ -396,18 +1027,17 @@ async def update_config_id(config_id, config: Update_Config_Model):
 														  "content": {"application/json": {
 																	  "example": {"status": "Error", "message": "Error message."}}}}})
 async def enable_config_id(config_id):
-  global update_queue_flag
   # Enable config by id
   if validate_uuid4(config_id) is False:
     return JSONResponse(status_code=404, content={"status": "Error", "message": "Config id invalid."})
-  resp = enable_config(config_id)
+  resp = await run_api(enable_config, config_id)
   if resp == 0:
     return JSONResponse(status_code=404, content={"status": "Error", "message": "Config id invalid."})
   if resp == 1:
     return JSONResponse(status_code=404, content={"status": "Error", "message": "Config already enabled."})
   if resp == -1:
     return JSONResponse(status_code=404, content={"status": "Error", "message": "Error in enable config in database."})
-  update_queue_flag = True
+  scheduler.notify()
   info_log(200, f'Monitoring spec {config_id} successfully enabled')
   return resp
 
@@ -418,18 +1048,17 @@ async def enable_config_id(config_id):
 														   "content": {"application/json": {
 																	   "example": {"status": "Error", "message": "Error message."}}}}})
 async def disable_config_id(config_id):
-  global update_queue_flag
   # Disable config by id
   if validate_uuid4(config_id) is False:
     return JSONResponse(status_code=404, content={"status": "Error", "message": "Config id invalid."})
-  resp = disable_config(config_id)
+  resp = await run_api(disable_config, config_id)
   if resp == 0:
     return JSONResponse(status_code=404, content={"status": "Error", "message": "Config id invalid."})
   if resp == 1:
     return JSONResponse(status_code=404, content={"status": "Error", "message": "Config already disabled."})
   if resp == -1:
     return JSONResponse(status_code=404, content={"status": "Error", "message": "Error in disable config in database."})
-  update_queue_flag = True
+  scheduler.notify()
   info_log(200, f'Monitoring spec {config_id} successfully disabled')
   return resp
 
@@ -437,15 +1066,72 @@ async def disable_config_id(config_id):
 													  "content": {"application/json": {
 																  "example": {"status": "Error", "message": "Error message."}}}}})
 async def delete_config_id(config_id):
-  global update_queue_flag
   # Get config by id
   if validate_uuid4(config_id) is False:
     return JSONResponse(status_code=404, content={"status": "Error", "message": "Config id invalid."})
-  resp = delete_config(config_id)
+  resp = await run_api(delete_config, config_id)
   if resp == 0:
     return JSONResponse(status_code=404, content={"status": "Error", "message": "Config id invalid."})
   if resp == -1:
     return JSONResponse(status_code=404, content={"status": "Error", "message": "Error in delete config in database."})
-  update_queue_flag = True
+  scheduler.notify()
   info_log(200, f'Monitoring spec {config_id} successfully deleted')
   return Response(status_code=HTTP_204_NO_CONTENT)
+
+@app.get("/stats/cache")
+async def get_cache_stats():
+  return config_cache.stats()
+
+@app.get("/stats/leases")
+async def get_lease_stats():
+  if lease_manager == None:
+    return JSONResponse(status_code=404, content={"status": "Error", "message": "Lease mode is not enabled."})
+  return lease_manager.stats()
+
+@app.put("/admin/tracing")
+async def set_tracing(enabled: bool, sampleRate: Optional[float] = None, reset: bool = False):
+  if sampleRate != None and (sampleRate < 0 or sampleRate > 1):
+    return JSONResponse(status_code=404, content={"status": "Error", "message": "Sample rate must be between 0 and 1."})
+  if reset:
+    tracer.reset()
+  tracer.configure(enabled, sampleRate)
+  if api_process:
+    # Spans are recorded where the ticks run, in the shard processes
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, wait_queue.request, 'tracing', (enabled, sampleRate, reset))
+  info_log(200, f'Tracing {"enabled" if enabled else "disabled"}')
+  return {"enabled": tracer.enabled, "sample_rate": tracer.sample_rate}
+
+@app.get("/admin/traces")
+async def get_traces():
+  stats = tracer.stats()
+  if api_process:
+    loop = asyncio.get_event_loop()
+    shards = await loop.run_in_executor(None, wait_queue.request, 'traces')
+    stats['shards'] = dict((str(shard), shard_stats) for shard, shard_stats in sorted(shards.items()))
+  return stats
+
+@app.get("/admin/profile")
+async def get_profile(seconds: float = 10):
+  if seconds <= 0 or seconds > max_profile_seconds:
+    return JSONResponse(status_code=404, content={"status": "Error", "message": "Seconds must be between 0 and "+str(max_profile_seconds)+"."})
+  # Sampling thread outside of the API executor
+  loop = asyncio.get_event_loop()
+  if not api_process:
+    return await loop.run_in_executor(None, sample_stacks, seconds)
+  # The shards are sampled at the same time as the API process
+  profile, shards = await asyncio.gather(loop.run_in_executor(None, sample_stacks, seconds),
+                                         loop.run_in_executor(None, wait_queue.request, 'profile', seconds, seconds + 5))
+  profile['shards'] = dict((str(shard), shard_profile) for shard, shard_profile in sorted(shards.items()))
+  return profile
+
+@app.get("/metrics")
+async def get_metrics():
+  content, content_type = metrics_payload()
+  if api_process:
+    # Scheduler, worker and OSM metrics live in the shard processes, labelled by process
+    loop = asyncio.get_event_loop()
+    shards = await loop.run_in_executor(None, wait_queue.request, 'metrics')
+    payloads = [('api', content.decode('utf-8'))] + [(str(shard), payload) for shard, payload in sorted(shards.items()) if payload != None]
+    content, content_type = merged_payload(payloads)
+  return Response(content=content, media_type=content_type)
@@ -0,0 +1,41 @@
+import hashlib
+
+# Domain separated hashes, a leaf can never be taken for an inner node
+def leaf_hash(digest):
+  return hashlib.sha256(b'\x00' + digest).digest()
+
+def node_hash(left, right):
+  return hashlib.sha256(b'\x01' + left + right).digest()
+
+# Every level of the tree, from the leaves to the root (an odd last node goes up unchanged)
+def merkle_levels(digests):
+  levels = [[leaf_hash(digest) for digest in digests]]
+  while len(levels[-1]) > 1:
+    level = levels[-1]
+    upper = [node_hash(level[i], level[i+1]) for i in range(0, len(level) - 1, 2)]
+    if len(level) % 2 == 1:
+      upper.append(level[-1])
+    levels.append(upper)
+  return levels
+
+def merkle_root(digests):
+  return merkle_levels(digests)[-1][0]
+
+# Sibling hashes from the leaf to the root, 'l'/'r' is the side of the sibling
+def merkle_proof(levels, index):
+  proof = []
+  for level in levels[:-1]:
+    sibling = index ^ 1
+    if sibling < len(level):
+      proof.append(['l' if sibling < index else 'r', level[sibling].hex()])
+    index = index // 2
+  return proof
+
+def verify_proof(digest, proof, root):
+  current = leaf_hash(digest)
+  for side, sibling in proof:
+    if side == 'l':
+      current = node_hash(bytes.fromhex(sibling), current)
+    else:
+      current = node_hash(current, bytes.fromhex(sibling))
+  return current == root
@@ -0,0 +1,251 @@
+import asyncio, collections, random, threading, time
+import concurrent.futures
+from .telemetry import osm_request_seconds, osm_errors, osm_retries, osm_hedged
+
+class OSMError(Exception):
+  # reason: timeout, exception, status, rejected or circuit_open.
+  # Rejected requests (4xx) would fail again, the other ticks can be replayed.
+  def __init__(self, reason, message):
+    Exception.__init__(self, message)
+    self.reason = reason
+    self.replay = reason != 'rejected'
+
+# Closed -> open after `threshold` consecutive failures, one probe request let through
+# (half open) once `reset_timeout` seconds passed, closed again if it succeeds
+class CircuitBreaker(object):
+  def __init__(self, threshold=5, reset_timeout=30.0):
+    self.threshold = threshold
+    self.reset_timeout = reset_timeout
+    self.state = 'closed'
+    self.failures = 0
+    self.opened_at = 0.0
+    self.probing = False
+    self.lock = threading.Lock()
+
+  def allow(self):
+    with self.lock:
+      if self.state == 'closed':
+        return True
+      if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+        self.state = 'half_open'
+      if self.state == 'half_open' and not self.probing:
+        self.probing = True
+        return True
+      return False
+
+  def success(self):
+    with self.lock:
+      self.state = 'closed'
+      self.failures = 0
+      self.probing = False
+
+  def failure(self):
+    with self.lock:
+      self.failures += 1
+      self.probing = False
+      if self.state == 'half_open' or self.failures >= self.threshold:
+        self.state = 'open'
+        self.opened_at = time.monotonic()
+
+# OSM fetches bounded by a deadline: each attempt times out with the time left, failed
+# attempts are retried with full-jitter exponential backoff, and a second (hedged) request
+# is sent when the first did not answer after `hedge_after` seconds.
+# The same breaker guards the threaded (requests) and asyncio (httpx) paths.
+class OSMClient(object):
+  def __init__(self, endpoint, session, timeout=10.0, deadline=10.0, retries=2, backoff=0.1, hedge_after=None, breaker=None, hedge_workers=20):
+    self.endpoint = endpoint
+    self.session = session
+    self.timeout = timeout
+    self.deadline = deadline
+    self.retries = retries
+    self.backoff = backoff
+    self.hedge_after = hedge_after
+    self.breaker = breaker if breaker != None else CircuitBreaker()
+    self.executor = None
+    if hedge_after != None:
+      self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix='mda-hedge')
+
+  # Server errors and throttling are retried, other non-200 answers are final
+  def check(self, response):
+    if response.status_code == 200:
+      return response
+    if response.status_code >= 500 or response.status_code == 429:
+      raise OSMError('status', 'OSM answered ' + str(response.status_code))
+    raise OSMError('rejected', 'OSM answered ' + str(response.status_code))
+
+  def failed(self, e):
+    if isinstance(e, OSMError):
+      return e
+    if isinstance(e, (asyncio.TimeoutError, concurrent.futures.TimeoutError)) or 'timeout' in type(e).__name__.lower() or 'timed out' in str(e):
+      return OSMError('timeout', 'OSM request timed out')
+    return OSMError('exception', str(e))
+
+  # Delay before the next attempt, None once the retries or the deadline are exhausted
+  def retry_delay(self, attempt, deadline):
+    delay = random.uniform(0, self.backoff * 2 ** attempt)
+    if attempt > self.retries or time.monotonic() + delay >= deadline:
+      return None
+    osm_retries.inc()
+    return delay
+
+  def request(self, params, timeout):
+    with osm_request_seconds.time():
+      return self.check(self.session.get(self.endpoint, params=params, timeout=timeout))
+
+  def hedged(self, params, timeout):
+    if self.executor == None or self.hedge_after >= timeout:
+      return self.request(params, timeout)
+    first = self.executor.submit(self.request, params, timeout)
+    try:
+      return first.result(timeout=self.hedge_after)
+    except concurrent.futures.TimeoutError:
+      pass
+    osm_hedged.inc()
+    pending = set([first, self.executor.submit(self.request, params, timeout - self.hedge_after)])
+    error = None
+    # First successful answer, the slower request finishes in the background
+    while pending:
+      done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        if future.exception() == None:
+          return future.result()
+        error = future.exception()
+    raise error
+
+  def fetch(self, params):
+    deadline = time.monotonic() + self.deadline
+    attempt = 0
+    while True:
+      if not self.breaker.allow():
+        osm_errors.labels('circuit_open').inc()
+        raise OSMError('circuit_open', 'Circuit open for ' + self.endpoint)
+      try:
+        response = self.hedged(params, max(0.001, min(self.timeout, deadline - time.monotonic())))
+        self.breaker.success()
+        return response
+      except Exception as e:
+        error = self.failed(e)
+      osm_errors.labels(error.reason).inc()
+      if error.reason == 'rejected':
+        # OSM is up, the request itself is wrong
+        self.breaker.success()
+        raise error
+      self.breaker.failure()
+      attempt += 1
+      delay = self.retry_delay(attempt, deadline)
+      if delay == None:
+        raise error
+      time.sleep(delay)
+
+  async def request_async(self, get, params, timeout):
+    with osm_request_seconds.time():
+      return self.check(await asyncio.wait_for(get(params, timeout), timeout))
+
+  async def hedged_async(self, get, params, timeout):
+    if self.hedge_after == None or self.hedge_after >= timeout:
+      return await self.request_async(get, params, timeout)
+    first = asyncio.ensure_future(self.request_async(get, params, timeout))
+    done, pending = await asyncio.wait([first], timeout=self.hedge_after)
+    if done:
+      return first.result()
+    osm_hedged.inc()
+    pending = set([first, asyncio.ensure_future(self.request_async(get, params, timeout - self.hedge_after))])
+    error = None
+    while pending:
+      done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+      for task in done:
+        if task.exception() == None:
+          for other in pending:
+            other.cancel()
+          return task.result()
+        error = task.exception()
+    raise error
+
+  # Same policy on the event loop, get(params, timeout) is the coroutine sending one request
+  async def fetch_async(self, get, params):
+    deadline = time.monotonic() + self.deadline
+    attempt = 0
+    while True:
+      if not self.breaker.allow():
+        osm_errors.labels('circuit_open').inc()
+        raise OSMError('circuit_open', 'Circuit open for ' + self.endpoint)
+      try:
+        response = await self.hedged_async(get, params, max(0.001, min(self.timeout, deadline - time.monotonic())))
+        self.breaker.success()
+        return response
+      except Exception as e:
+        error = self.failed(e)
+      osm_errors.labels(error.reason).inc()
+      if error.reason == 'rejected':
+        self.breaker.success()
+        raise error
+      self.breaker.failure()
+      attempt += 1
+      delay = self.retry_delay(attempt, deadline)
+      if delay == None:
+        raise error
+      await asyncio.sleep(delay)
+
+  def close(self):
+    if self.executor != None:
+      self.executor.shutdown(wait=False)
+
+# Ticks whose fetch failed, oldest first; the oldest are dropped (and counted) past max_entries.
+# Entries are (metrics, config, next_run_at); a tick stays pending from add() until done() or
+# drop(), so the aggregation buckets it belongs to can be held back until it is replayed
+class ReplayBuffer(object):
+  def __init__(self, max_entries=100000):
+    self.max_entries = max_entries
+    self.entries = collections.deque()
+    self.ticks = {}
+    self.lock = threading.Lock()
+    self.dropped = 0
+
+  def __len__(self):
+    return len(self.entries)
+
+  def track(self, entry, count):
+    metrics, config, next_run_at = entry
+    for metric in metrics:
+      ticks = self.ticks.setdefault(metric.metric_id, collections.Counter())
+      ticks[next_run_at] += count
+      if ticks[next_run_at] <= 0:
+        del ticks[next_run_at]
+        if not ticks:
+          del self.ticks[metric.metric_id]
+
+  def add(self, entry):
+    with self.lock:
+      if len(self.entries) >= self.max_entries:
+        self.track(self.entries.popleft(), -1)
+        self.dropped += 1
+      self.entries.append(entry)
+      self.track(entry, 1)
+
+  # Oldest entry, still pending while it is replayed
+  def pop(self):
+    with self.lock:
+      if not self.entries:
+        return None
+      return self.entries.popleft()
+
+  # Entry replayed, or not to be replayed
+  def done(self, entry):
+    with self.lock:
+      self.track(entry, -1)
+
+  # Entry given up by the replay (too old to be fetched)
+  def drop(self, entry):
+    with self.lock:
+      self.track(entry, -1)
+      self.dropped += 1
+
+  # Put back in front after a failed replay
+  def restore(self, entry):
+    with self.lock:
+      self.entries.appendleft(entry)
+
+  # Ticks of the metric before `before` not replayed yet
+  def pending(self, metric_id, before):
+    with self.lock:
+      return any(next_run_at < before for next_run_at in self.ticks.get(metric_id, ()))
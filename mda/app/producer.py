@@ -0,0 +1,95 @@
+import threading, time
+from .telemetry import kafka_publish_seconds, kafka_failures
+
+# Already resolved send result, same callback interface as kafka-python futures
+class MemoryFuture(object):
+  def __init__(self, value=None, exception=None):
+    self.value = value
+    self.exception = exception
+
+  def add_callback(self, f, *args, **kwargs):
+    if self.exception == None:
+      f(*(args + (self.value,)), **kwargs)
+    return self
+
+  def add_errback(self, f, *args, **kwargs):
+    if self.exception != None:
+      f(*(args + (self.exception,)), **kwargs)
+    return self
+
+# In-process stand-in broker keeping every record per topic (no network)
+class MemoryTransport(object):
+  def __init__(self, **configs):
+    self.configs = configs
+    self.value_serializer = configs.get('value_serializer')
+    self.topics = {}
+    self.lock = threading.Lock()
+    self.closed = False
+
+  def send(self, topic, key=None, value=None, headers=None):
+    if self.closed:
+      return MemoryFuture(exception=Exception('Producer is closed.'))
+    if self.value_serializer != None:
+      value = self.value_serializer(value)
+    with self.lock:
+      records = self.topics.setdefault(topic, [])
+      records.append((key, value, headers))
+      offset = len(records) - 1
+    return MemoryFuture(value=(topic, offset))
+
+  def flush(self, timeout=None):
+    return
+
+  def close(self, timeout=None):
+    self.closed = True
+
+# Long-lived producer shared by every worker
+class KafkaPublisher(object):
+  def __init__(self, transport, on_error=None, **configs):
+    self.transport = transport
+    self.configs = configs
+    self.on_error = on_error
+    self.producer = None
+    self.lock = threading.Lock()
+    self.sent = 0
+    self.failed = 0
+
+  def start(self):
+    with self.lock:
+      if self.producer == None:
+        self.producer = self.transport(**self.configs)
+      return self.producer
+
+  def send(self, topic, key=None, value=None, headers=None):
+    producer = self.producer if self.producer != None else self.start()
+    future = producer.send(topic, key=key, value=value, headers=headers)
+    future.add_callback(self.delivered, time.time())
+    future.add_errback(self.delivery_failed)
+    return future
+
+  def delivered(self, started, metadata):
+    kafka_publish_seconds.observe(time.time() - started)
+    with self.lock:
+      self.sent += 1
+
+  def delivery_failed(self, exception):
+    kafka_failures.inc()
+    with self.lock:
+      self.failed += 1
+    if self.on_error != None:
+      self.on_error(exception)
+
+  def flush(self, timeout=None):
+    if self.producer != None:
+      self.producer.flush(timeout=timeout)
+
+  def close(self, timeout=None):
+    with self.lock:
+      producer = self.producer
+      self.producer = None
+    if producer != None:
+      producer.flush(timeout=timeout)
+      producer.close(timeout=timeout)
+
+  def stats(self):
+    return {'sent': self.sent, 'failed': self.failed}
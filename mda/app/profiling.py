@@ -0,0 +1,120 @@
+import collections, random, sys, threading, time
+
+# Shared span used while tracing is off, entering it does nothing
+class NullSpan(object):
+  __slots__ = ()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    return False
+
+null_span = NullSpan()
+
+class Span(object):
+  __slots__ = ('tracer', 'name', 'start', 'trace')
+
+  def __init__(self, tracer, name, trace):
+    self.tracer = tracer
+    self.name = name
+    self.trace = trace
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    duration = time.perf_counter() - self.start
+    self.tracer.record(self.name, duration)
+    if self.trace != None:
+      self.trace['spans'].append((self.name, round((self.start - self.trace['start']) * 1000, 3), round(duration * 1000, 3)))
+    return False
+
+# Root span, kept in the trace buffer when sampled
+class TraceSpan(Span):
+  __slots__ = ()
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    Span.__exit__(self, exc_type, exc_value, traceback)
+    if self.trace != None:
+      self.tracer.local.trace = None
+      self.tracer.traces.append(self.trace)
+    return False
+
+# Per-stage timing (count, total and max per span name) and sampled traces, toggled at runtime
+class Tracer(object):
+  def __init__(self, enabled=False, sample_rate=0.01, max_traces=1000):
+    self.enabled = enabled
+    self.sample_rate = sample_rate
+    self.traces = collections.deque(maxlen=max_traces)
+    self.stages = {}
+    self.lock = threading.Lock()
+    self.local = threading.local()
+
+  def configure(self, enabled, sample_rate=None):
+    if sample_rate != None:
+      self.sample_rate = sample_rate
+    self.enabled = enabled
+
+  def span(self, name):
+    if not self.enabled:
+      return null_span
+    return Span(self, name, getattr(self.local, 'trace', None))
+
+  def trace(self, name):
+    if not self.enabled:
+      return null_span
+    trace = None
+    if random.random() < self.sample_rate:
+      trace = {'name': name, 'thread': threading.current_thread().name, 'timestamp': time.time(), 'start': time.perf_counter(), 'spans': []}
+      self.local.trace = trace
+    return TraceSpan(self, name, trace)
+
+  def record(self, name, duration):
+    with self.lock:
+      stage = self.stages.get(name)
+      if stage == None:
+        stage = self.stages[name] = [0, 0.0, 0.0]
+      stage[0] += 1
+      stage[1] += duration
+      if duration > stage[2]:
+        stage[2] = duration
+
+  def reset(self):
+    with self.lock:
+      self.stages = {}
+    self.traces.clear()
+
+  # Span times in milliseconds, trace span offsets relative to the root span
+  def stats(self):
+    with self.lock:
+      stages = dict((name, {'count': count, 'total_ms': round(total * 1000, 3), 'avg_ms': round(total * 1000 / count, 3), 'max_ms': round(maximum * 1000, 3)})
+                    for name, (count, total, maximum) in self.stages.items())
+    traces = [{'name': trace['name'], 'thread': trace['thread'], 'timestamp': trace['timestamp'],
+               'spans': [{'name': name, 'offset_ms': offset, 'duration_ms': duration} for name, offset, duration in trace['spans']]}
+              for trace in list(self.traces)]
+    return {'enabled': self.enabled, 'sample_rate': self.sample_rate, 'stages': stages, 'traces': traces}
+
+# Sampling profiler: stacks of every other thread captured each interval for `seconds`
+def sample_stacks(seconds, interval=0.005, limit=50):
+  own = threading.get_ident()
+  names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+  counts = collections.Counter()
+  samples = 0
+  deadline = time.time() + seconds
+  while time.time() < deadline:
+    for ident, frame in sys._current_frames().items():
+      if ident == own:
+        continue
+      stack = []
+      while frame != None:
+        code = frame.f_code
+        stack.append(code.co_filename + ':' + code.co_name + ':' + str(frame.f_lineno))
+        frame = frame.f_back
+      stack.reverse()
+      counts[(names.get(ident, str(ident)).rstrip('0123456789_-'), tuple(stack))] += 1
+    samples += 1
+    time.sleep(interval)
+  return {'seconds': seconds, 'samples': samples,
+          'stacks': [{'thread': thread, 'count': count, 'stack': list(stack)} for (thread, stack), count in counts.most_common(limit)]}
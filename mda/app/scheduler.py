@@ -0,0 +1,179 @@
+import datetime, heapq, itertools, threading
+from queue import PriorityQueue
+
+# Wait queue that wakes the scheduler up whenever a new item is scheduled.
+# Entries are indexed by metric: cancelling bumps the metric generation and the
+# stale entries are dropped lazily when they reach the top of the heap.
+class SchedulerQueue(PriorityQueue):
+  def __init__(self, maxsize=0):
+    PriorityQueue.__init__(self, maxsize)
+    self.changed = threading.Condition(self.mutex)
+
+  def _init(self, maxsize):
+    PriorityQueue._init(self, maxsize)
+    # metric_id -> [generation, config_id, live entries]
+    self.index = {}
+    # config_id -> metric ids
+    self.configs = {}
+    self.generation = itertools.count(1)
+    self.stale = 0
+
+  def _qsize(self):
+    return len(self.queue) - self.stale
+
+  def is_live(self, item):
+    entry = self.index.get(item.metric.metric_id)
+    return entry != None and entry[0] == item.generation
+
+  def _put(self, item):
+    metric_id = item.metric.metric_id
+    entry = self.index.get(metric_id)
+    if item.generation == None:
+      if entry == None:
+        config_id = item.metric.config.config_id
+        entry = self.index[metric_id] = [next(self.generation), config_id, 0]
+        self.configs.setdefault(config_id, set()).add(metric_id)
+      item.generation = entry[0]
+    elif entry == None or entry[0] != item.generation:
+      # Rescheduled from an entry cancelled meanwhile, put() counts it right after
+      self.unfinished_tasks -= 1
+      return
+    entry[2] += 1
+    heapq.heappush(self.queue, item)
+    self.changed.notify()
+
+  # First live entry, cancelled entries reaching the top are dropped
+  def peek(self):
+    while self.queue and not self.is_live(self.queue[0]):
+      heapq.heappop(self.queue)
+      self.stale -= 1
+    return self.queue[0] if self.queue else None
+
+  def _get(self):
+    self.peek()
+    item = heapq.heappop(self.queue)
+    self.index[item.metric.metric_id][2] -= 1
+    return item
+
+  def _cancel(self, metric_id):
+    entry = self.index.pop(metric_id, None)
+    if entry == None:
+      return 0
+    metrics = self.configs.get(entry[1])
+    if metrics != None:
+      metrics.discard(metric_id)
+      if not metrics:
+        del self.configs[entry[1]]
+    self.discard_entries(entry[2])
+    return entry[2]
+
+  def discard_entries(self, count):
+    self.stale += count
+    # Cancelled entries are never handed out
+    self.unfinished_tasks -= count
+    if self.unfinished_tasks <= 0:
+      self.unfinished_tasks = 0
+      self.all_tasks_done.notify_all()
+    # Rebuilt once most of the heap is stale, amortized over the cancellations
+    if self.stale > 1024 and self.stale * 2 > len(self.queue):
+      self.queue = [item for item in self.queue if self.is_live(item)]
+      heapq.heapify(self.queue)
+      self.stale = 0
+
+  # Cancel every queued entry of a metric (fetch and aggregation jobs)
+  def cancel(self, metric_id):
+    with self.mutex:
+      return self._cancel(metric_id)
+
+  def cancel_config(self, config_id):
+    with self.mutex:
+      count = 0
+      for metric_id in list(self.configs.get(config_id, ())):
+        count += self._cancel(metric_id)
+      return count
+
+  # Several new entries under one lock acquisition
+  def put_many(self, items):
+    with self.mutex:
+      for item in items:
+        self._put(item)
+        self.unfinished_tasks += 1
+      self.not_empty.notify_all()
+
+  def metrics_of(self, config_id):
+    with self.mutex:
+      return list(self.configs.get(config_id, ()))
+
+  def configs_of(self, metric_ids):
+    with self.mutex:
+      return set(self.index[metric_id][1] for metric_id in metric_ids if metric_id in self.index)
+
+  # Replace the queued entries of the metric by a new one
+  def reschedule(self, item):
+    with self.mutex:
+      self._cancel(item.metric.metric_id)
+      item.generation = None
+      self._put(item)
+      self.unfinished_tasks += 1
+      self.not_empty.notify()
+
+# Hands every due item of the wait queue to the dispatch function in one call
+class Scheduler(object):
+  def __init__(self, wait_queue, dispatch):
+    self.wait_queue = wait_queue
+    self.dispatch = dispatch
+    self.running = False
+    self.thread = None
+
+  def start(self):
+    self.running = True
+    self.thread = threading.Thread(target=self.run, name='mda-scheduler')
+    self.thread.setDaemon(True)
+    self.thread.start()
+
+  def stop(self):
+    with self.wait_queue.mutex:
+      self.running = False
+      self.wait_queue.changed.notify_all()
+    if self.thread != None:
+      self.thread.join()
+
+  # Wake the scheduler up before the current deadline (e.g. configs changed)
+  def notify(self):
+    with self.wait_queue.mutex:
+      self.wait_queue.changed.notify_all()
+
+  def next_due(self):
+    q = self.wait_queue
+    while self.running:
+      head = q.peek()
+      if head == None:
+        q.changed.wait()
+        continue
+      delay = (head.next_run_at - datetime.datetime.now()).total_seconds()
+      if delay <= 0:
+        return True
+      q.changed.wait(delay)
+    return False
+
+  def pop_due(self, now):
+    q = self.wait_queue
+    due = []
+    while True:
+      head = q.peek()
+      if head == None or head.next_run_at > now:
+        return due
+      due.append(q._get())
+
+  def run(self):
+    q = self.wait_queue
+    while True:
+      with q.mutex:
+        if not self.next_due():
+          return
+        now = datetime.datetime.now()
+        due = self.pop_due(now)
+      for item in due:
+        q.task_done()
+      self.dispatch(due)
+
@@ -0,0 +1,127 @@
+import bisect, hashlib, itertools, multiprocessing, os, threading
+
+# Consistent hashing of metric ids over the shards (virtual nodes smooth the distribution)
+class ShardRing(object):
+  def __init__(self, shards, replicas=128):
+    self.shards = shards
+    self.ring = sorted((self.hash(str(shard) + '-' + str(replica)), shard) for shard in range(shards) for replica in range(replicas))
+    self.keys = [key for key, shard in self.ring]
+
+  @staticmethod
+  def hash(value):
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+  def owner(self, metric_id):
+    index = bisect.bisect(self.keys, self.hash(str(metric_id)))
+    return self.ring[index % len(self.ring)][1]
+
+# Entry point of a shard process: the app is imported again with the shard identity
+def shard_entry(index, shards, commands, replies):
+  os.environ['MDA_SHARD_INDEX'] = str(index)
+  os.environ['MDA_SHARDS'] = str(shards)
+  from . import main
+  main.run_shard(commands, replies)
+
+# Wait queue and scheduler of the API process in multi-process mode: scheduling runs in
+# the shard processes, queue operations are sent to the shard owning the metric
+class ShardRouter(object):
+  def __init__(self, shards):
+    self.ring = ShardRing(shards)
+    self.context = multiprocessing.get_context('spawn')
+    self.commands = [self.context.Queue() for shard in range(shards)]
+    # Answers of the shards to the requests (metrics, traces, profiles), as (request id, shard, result)
+    self.replies = self.context.Queue()
+    self.requests = itertools.count()
+    self.pending = {}
+    self.lock = threading.Lock()
+    self.processes = []
+    self.collector = None
+
+  def start(self):
+    for index, commands in enumerate(self.commands):
+      process = self.context.Process(target=shard_entry, args=(index, len(self.commands), commands, self.replies), name='mda-shard-' + str(index))
+      process.start()
+      self.processes.append(process)
+    self.collector = threading.Thread(target=self.collect, name='mda-shard-replies')
+    self.collector.setDaemon(True)
+    self.collector.start()
+
+  def collect(self):
+    while True:
+      reply = self.replies.get()
+      if reply == None:
+        return
+      request_id, shard, result = reply
+      with self.lock:
+        waiting = self.pending.get(request_id)
+        if waiting != None:
+          waiting[0][shard] = result
+          if len(waiting[0]) == len(self.commands):
+            waiting[1].set()
+
+  # Result of the request in every shard, by shard index; shards not answering within the timeout are left out
+  def request(self, action, argument=None, timeout=5.0):
+    answers = {}
+    done = threading.Event()
+    with self.lock:
+      request_id = next(self.requests)
+      self.pending[request_id] = (answers, done)
+    for commands in self.commands:
+      commands.put(('request', (request_id, action, argument)))
+    done.wait(timeout)
+    with self.lock:
+      del self.pending[request_id]
+      return dict(answers)
+
+  # Every shard drains its commands, stops its scheduler and delivers its pending records
+  def stop(self):
+    for commands in self.commands:
+      commands.put(None)
+    for process in self.processes:
+      process.join()
+    self.processes = []
+    if self.collector != None:
+      self.replies.put(None)
+      self.collector.join()
+      self.collector = None
+
+  # Shards are woken up by their own queue
+  def notify(self):
+    return
+
+  def send(self, metric_id, command):
+    self.commands[self.ring.owner(metric_id)].put(command)
+
+  def put(self, item):
+    self.put_many([item])
+
+  def put_many(self, items):
+    by_shard = {}
+    for item in items:
+      by_shard.setdefault(self.ring.owner(item.metric.metric_id), []).append(item)
+    for shard, shard_items in by_shard.items():
+      self.commands[shard].put(('put', shard_items))
+
+  def cancel(self, metric_id):
+    self.send(metric_id, ('cancel', metric_id))
+    return 0
+
+  def cancel_config(self, config_id):
+    for commands in self.commands:
+      commands.put(('cancel_config', config_id))
+    return 0
+
+  # Timestamp end of a config, applied to the records of every shard
+  def update_config_end(self, config_id, timestamp_end):
+    for commands in self.commands:
+      commands.put(('config_end', (config_id, timestamp_end)))
+
+  def reschedule(self, item):
+    self.send(item.metric.metric_id, ('reschedule', item))
+
+  # Nothing is scheduled in the API process
+  def configs_of(self, metric_ids):
+    return set()
+
+  def qsize(self):
+    return 0
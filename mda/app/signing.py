@@ -0,0 +1,157 @@
+import json, hashlib, os, rsa, threading
+from .merkle import merkle_levels, merkle_proof, verify_proof
+from concurrent.futures import ProcessPoolExecutor
+
+hash_method = 'SHA-256'
+key_size = 2048
+
+# Canonical form of a record, the same bytes on both producer and consumer side
+def canonical_record(record):
+  return json.dumps(record, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')
+
+def record_digest(record):
+  return hashlib.sha256(canonical_record(record)).digest()
+
+def read_key(value):
+  # PEM content or path to a PEM file
+  if value.lstrip().startswith('-----BEGIN'):
+    return value.encode('utf-8')
+  with open(value, 'rb') as f:
+    return f.read()
+
+def write_key(path, data):
+  folder = os.path.dirname(path)
+  if folder != '' and not os.path.exists(folder):
+    os.makedirs(folder)
+  with open(path, 'wb') as f:
+    f.write(data)
+
+# Load the operator keypair, it is created once if it does not exist yet
+def load_keys(private_key, public_key=None):
+  if private_key.lstrip().startswith('-----BEGIN') or os.path.exists(private_key):
+    private = rsa.PrivateKey.load_pkcs1(read_key(private_key))
+  else:
+    public, private = rsa.newkeys(key_size)
+    write_key(private_key, private.save_pkcs1())
+  public = rsa.PublicKey(private.n, private.e)
+  if public_key != None and not public_key.lstrip().startswith('-----BEGIN'):
+    if not os.path.exists(public_key):
+      write_key(public_key, public.save_pkcs1())
+    elif rsa.PublicKey.load_pkcs1(read_key(public_key)) != public:
+      raise ValueError('Operator public key does not match the private key.')
+  return private, public
+
+def sign_digest(digest, private_key):
+  return rsa.sign_hash(digest, private_key, hash_method)
+
+def verify_record(record, signature, public_key):
+  try:
+    return rsa.verify(canonical_record(record), signature, public_key) == hash_method
+  except rsa.VerificationError:
+    return False
+
+# Process pool workers load the key once and only receive digests
+worker_private_key = None
+
+def init_worker(private_key):
+  global worker_private_key
+  worker_private_key = rsa.PrivateKey.load_pkcs1(read_key(private_key))
+
+def sign_in_worker(digest):
+  return sign_digest(digest, worker_private_key)
+
+def sign_root_in_worker(root):
+  return rsa.sign(root, worker_private_key, hash_method)
+
+class RecordSigner(object):
+  def __init__(self, private_key, public_key=None, processes=0):
+    self.private_key, self.public_key = load_keys(private_key, public_key)
+    self.pool = None
+    if processes > 0:
+      self.pool = ProcessPoolExecutor(max_workers=processes, initializer=init_worker, initargs=(private_key,))
+
+  # One signature over the SHA-256 digest of the whole record
+  def sign(self, record):
+    digest = record_digest(record)
+    if self.pool != None:
+      return digest, self.pool.submit(sign_in_worker, digest).result()
+    return digest, sign_digest(digest, self.private_key)
+
+  # Signature over a Merkle root (the root bytes are the signed message)
+  def sign_root(self, root):
+    if self.pool != None:
+      return self.pool.submit(sign_root_in_worker, root).result()
+    return rsa.sign(root, self.private_key, hash_method)
+
+  def close(self):
+    if self.pool != None:
+      self.pool.shutdown()
+
+# Records published within a window are signed together, per topic, through their Merkle root
+class BatchSigner(object):
+  def __init__(self, signer, publish, window=0.2, max_batch=1024):
+    self.signer = signer
+    self.publish = publish
+    self.window = window
+    self.max_batch = max_batch
+    self.pending = {}
+    self.lock = threading.Lock()
+    self.stopped = threading.Event()
+    self.thread = threading.Thread(target=self.run, name='mda-batch-signer')
+    self.thread.setDaemon(True)
+    self.thread.start()
+
+  def add(self, topic, record, value):
+    with self.lock:
+      batch = self.pending.setdefault(topic, [])
+      batch.append((record, value))
+      if len(batch) < self.max_batch:
+        return
+      del self.pending[topic]
+    self.sign_batch(topic, batch)
+
+  def run(self):
+    while not self.stopped.wait(self.window):
+      try:
+        self.flush()
+      except Exception as e:
+        print('batch_signer-> ' + str(e))
+
+  def flush(self):
+    with self.lock:
+      pending = self.pending
+      self.pending = {}
+    for topic, batch in pending.items():
+      self.sign_batch(topic, batch)
+
+  def sign_batch(self, topic, batch):
+    digests = [record_digest(record) for record, value in batch]
+    levels = merkle_levels(digests)
+    root = levels[-1][0]
+    signature = self.signer.sign_root(root)
+    for index, (record, value) in enumerate(batch):
+      value = dict(value)
+      value["signature"] = {
+        "merkleRoot": root.hex(),
+        "merkleProof": merkle_proof(levels, index),
+        "rootSignature": signature.hex()
+      }
+      # Keyed by the record digest, the records of a batch spread over the partitions
+      self.publish(topic, key=digests[index], value=value)
+
+  def close(self):
+    self.stopped.set()
+    self.thread.join()
+    self.flush()
+
+# Check a batch-signed Kafka value: its record is in the tree and the root is signed by the operator.
+# A malformed signature block is a failed verification
+def verify_batch_record(record, value, public_key):
+  try:
+    block = value["signature"]
+    root = bytes.fromhex(block["merkleRoot"])
+    if not verify_proof(record_digest(record), block["merkleProof"], root):
+      return False
+    return rsa.verify(root, bytes.fromhex(block["rootSignature"]), public_key) == hash_method
+  except (KeyError, TypeError, ValueError, rsa.VerificationError):
+    return False
@@ -0,0 +1,56 @@
+import collections
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.metrics_core import Metric
+from prometheus_client.parser import text_string_to_metric_families
+
+# Internal metrics of the pipeline, served in the Prometheus text format on /metrics.
+# Updating a counter or histogram is a lock and a few additions, cheap enough for every tick.
+
+latency_buckets = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+lag_buckets = (.01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+wait_queue_depth = Gauge('mda_wait_queue_depth', 'Scheduled entries waiting for their next run')
+metrics_queue_depth = Gauge('mda_metrics_queue_depth', 'Due batches waiting for a worker')
+workers = Gauge('mda_workers', 'Fetch workers by state', ['state'])
+log_records_dropped = Gauge('mda_log_records_dropped', 'Log records dropped while the log queue was full')
+values_buffered = Gauge('mda_values_buffered', 'Raw values waiting to be written')
+values_dropped = Gauge('mda_values_dropped', 'Raw values dropped while the database writes failed')
+
+dispatch_lag = Histogram('mda_dispatch_lag_seconds', 'Fetch start time minus next_run_at', buckets=lag_buckets)
+osm_request_seconds = Histogram('mda_osm_request_seconds', 'OSM request latency', buckets=latency_buckets)
+osm_errors = Counter('mda_osm_errors_total', 'Failed OSM requests', ['reason'])
+osm_retries = Counter('mda_osm_retries_total', 'OSM requests retried after a failure')
+osm_hedged = Counter('mda_osm_hedged_total', 'Hedged second OSM requests sent')
+osm_circuit_open = Gauge('mda_osm_circuit_open', '1 while the OSM circuit breaker is not closed')
+osm_replay_depth = Gauge('mda_osm_replay_depth', 'Ticks waiting to be fetched again')
+osm_replay_dropped = Gauge('mda_osm_replay_dropped', 'Ticks dropped from the full or expired replay buffer')
+osm_replayed = Counter('mda_osm_replayed_total', 'Ticks fetched and published by a replay')
+kafka_publish_seconds = Histogram('mda_kafka_publish_seconds', 'Kafka send to delivery acknowledgement latency', buckets=latency_buckets)
+kafka_failures = Counter('mda_kafka_failures_total', 'Kafka records not delivered')
+db_commit_seconds = Histogram('mda_db_commit_seconds', 'Database write and commit latency', ['operation'], buckets=latency_buckets)
+aggregation_seconds = Histogram('mda_aggregation_seconds', 'Aggregation compute time', ['backend'], buckets=latency_buckets)
+
+def metrics_payload():
+  return generate_latest(), CONTENT_TYPE_LATEST
+
+# Payloads of several processes (process name, text payload) served as one,
+# each sample labelled with the process it comes from
+class MergedCollector(object):
+  def __init__(self, payloads):
+    self.payloads = payloads
+
+  def collect(self):
+    families = collections.OrderedDict()
+    for process, payload in self.payloads:
+      for family in text_string_to_metric_families(payload):
+        merged = families.get(family.name)
+        if merged == None:
+          merged = families[family.name] = Metric(family.name, family.documentation, family.type)
+        for sample in family.samples:
+          merged.add_sample(sample.name, dict(sample.labels, process=process), sample.value)
+    return list(families.values())
+
+def merged_payload(payloads):
+  registry = CollectorRegistry(auto_describe=False)
+  registry.register(MergedCollector(payloads))
+  return generate_latest(registry), CONTENT_TYPE_LATEST
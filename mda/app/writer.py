@@ -0,0 +1,107 @@
+import threading
+import psycopg2.extras
+from .telemetry import db_commit_seconds
+
+# Raw values of deleted metrics are skipped, duplicated samples are ignored
+insert_values = "INSERT INTO value (timestamp, metric_id, metric_value) " \
+                "SELECT v.timestamp, v.metric_id, v.metric_value " \
+                "FROM (VALUES %s) AS v (timestamp, metric_id, metric_value) " \
+                "WHERE EXISTS (SELECT 1 FROM metric WHERE metric._id = v.metric_id) " \
+                "ON CONFLICT DO NOTHING;"
+
+# Write-behind buffer collecting raw values from every worker, flushed in bulk by size or time.
+# Rows of a failed write are kept for the next flush, the oldest dropped (and counted) past max_rows
+class ValueWriter(object):
+  def __init__(self, engine, max_rows=50000, flush_rows=1000, interval=1.0):
+    self.engine = engine
+    self.max_rows = max_rows
+    self.flush_rows = flush_rows
+    self.interval = interval
+    self.rows = []
+    self.lock = threading.Condition()
+    self.flush_lock = threading.Lock()
+    self.running = True
+    self.written = 0
+    self.dropped = 0
+    self.failing = False
+    self.thread = threading.Thread(target=self.run, name='mda-value-writer')
+    self.thread.setDaemon(True)
+    self.thread.start()
+
+  def add(self, metric_id, metric_value, timestamp):
+    with self.lock:
+      self.rows.append((timestamp, str(metric_id), metric_value))
+      if self.failing and len(self.rows) > self.max_rows:
+        del self.rows[0]
+        self.dropped += 1
+      size = len(self.rows)
+      if size >= self.flush_rows:
+        self.lock.notify()
+    # Bounded memory: the producer writes itself when the flusher falls behind
+    # (not while the database is failing, the flusher retries every interval)
+    if size >= self.max_rows and not self.failing:
+      self.flush()
+
+  def run(self):
+    while True:
+      with self.lock:
+        if self.running and (len(self.rows) < self.flush_rows or self.failing):
+          self.lock.wait(self.interval)
+        running = self.running
+      # A failure must not stop the flusher
+      try:
+        self.flush()
+      except Exception as e:
+        print('value_writer-> ' + str(e))
+      if not running:
+        return
+
+  def flush(self):
+    with self.flush_lock:
+      with self.lock:
+        rows = self.rows
+        self.rows = []
+      if rows:
+        self.write(rows)
+
+  def write(self, rows):
+    conn = None
+    try:
+      # An unreachable database fails here, the rows are kept as for a failed write
+      conn = self.engine.raw_connection()
+      with db_commit_seconds.labels('values').time():
+        cursor = conn.cursor()
+        psycopg2.extras.execute_values(cursor, insert_values, rows, template='(%s::timestamp, %s::uuid, %s::float)', page_size=1000)
+        conn.commit()
+      self.written += len(rows)
+      self.failing = False
+    except Exception as e:
+      self.retry(rows)
+      print('value_writer-> ' + str(e))
+      if conn != None:
+        try:
+          conn.rollback()
+        except Exception:
+          pass
+    finally:
+      if conn != None:
+        conn.close()
+
+  # Failed rows back in front of the newer ones
+  def retry(self, rows):
+    with self.lock:
+      rows.extend(self.rows)
+      overflow = max(0, len(rows) - self.max_rows)
+      self.rows = rows[overflow:]
+      self.dropped += overflow
+      self.failing = True
+
+  def close(self):
+    with self.lock:
+      self.running = False
+      self.lock.notify()
+    self.thread.join()
+    self.flush()
+
+  def stats(self):
+    return {'buffered': len(self.rows), 'written': self.written, 'dropped': self.dropped}
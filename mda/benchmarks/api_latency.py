@@ -0,0 +1,77 @@
+import argparse, datetime, threading, time
+import requests
+from prometheus_client.parser import text_string_to_metric_families
+from benchmarks.server import start_osm, start_mda, stop_mda, configs, create, percentile
+
+# REST latency with an idle scheduler and with a saturated one: configs ticking each second against
+# a slow OSM, more requests due than the 20 workers can fetch, so the metrics queue keeps growing.
+# Clients read pages of GET /settings and single configs with GET /settings/{id} (without ETag).
+# Records are signed in batches by default: with --signing-mode record on few CPUs the workers are
+# CPU bound on signing and starve every thread of the process, the API included (see MDA_SHARDS).
+#   cd mda; POSTGRES_URL=localhost:5432 POSTGRES_USER=postgres POSTGRES_PW= python -m benchmarks.api_latency
+
+def gauge(url, name):
+  text = requests.get(url + '/metrics', timeout=30).text
+  return sum(sample.value for family in text_string_to_metric_families(text) for sample in family.samples if sample.name == name)
+
+# Latencies (seconds) of the requests sent by `clients` threads during `seconds`
+def measure(url, config_ids, clients, seconds):
+  latencies = []
+  lock = threading.Lock()
+  deadline = time.time() + seconds
+  def client(index):
+    session = requests.Session()
+    count = 0
+    while time.time() < deadline:
+      if count % 2:
+        path = '/settings/' + config_ids[(index * 7919 + count) % len(config_ids)]
+      else:
+        path = '/settings?limit=50'
+      started = time.perf_counter()
+      session.get(url + path, timeout=60).raise_for_status()
+      elapsed = time.perf_counter() - started
+      with lock:
+        latencies.append(elapsed)
+      count += 1
+  threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  return latencies
+
+def report(name, latencies, seconds):
+  print('%-10s %8.1f req/s  p50 %7.2f ms  p99 %7.2f ms  max %7.2f ms' % (name, len(latencies) / seconds, percentile(latencies, 0.5) * 1000,
+                                                                         percentile(latencies, 0.99) * 1000, max(latencies) * 1000))
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--configs', type=int, default=500)
+  parser.add_argument('--metrics-per-config', type=int, default=2)
+  parser.add_argument('--latency-ms', type=float, default=200)
+  parser.add_argument('--clients', type=int, default=4)
+  parser.add_argument('--warmup', type=float, default=10)
+  parser.add_argument('--seconds', type=float, default=30)
+  parser.add_argument('--port', type=int, default=4100)
+  parser.add_argument('--signing-mode', default='batch')
+  args = parser.parse_args()
+  osm = start_osm(args.latency_ms / 1000.0)
+  process, url = start_mda(args.port, osm.server_address[1], SIGNING_MODE=args.signing_mode)
+  try:
+    # Read by the clients, not scheduled during the benchmark
+    create(url, configs(args.configs, args.metrics_per_config, start=datetime.datetime.now() + datetime.timedelta(days=1)))
+    config_ids = [config['id'] for config in requests.get(url + '/settings?limit=' + str(min(args.configs, 100)), timeout=60).json()]
+    print('OSM latency %g ms, %d API clients, offered %d OSM requests/s once saturated (20 workers: %d/s)' % (
+      args.latency_ms, args.clients, args.configs, 20 * 1000 / args.latency_ms))
+    report('idle', measure(url, config_ids, args.clients, args.seconds), args.seconds)
+    create(url, configs(args.configs, args.metrics_per_config, offset=args.configs))
+    time.sleep(args.warmup)
+    before = gauge(url, 'mda_metrics_queue_depth')
+    report('saturated', measure(url, config_ids, args.clients, args.seconds), args.seconds)
+    print('metrics queue depth %d -> %d batches' % (before, gauge(url, 'mda_metrics_queue_depth')))
+  finally:
+    stop_mda(process)
+    osm.shutdown()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,41 @@
+import argparse
+from benchmarks.server import start_osm, start_mda, stop_mda, configs, create, throughput
+
+# Records published per second against a slow OSM (200 ms per request by default), one request per
+# config each second: the 20 worker threads against the asyncio engine at several OSM_CONCURRENCY limits.
+# The threads top out at 20 / latency requests per second, the asyncio engine at concurrency / latency.
+# Records are signed in batches by default, so the signing CPU does not cap the fetches.
+#   cd mda; POSTGRES_URL=localhost:5432 POSTGRES_USER=postgres POSTGRES_PW= python -m benchmarks.async_engine
+
+def run(engine, concurrency, args, osm_port):
+  extra = {'EXECUTION_ENGINE': engine, 'SIGNING_MODE': args.signing_mode}
+  if concurrency != None:
+    extra['OSM_CONCURRENCY'] = str(concurrency)
+  process, url = start_mda(args.port, osm_port, **extra)
+  try:
+    create(url, configs(args.configs, 1))
+    return throughput(url, args.warmup, args.seconds)
+  finally:
+    stop_mda(process)
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--concurrency', type=int, nargs='+', default=[20, 50, 100, 200])
+  parser.add_argument('--latency-ms', type=float, default=200)
+  parser.add_argument('--configs', type=int, default=500)
+  parser.add_argument('--warmup', type=float, default=10)
+  parser.add_argument('--seconds', type=float, default=30)
+  parser.add_argument('--port', type=int, default=4100)
+  parser.add_argument('--signing-mode', default='batch')
+  parser.add_argument('--skip-threads', action='store_true')
+  args = parser.parse_args()
+  osm = start_osm(args.latency_ms / 1000.0)
+  print('OSM latency %g ms, offered %d requests/s' % (args.latency_ms, args.configs))
+  if not args.skip_threads:
+    print('threads (20)       : %10.1f records/s' % run('threads', None, args, osm.server_address[1]))
+  for concurrency in args.concurrency:
+    print('asyncio, limit %4d: %10.1f records/s' % (concurrency, run('asyncio', concurrency, args, osm.server_address[1])))
+  osm.shutdown()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,63 @@
+import argparse, datetime, gc, tracemalloc, uuid
+from app.jobs import MetricRecord, ScheduledJob, config_record
+from app.scheduler import SchedulerQueue
+
+# Bytes per scheduled metric in the wait queue (entries, metric index and shared config records)
+# at 10k, 100k and 1M metrics, against the old 17-field tuples copying the config of every metric.
+#   cd mda; python -m benchmarks.job_memory
+
+def copy(value):
+  # Distinct string objects, as read from each database row
+  return (value + '.')[:-1]
+
+def fill(metrics, per_config):
+  now = datetime.datetime.now()
+  wait_queue = SchedulerQueue()
+  items = []
+  for index in range(metrics):
+    if index % per_config == 0:
+      record = config_record(uuid.uuid4(), 'business' + str(index), 'topic', '1', 'tenant', 'resource' + str(index), 'reference' + str(index), now, None)
+    items.append(ScheduledJob(now + datetime.timedelta(seconds=index % 3600), None, 0,
+                              MetricRecord(uuid.uuid4(), 'metric' + str(index % per_config), None, '30s', None, record)))
+  wait_queue.put_many(items)
+  return wait_queue
+
+# Before: (next_run_at, metric_name, metric_type, aggregation_method, metric_id, step, business_id, kafka_topic,
+# network_id, tenant_id, resource_id, reference_id, timestamp_start, timestamp_end, config_id, step_aggregation, next_aggregation)
+def fill_old(metrics, per_config):
+  now = datetime.datetime.now()
+  entries = []
+  for index in range(metrics):
+    if index % per_config == 0:
+      config_id = uuid.uuid4()
+      business, resource, reference = 'business' + str(index), 'resource' + str(index), 'reference' + str(index)
+    entries.append((now + datetime.timedelta(seconds=index % 3600), copy('metric' + str(index % per_config)), copy('float'), None, uuid.uuid4(), copy('30s'),
+                    copy(business), copy('topic'), copy('1'), copy('tenant'), copy(resource), copy(reference), datetime.datetime(now.year, now.month, now.day), None,
+                    uuid.UUID(int=config_id.int), None, None))
+  return entries
+
+def measure(fill, metrics, per_config):
+  gc.collect()
+  tracemalloc.start()
+  before = tracemalloc.get_traced_memory()[0]
+  kept = fill(metrics, per_config)
+  gc.collect()
+  used = tracemalloc.get_traced_memory()[0] - before
+  tracemalloc.stop()
+  del kept
+  return used / float(metrics)
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--metrics', type=int, nargs='+', default=[10000, 100000, 1000000])
+  parser.add_argument('--metrics-per-config', type=int, default=10)
+  parser.add_argument('--skip-old', action='store_true')
+  args = parser.parse_args()
+  print('%10s %16s %16s' % ('metrics', 'bytes/metric', 'old bytes/metric'))
+  for metrics in args.metrics:
+    current = measure(fill, metrics, args.metrics_per_config)
+    old = measure(fill_old, metrics, args.metrics_per_config) if not args.skip_old else 0
+    print('%10d %16.0f %16.0f' % (metrics, current, old))
+
+if __name__ == '__main__':
+  main()
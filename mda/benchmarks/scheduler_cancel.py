@@ -0,0 +1,74 @@
+import argparse, datetime, queue, time, uuid
+from app.jobs import MetricRecord, ScheduledJob, config_record
+from app.scheduler import SchedulerQueue
+
+# Disabling one config of 1000 metrics against a wait queue of 100k entries: the indexed
+# cancellation of SchedulerQueue against the old linear scan of the heap list per metric.
+#   cd mda; python -m benchmarks.scheduler_cancel
+
+def jobs(total, config_size):
+  now = datetime.datetime.now()
+  configs = []
+  items = []
+  for index in range(total):
+    if index % config_size == 0:
+      config_id = uuid.uuid4()
+      configs.append(config_id)
+      record = config_record(config_id, 'business', 'topic', '1', 'tenant', 'resource', 'reference', now, None)
+    metric = MetricRecord(uuid.uuid4(), 'metric' + str(index), None, '30s', None, record)
+    items.append(ScheduledJob(now + datetime.timedelta(seconds=index % 3600), None, 0, metric))
+  return configs, items
+
+# Before: every metric of the config deleted by scanning the heap list from the start
+def old_disable(wait_queue, metric_ids):
+  for metric_id in metric_ids:
+    index = True
+    while index:
+      index = False
+      for i in range(len(wait_queue.queue)):
+        if wait_queue.queue[i][4] == metric_id:
+          del wait_queue.queue[i]
+          index = True
+          break
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--entries', type=int, default=100000)
+  parser.add_argument('--config-size', type=int, default=1000)
+  parser.add_argument('--skip-old', action='store_true')
+  args = parser.parse_args()
+  configs, items = jobs(args.entries, args.config_size)
+  # The config disabled is in the middle of the heap
+  disabled = configs[len(configs) // 2]
+  metric_ids = [item.metric.metric_id for item in items if item.metric.config.config_id == disabled]
+
+  wait_queue = SchedulerQueue()
+  wait_queue.put_many(items)
+  started = time.perf_counter()
+  cancelled = wait_queue.cancel_config(disabled)
+  cancel_seconds = time.perf_counter() - started
+  # Stale entries are dropped as they reach the top of the heap
+  started = time.perf_counter()
+  drained = 0
+  while not wait_queue.empty():
+    wait_queue.get_nowait()
+    drained += 1
+  drain_seconds = time.perf_counter() - started
+  assert cancelled == len(metric_ids) and drained == args.entries - cancelled
+  print('entries %d, config of %d metrics' % (args.entries, len(metric_ids)))
+  print('indexed cancel_config  %10.3f ms' % (cancel_seconds * 1000))
+  print('drain of the rest      %10.3f ms (%.2f us per get)' % (drain_seconds * 1000, drain_seconds * 1e6 / drained))
+
+  if not args.skip_old:
+    # The old 17-field tuples, metric id at index 4
+    old_queue = queue.PriorityQueue()
+    for item in items:
+      old_queue.put((item.next_run_at, item.metric.metric_name, None, None, item.metric.metric_id))
+    started = time.perf_counter()
+    old_disable(old_queue, metric_ids)
+    old_seconds = time.perf_counter() - started
+    assert old_queue.qsize() == args.entries - len(metric_ids)
+    print('old linear scans       %10.3f ms  x%.0f' % (old_seconds * 1000, old_seconds / cancel_seconds))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,52 @@
+import argparse, datetime, threading, time, uuid
+from app.jobs import MetricRecord, ScheduledJob, config_record
+from app.scheduler import Scheduler, SchedulerQueue
+
+# The 1000-metric scenario of `Tests jmeter.jmx`: 1000 configs created together, so every
+# metric is due at the same instant each step. Reports the ticks dispatched against the
+# ticks due and the dispatch lag (dispatch time - next_run_at) of the scheduler.
+# The old Timeloop job moved one item per second, 1000 seconds for each round.
+#   cd mda; python -m benchmarks.scheduler_dispatch
+
+def percentile(values, fraction):
+  return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--metrics', type=int, default=1000)
+  # 2m in the JMeter plan, shortened to see several rounds
+  parser.add_argument('--step', type=float, default=5)
+  parser.add_argument('--seconds', type=float, default=30)
+  args = parser.parse_args()
+  step = datetime.timedelta(seconds=args.step)
+  start = datetime.datetime.now() + datetime.timedelta(seconds=1)
+  end = start + datetime.timedelta(seconds=args.seconds)
+  items = []
+  for index in range(args.metrics):
+    record = config_record(uuid.uuid4(), 'business', 'topic', '1', 'tenant', 'resource', 'reference', start, None)
+    items.append(ScheduledJob(start, None, 0, MetricRecord(uuid.uuid4(), 'metric' + str(index), None, '2m', None, record)))
+
+  wait_queue = SchedulerQueue()
+  lags = []
+  lock = threading.Lock()
+  # Each tick is rescheduled one step later, as the workers do once the values are published
+  def dispatch(due):
+    now = datetime.datetime.now()
+    with lock:
+      lags.extend((now - item.next_run_at).total_seconds() for item in due)
+    wait_queue.put_many([item.reschedule(item.next_run_at + step, None) for item in due if item.next_run_at + step < end])
+  scheduler = Scheduler(wait_queue, dispatch)
+  wait_queue.put_many(items)
+  scheduler.start()
+  time.sleep((end - datetime.datetime.now()).total_seconds() + 1)
+  scheduler.stop()
+
+  rounds = int((end - start).total_seconds() // args.step) + (1 if (end - start).total_seconds() % args.step else 0)
+  lags.sort()
+  print('metrics %d, step %gs, %d rounds' % (args.metrics, args.step, rounds))
+  print('dispatched %d of %d ticks due' % (len(lags), rounds * args.metrics))
+  print('dispatch lag  p50 %.2f ms  p99 %.2f ms  max %.2f ms' % (percentile(lags, 0.5) * 1000, percentile(lags, 0.99) * 1000, lags[-1] * 1000))
+  print('old Timeloop: 1 tick/s, %d of %d ticks due over the same period' % (min(rounds * args.metrics, int(args.seconds)), rounds * args.metrics))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,109 @@
+import datetime, http.server, json, os, subprocess, sys, tempfile, threading, time, urllib.parse
+import requests
+from prometheus_client.parser import text_string_to_metric_families
+
+# Helpers of the benchmarks running the app as in the container (uvicorn app.main:app) against the
+# Postgres of POSTGRES_URL/POSTGRES_USER/POSTGRES_PW, an OSM stub and the memory Kafka transport.
+
+# OSM answering every request after `latency` seconds, one thread per request
+class OSMStub(http.server.BaseHTTPRequestHandler):
+  latency = 0
+
+  def do_GET(self):
+    if self.latency:
+      time.sleep(self.latency)
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+    start = query['start'][0]
+    body = json.dumps({'status': 'success', 'data': {'resultType': 'matrix', 'result': [
+      {'metric': {'__name__': name}, 'values': [[start, '1.0']]} for name in query['match']]}}).encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    return
+
+# Backlog large enough for hundreds of concurrent fetches
+class OSMServer(http.server.ThreadingHTTPServer):
+  daemon_threads = True
+  request_queue_size = 1024
+
+def start_osm(latency=0):
+  handler = type('OSMStub', (OSMStub,), {'latency': latency})
+  osm = OSMServer(('127.0.0.1', 0), handler)
+  threading.Thread(target=osm.serve_forever, daemon=True).start()
+  return osm
+
+def start_mda(port, osm_port, **extra):
+  work = tempfile.mkdtemp(prefix='mda-bench-')
+  env = dict(os.environ)
+  env.update({
+    'POSTGRES_DB': 'mda_benchmark',
+    'RESET_DB': 'true',
+    'KAFKA_HOST': 'localhost',
+    'KAFKA_PORT': '9092',
+    'KAFKA_TRANSPORT': 'memory',
+    'LOG_FILE': os.path.join(work, 'mda.json'),
+    'OPERATOR_PRIVATE_KEY': os.path.join(work, 'operator_private.pem'),
+    'OPERATOR_PUBLIC_KEY': os.path.join(work, 'operator_public.pem'),
+    'OSM_ENDPOINT': 'http://127.0.0.1:' + str(osm_port) + '/monitoringData',
+    'CATCHUP_ENABLED': 'false'
+  })
+  env.update(extra)
+  url = 'http://127.0.0.1:' + str(port)
+  process = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'app.main:app', '--port', str(port), '--log-level', 'warning'],
+                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env=env)
+  try:
+    wait_ready(url, process)
+  except Exception:
+    stop_mda(process)
+    raise
+  return process, url
+
+def stop_mda(process):
+  process.terminate()
+  process.wait()
+
+def wait_ready(url, process, timeout=120):
+  deadline = time.time() + timeout
+  while time.time() < deadline:
+    if process.poll() != None:
+      raise Exception('MDA exited with ' + str(process.returncode))
+    try:
+      requests.get(url + '/stats/cache', timeout=1)
+      return
+    except requests.exceptions.RequestException:
+      time.sleep(0.5)
+  raise Exception('MDA did not start')
+
+# Config bodies of POST /settings, every metric ticking each `step`
+def configs(count, metrics_per_config, step='1s', start=None, offset=0):
+  start = (start or datetime.datetime.now() + datetime.timedelta(seconds=2)).replace(microsecond=0).isoformat()
+  return [{'businessID': 'business', 'topic': 'benchmark', 'networkID': 1, 'tenantID': 'tenant',
+           'resourceID': 'resource' + str(config), 'referenceID': 'reference' + str(config), 'timestampStart': start,
+           'metrics': [{'metricName': 'metric' + str(metric), 'metricType': 'float', 'step': step} for metric in range(metrics_per_config)]}
+          for config in range(offset, offset + count)]
+
+def create(url, bodies):
+  for index in range(0, len(bodies), 100):
+    requests.post(url + '/settings/batch', json=bodies[index:index + 100], timeout=60).raise_for_status()
+
+# Published records summed over the processes (one delivery acknowledgement per record)
+def published(url):
+  text = requests.get(url + '/metrics', timeout=30).text
+  return sum(sample.value for family in text_string_to_metric_families(text) for sample in family.samples
+             if sample.name == 'mda_kafka_publish_seconds_count')
+
+# Records published per second once the schedule is running
+def throughput(url, warmup, seconds):
+  time.sleep(warmup)
+  first, started = published(url), time.time()
+  time.sleep(seconds)
+  last, ended = published(url), time.time()
+  return (last - first) / (ended - started)
+
+def percentile(values, fraction):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * fraction))]
@@ -0,0 +1,47 @@
+import argparse, datetime, time
+import requests
+from benchmarks.server import start_osm, start_mda, stop_mda, configs
+
+# Creation time of N configs (10 metrics each, as the `Tests jmeter.jmx` plan) posted one by one
+# to POST /settings against a single POST /settings/batch, configs starting the next day so the
+# scheduler stays idle.
+#   cd mda; POSTGRES_URL=localhost:5432 POSTGRES_USER=postgres POSTGRES_PW= python -m benchmarks.settings_batch
+
+def individual(url, bodies):
+  session = requests.Session()
+  started = time.perf_counter()
+  for body in bodies:
+    session.post(url + '/settings', json=body, timeout=60).raise_for_status()
+  return time.perf_counter() - started
+
+def batch(url, bodies):
+  started = time.perf_counter()
+  results = requests.post(url + '/settings/batch', json=bodies, timeout=600).json()
+  elapsed = time.perf_counter() - started
+  assert all(result['status'] == 'Success' for result in results)
+  return elapsed
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--configs', type=int, nargs='+', default=[1, 10, 100, 500])
+  parser.add_argument('--metrics-per-config', type=int, default=10)
+  parser.add_argument('--port', type=int, default=4100)
+  args = parser.parse_args()
+  osm = start_osm()
+  process, url = start_mda(args.port, osm.server_address[1])
+  try:
+    start = datetime.datetime.now() + datetime.timedelta(days=1)
+    offset = 0
+    print('%8s %14s %14s %8s' % ('configs', 'individual s', 'batch s', 'speedup'))
+    for count in args.configs:
+      single = individual(url, configs(count, args.metrics_per_config, start=start, offset=offset))
+      offset += count
+      bulk = batch(url, configs(count, args.metrics_per_config, start=start, offset=offset))
+      offset += count
+      print('%8d %14.3f %14.3f %7.1fx' % (count, single, bulk, single / bulk))
+  finally:
+    stop_mda(process)
+    osm.shutdown()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,37 @@
+import argparse, os
+from benchmarks.server import start_osm, start_mda, stop_mda, configs, create, throughput
+
+# Records published per second with 1, 2, 4... shard processes, every metric ticking each second.
+# The app runs as in the container (uvicorn app.main:app) against the Postgres of
+# POSTGRES_URL/POSTGRES_USER/POSTGRES_PW, an OSM stub answering at once, and the memory Kafka transport.
+#   cd mda; POSTGRES_URL=localhost:5432 POSTGRES_USER=postgres POSTGRES_PW= python -m benchmarks.shards_throughput
+
+def run(shards, args, osm_port):
+  process, url = start_mda(args.port, osm_port, MDA_SHARDS=str(shards))
+  try:
+    create(url, configs(args.configs, args.metrics_per_config))
+    return throughput(url, args.warmup, args.seconds)
+  finally:
+    stop_mda(process)
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+  parser.add_argument('--configs', type=int, default=200)
+  parser.add_argument('--metrics-per-config', type=int, default=10)
+  parser.add_argument('--warmup', type=float, default=10)
+  parser.add_argument('--seconds', type=float, default=30)
+  parser.add_argument('--port', type=int, default=4100)
+  args = parser.parse_args()
+  osm = start_osm()
+  offered = args.configs * args.metrics_per_config
+  print('cpus %d, offered %d records/s' % (os.cpu_count(), offered))
+  baseline = None
+  for shards in args.shards:
+    rate = run(shards, args, osm.server_address[1])
+    baseline = baseline or rate
+    print('shards %2d: %10.1f records/s  x%.2f' % (shards, rate, rate / baseline if baseline else 0))
+  osm.shutdown()
+
+if __name__ == '__main__':
+  main()
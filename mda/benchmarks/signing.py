@@ -0,0 +1,57 @@
+import argparse, concurrent.futures, hashlib, os, time
+import rsa
+from app.signing import BatchSigner, RecordSigner, key_size
+
+# Records signed per second: the old per-record keypair against the operator key signing
+# one digest per record (in this process or a pool) and one Merkle root per batch.
+#   cd mda; python -m benchmarks.signing
+
+def records(count):
+  return [{"data": {"metricName": "cpu_utilization", "metricValue": str(index), "resourceID": "resource", "referenceID": "reference",
+                    "timestamp": "2026-01-01 10:00:00." + str(index)}} for index in range(count)]
+
+# Before: a new 1024 bits keypair for every record, each field digest encrypted with it
+def old_sign(record):
+  hashes = {k: hashlib.sha256(str(v).encode('utf-8')).hexdigest() for k, v in record.items()}
+  public_key, private_key = rsa.newkeys(1024)
+  return {rsa.encrypt(k.encode(), private_key): rsa.encrypt(v.encode(), private_key) for k, v in hashes.items()}
+
+def measure(sign, batch):
+  started = time.perf_counter()
+  sign(batch)
+  return len(batch) / (time.perf_counter() - started)
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--records', type=int, default=2000)
+  parser.add_argument('--old-records', type=int, default=20)
+  parser.add_argument('--processes', type=int, default=os.cpu_count())
+  parser.add_argument('--batch', type=int, default=1024)
+  args = parser.parse_args()
+  public, private = rsa.newkeys(key_size)
+  key = private.save_pkcs1().decode('utf-8')
+  results = [('old: keypair per record', measure(lambda batch: [old_sign(record) for record in batch], records(args.old_records)))]
+  signer = RecordSigner(key)
+  results.append(('record: operator key', measure(lambda batch: [signer.sign(record) for record in batch], records(args.records))))
+  if args.processes > 1:
+    # Signed from as many threads as the fetch workers would
+    pool = RecordSigner(key, processes=args.processes)
+    pool.sign(records(1)[0])
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4 * args.processes) as callers:
+      results.append(('record: %d processes' % args.processes, measure(lambda batch: list(callers.map(pool.sign, batch)), records(args.records))))
+    pool.close()
+  # Flushed within the measure, the last partial batch is signed too
+  batch_signer = BatchSigner(signer, lambda topic, key=None, value=None: None, window=3600, max_batch=args.batch)
+  def sign_batches(batch):
+    for record in batch:
+      batch_signer.add('topic', record, record)
+    batch_signer.flush()
+  results.append(('batch: one root per %d' % args.batch, measure(sign_batches, records(args.records))))
+  batch_signer.close()
+  signer.close()
+  baseline = results[0][1]
+  for name, rate in results:
+    print('%-28s %12.1f records/s  x%.0f' % (name, rate, rate / baseline))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,58 @@
+import argparse, threading, time
+from app.telemetry import workers, dispatch_lag, osm_request_seconds, kafka_publish_seconds, db_commit_seconds, metrics_payload
+
+# Cost of the instrumentation of one tick of the threaded workers (busy/idle gauges, dispatch lag,
+# OSM request timer, one Kafka acknowledgement per record, the share of a value write) measured
+# single threaded and with the 20 workers updating at once, and the cost of a /metrics scrape.
+#   cd mda; python -m benchmarks.telemetry_overhead
+
+def tick(records):
+  workers.labels('busy').inc()
+  workers.labels('idle').dec()
+  dispatch_lag.observe(0.01)
+  with osm_request_seconds.time():
+    pass
+  for record in range(records):
+    kafka_publish_seconds.observe(0.002)
+  with db_commit_seconds.labels('values').time():
+    pass
+  workers.labels('idle').inc()
+  workers.labels('busy').dec()
+
+def bare(records):
+  # Same loop without the metric updates
+  for record in range(records):
+    pass
+
+def per_tick(function, ticks, records, threads):
+  def run():
+    for index in range(ticks):
+      function(records)
+  started = time.perf_counter()
+  pool = [threading.Thread(target=run) for thread in range(threads)]
+  for thread in pool:
+    thread.start()
+  for thread in pool:
+    thread.join()
+  return (time.perf_counter() - started) / (ticks * threads)
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--ticks', type=int, default=100000)
+  parser.add_argument('--records', type=int, default=10)
+  parser.add_argument('--threads', type=int, default=20)
+  parser.add_argument('--rate', type=int, default=1000, help='ticks per second of the CPU share estimate')
+  parser.add_argument('--scrapes', type=int, default=200)
+  args = parser.parse_args()
+  for threads in (1, args.threads):
+    ticks = args.ticks // threads
+    overhead = per_tick(tick, ticks, args.records, threads) - per_tick(bare, ticks, args.records, threads)
+    print('%2d thread(s): %6.2f us per tick of %d records, %.2f%% of a CPU at %d ticks/s' % (
+      threads, overhead * 1e6, args.records, overhead * args.rate * 100, args.rate))
+  started = time.perf_counter()
+  for scrape in range(args.scrapes):
+    payload = metrics_payload()[0]
+  print('/metrics scrape: %.2f ms, %d bytes' % ((time.perf_counter() - started) * 1000 / args.scrapes, len(payload)))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,36 @@
+import os, sys, tempfile
+import pytest
+
+# Tests import the app package the way the container runs it (app.main:app)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Tests touching the database run against MDA_TEST_POSTGRES_URL (host:port), skipped without it
+def postgres_env(database, **extra):
+  url = os.environ.get("MDA_TEST_POSTGRES_URL")
+  if not url:
+    pytest.skip("MDA_TEST_POSTGRES_URL is not set")
+  work = tempfile.mkdtemp(prefix='mda-test-')
+  env = dict(os.environ)
+  env.update({
+    "POSTGRES_USER": os.environ.get("MDA_TEST_POSTGRES_USER", "postgres"),
+    "POSTGRES_PW": os.environ.get("MDA_TEST_POSTGRES_PW", ""),
+    "POSTGRES_URL": url,
+    "POSTGRES_DB": database,
+    "RESET_DB": "true",
+    "KAFKA_HOST": "localhost",
+    "KAFKA_PORT": "9092",
+    "KAFKA_TRANSPORT": "memory",
+    "LOG_FILE": os.path.join(work, "mda.json"),
+    "OPERATOR_PRIVATE_KEY": os.path.join(work, "operator_private.pem"),
+    "OPERATOR_PUBLIC_KEY": os.path.join(work, "operator_public.pem"),
+    "CATCHUP_ENABLED": "false"
+  })
+  env.update(extra)
+  return env
+
+# The app started in this process (one per test session, its configuration is read on import)
+@pytest.fixture(scope="session")
+def mda():
+  os.environ.update(postgres_env("mda_test"))
+  from app import main
+  yield main
@@ -0,0 +1,55 @@
+import datetime, math, uuid
+import pytest
+from app.aggregation import RunningAggregate, StreamingAggregator
+
+methods = ['SUM', 'AVG', 'MIN', 'MAX', 'COUNT', 'STDDEV']
+
+def aggregate(values):
+  state = RunningAggregate()
+  for value in values:
+    state.add(value)
+  return state
+
+def test_results_of_every_method():
+  state = aggregate([1.0, 2.0, 3.0, 6.0])
+  assert [state.result(method) for method in methods[:5]] == [12.0, 3.0, 1.0, 6.0, 4]
+  # Sample standard deviation, as stddev() in SQL
+  assert state.result('STDDEV') == pytest.approx(math.sqrt(14.0 / 3))
+  assert state.result('avg') == 3.0
+
+# NULL in SQL for every method but COUNT
+def test_empty_bucket():
+  state = RunningAggregate()
+  assert [state.result(method) for method in methods] == [None, None, None, None, 0, None]
+
+def test_single_sample():
+  state = aggregate([2.5])
+  assert [state.result(method) for method in methods] == [2.5, 2.5, 2.5, 2.5, 1, None]
+
+def test_unknown_method():
+  with pytest.raises(ValueError):
+    aggregate([1.0]).result('MEDIAN')
+
+# Bucket ending at `bucket` holds timestamp >= bucket - step and < bucket, as the SQL query
+def test_sample_on_a_boundary_goes_to_the_next_bucket():
+  aggregator = StreamingAggregator()
+  metric_id = uuid.uuid4()
+  start = datetime.datetime(2026, 1, 1)
+  step = datetime.timedelta(minutes=5)
+  for timestamp, value in [(start, 1.0), (start + step - datetime.timedelta(microseconds=1), 2.0), (start + step, 10.0), (start + 2 * step, 100.0)]:
+    aggregator.add(metric_id, value, timestamp, start, step.total_seconds())
+  assert aggregator.pop(metric_id, start + step).result('SUM') == 3.0
+  assert aggregator.pop(metric_id, start + 2 * step).result('SUM') == 10.0
+  assert aggregator.pop(metric_id, start + 3 * step).result('SUM') == 100.0
+  assert aggregator.pop(metric_id, start + 3 * step) == None
+
+def test_older_buckets_are_dropped_past_keep():
+  aggregator = StreamingAggregator()
+  metric_id = uuid.uuid4()
+  start = datetime.datetime(2026, 1, 1)
+  for minutes in [1, 6, 11]:
+    aggregator.add(metric_id, 1.0, start + datetime.timedelta(minutes=minutes), start, 300)
+  # Bucket ending at start + 15m popped, the one ending at start + 5m is older than keep
+  assert aggregator.pop(metric_id, start + datetime.timedelta(minutes=15), keep=datetime.timedelta(minutes=5)).result('COUNT') == 1
+  assert aggregator.pop(metric_id, start + datetime.timedelta(minutes=5)) == None
+  assert aggregator.pop(metric_id, start + datetime.timedelta(minutes=10)).result('COUNT') == 1
@@ -0,0 +1,101 @@
+import datetime, json, os, subprocess, sys
+import pytest
+from conftest import postgres_env
+from app.aggregation import RunningAggregate, StreamingAggregator
+
+# The backend is resolved when the app is imported, each case runs in a process of its own.
+# The script creates an aggregated metric, writes raw values of one bucket and reads its aggregation.
+script = '''
+import datetime, json
+from app import main, database
+now = datetime.datetime.now().replace(second=0, microsecond=0)
+start = now - datetime.timedelta(minutes=10)
+config = main.Config_Model(businessID='business', topic='topic', networkID=1, tenantID='tenant', resourceID='resource', referenceID='reference',
+                           timestampStart=start, metrics=[main.Metric_Model(metricName='cpu', metricType='float', step='1m', aggregationMethod='AVG', step_aggregation='5m')])
+created = database.add_config(config)
+metric_id = database.db_session.execute("SELECT _id FROM metric WHERE config_id = :config_id;", {'config_id': created['id']}).scalar()
+for minute, value in enumerate([1.0, 2.0, 3.0, 6.0]):
+  database.insert_metric_value(metric_id, value, start + datetime.timedelta(minutes=minute + 1))
+# Next bucket value, outside of the aggregated one
+database.insert_metric_value(metric_id, 100.0, start + datetime.timedelta(minutes=6))
+bucket = start + datetime.timedelta(minutes=5)
+result = {
+  'backend': database.AGGREGATION_BACKEND,
+  'partitioned': database.db_session.execute("SELECT count(*) FROM pg_partitioned_table WHERE partrelid = 'value'::regclass;").scalar() == 1,
+  'avg': database.get_last_aggregation(metric_id, 'AVG', bucket, '5m'),
+  'count': database.get_last_aggregation(metric_id, 'COUNT', bucket, '5m'),
+}
+if database.AGGREGATION_BACKEND == 'timescaledb':
+  result['hypertable'] = database.db_session.execute("SELECT count(*) FROM timescaledb_information.hypertables WHERE hypertable_name = 'value';").scalar() == 1
+  result['view'] = database.db_session.execute("SELECT count(*) FROM timescaledb_information.continuous_aggregates WHERE view_name = :view;",
+                                               {'view': database.aggregate_view_name(metric_id, 'AVG')}).scalar() == 1
+else:
+  # Metric without a continuous aggregate read as if TimescaleDB was enabled: the raw value query answers
+  database.AGGREGATION_BACKEND = 'timescaledb'
+  result['fallback_avg'] = database.get_last_aggregation(metric_id, 'AVG', bucket, '5m')
+print('RESULT ' + json.dumps(result))
+'''
+
+def run_app(database, backend):
+  env = postgres_env(database, AGGREGATION_BACKEND=backend)
+  completed = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env=env,
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=120)
+  lines = [line for line in completed.stdout.decode('utf-8').splitlines() if line.startswith('RESULT ')]
+  assert lines, completed.stdout.decode('utf-8')
+  return json.loads(lines[-1][len('RESULT '):])
+
+def timescaledb_installed():
+  import psycopg2
+  env = postgres_env('postgres')
+  host, port = (env['POSTGRES_URL'].split(':') + ['5432'])[:2]
+  conn = psycopg2.connect(host=host, port=port, user=env['POSTGRES_USER'], password=env['POSTGRES_PW'], dbname='postgres')
+  try:
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'timescaledb';")
+    return cursor.fetchone() != None
+  finally:
+    conn.close()
+
+def test_plain_postgres_falls_back_to_partitioned_values():
+  if timescaledb_installed():
+    pytest.skip("TimescaleDB is installed, the fallback is not taken")
+  result = run_app('mda_test_postgres', 'auto')
+  assert result['backend'] == 'postgres'
+  assert result['partitioned']
+  assert result['avg'] == 3.0 and result['count'] == 4
+  assert result['fallback_avg'] == 3.0
+
+def test_timescaledb_reads_the_continuous_aggregate():
+  if not timescaledb_installed():
+    pytest.skip("TimescaleDB extension is not installed")
+  result = run_app('mda_test_timescaledb', 'auto')
+  assert result['backend'] == 'timescaledb'
+  assert result['hypertable'] and result['view']
+  assert not result['partitioned']
+  assert result['avg'] == 3.0 and result['count'] == 4
+
+# Streaming aggregation against the SQL query over the same raw values, samples on both edges of the bucket
+def test_streaming_aggregation_matches_the_sql_query(mda):
+  from app import database
+  now = datetime.datetime.now().replace(second=0, microsecond=0)
+  start = now - datetime.timedelta(minutes=20)
+  config = mda.Config_Model(businessID='business', topic='topic', networkID=1, tenantID='tenant', resourceID='resource', referenceID='reference', timestampStart=start,
+                            metrics=[mda.Metric_Model(metricName='cpu', metricType='float', step='1m', aggregationMethod='AVG', step_aggregation='5m')])
+  created = database.add_config(config)
+  metric_id = database.db_session.execute("SELECT _id FROM metric WHERE config_id = :config_id;", {'config_id': created['id']}).scalar()
+  aggregator = StreamingAggregator()
+  samples = [(0, 1.5), (60, 2.0), (120, -3.25), (240, 7.0), (299, 0.5), (300, 100.0), (420, 4.0)]
+  for seconds, value in samples:
+    timestamp = start + datetime.timedelta(seconds=seconds)
+    database.insert_metric_value(metric_id, value, timestamp)
+    aggregator.add(metric_id, value, timestamp, start, 300)
+  # Two full buckets and an empty one
+  for minutes in [5, 10, 15]:
+    bucket = start + datetime.timedelta(minutes=minutes)
+    state = aggregator.pop(metric_id, bucket) or RunningAggregate()
+    for method in ['SUM', 'AVG', 'MIN', 'MAX', 'COUNT', 'STDDEV']:
+      expected = database.get_last_aggregation(metric_id, method, bucket, '5m')
+      if expected == None:
+        assert state.result(method) == None, (minutes, method)
+      else:
+        assert state.result(method) == pytest.approx(float(expected)), (minutes, method)
@@ -0,0 +1,19 @@
+import time
+from app.cache import ConfigCache
+
+def test_etag_changes_with_the_version():
+  cache = ConfigCache()
+  etag, body = cache.put('config', cache.version('config'), '{"next_run_at": 1}')
+  assert cache.get('config') == (etag, body)
+  cache.invalidate('config')
+  assert cache.get('config') == None
+  assert cache.put('config', cache.version('config'), '{"next_run_at": 1}')[0] != etag
+
+# Schedule advanced by another process: the body reloaded after the expiry is not served as the previous one
+def test_expired_entry_reloaded_with_another_body_gets_another_etag():
+  cache = ConfigCache(ttl=0.05)
+  etag = cache.put('config', cache.version('config'), '{"next_run_at": 1}')[0]
+  time.sleep(0.1)
+  assert cache.get('config') == None
+  assert cache.put('config', cache.version('config'), '{"next_run_at": 2}')[0] != etag
+  assert cache.put('config', cache.version('config'), '{"next_run_at": 1}')[0] == etag
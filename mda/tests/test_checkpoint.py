@@ -0,0 +1,23 @@
+import datetime, time, uuid
+from app.checkpoint import ScheduleCheckpoint
+from test_writer import Database
+
+def test_schedule_is_kept_and_the_checkpoints_survive_when_the_database_is_unreachable():
+  database = Database()
+  checkpoint = ScheduleCheckpoint(database, interval=0.05)
+  metric_id = uuid.uuid4()
+  next_run_at = datetime.datetime(2026, 1, 1)
+  checkpoint.activate(metric_id)
+  database.unreachable = True
+  checkpoint.advance(metric_id, next_run_at, None, 1)
+  checkpoint.flush()
+  assert checkpoint.dirty == {metric_id: (next_run_at, None, 1)}
+  # Checkpoints of the background thread fail as well
+  time.sleep(0.3)
+  assert checkpoint.thread.is_alive()
+  database.unreachable = False
+  deadline = time.time() + 5
+  while checkpoint.written < 1 and time.time() < deadline:
+    time.sleep(0.05)
+  assert database.rows == [(str(metric_id), next_run_at, None, 1)]
+  checkpoint.close()
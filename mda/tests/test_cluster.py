@@ -0,0 +1,156 @@
+import collections, datetime, http.server, json, os, signal, socket, subprocess, sys, threading, time, urllib.parse
+import psycopg2
+import pytest
+import requests
+from conftest import postgres_env
+
+# Several nodes in lease mode against one database and an OSM stub recording every tick
+STEP = 1
+
+class OSMStub(http.server.BaseHTTPRequestHandler):
+  ticks = collections.defaultdict(list)
+  lock = threading.Lock()
+
+  def do_GET(self):
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+    start = query['start'][0]
+    with self.lock:
+      for name in query['match']:
+        self.ticks[name].append((datetime.datetime.fromisoformat(start), time.time()))
+    body = json.dumps({'status': 'success', 'data': {'resultType': 'matrix', 'result': [
+      {'metric': {'__name__': name}, 'values': [[start, '1.0']]} for name in query['match']]}}).encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    return
+
+def query(sql):
+  env = postgres_env('mda_cluster_test')
+  host, port = (env['POSTGRES_URL'].split(':') + ['5432'])[:2]
+  conn = psycopg2.connect(host=host, port=port, user=env['POSTGRES_USER'], password=env['POSTGRES_PW'], dbname='mda_cluster_test')
+  try:
+    cursor = conn.cursor()
+    cursor.execute(sql)
+    return cursor.fetchall()
+  finally:
+    conn.close()
+
+def free_port():
+  with socket.socket() as sock:
+    sock.bind(('127.0.0.1', 0))
+    return sock.getsockname()[1]
+
+class Node(object):
+  def __init__(self, node_id, osm_port, reset, renew_interval):
+    self.port = free_port()
+    self.url = 'http://127.0.0.1:' + str(self.port)
+    env = postgres_env('mda_cluster_test', RESET_DB='true' if reset else 'false', CLUSTER_MODE='lease', NODE_ID=node_id,
+                       LEASE_TTL=str(3 * renew_interval), LEASE_RENEW_INTERVAL=str(renew_interval), CHECKPOINT_INTERVAL='1',
+                       OSM_ENDPOINT='http://127.0.0.1:' + str(osm_port) + '/monitoringData')
+    self.process = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'app.main:app', '--port', str(self.port), '--log-level', 'warning'],
+                                    cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env=env,
+                                    stdout=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while True:
+      assert self.process.poll() == None and time.time() < deadline
+      try:
+        requests.get(self.url + '/stats/leases', timeout=1)
+        return
+      except requests.exceptions.RequestException:
+        time.sleep(0.2)
+
+  def leases(self):
+    return requests.get(self.url + '/stats/leases', timeout=5).json()
+
+  # Graceful leave: the leases are given back once the schedule is checkpointed
+  def stop(self):
+    if self.process.poll() == None:
+      self.process.send_signal(signal.SIGTERM)
+      self.process.wait(30)
+
+@pytest.fixture
+def osm():
+  OSMStub.ticks.clear()
+  server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), OSMStub)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  yield server.server_address[1]
+  server.shutdown()
+
+@pytest.fixture
+def nodes(osm):
+  postgres_env('mda_cluster_test')
+  started = []
+  def start(node_id, renew_interval=2):
+    node = Node(node_id, osm, not started, renew_interval)
+    started.append(node)
+    return node
+  yield start
+  for node in started:
+    node.stop()
+
+def create_configs(node, configs, metrics):
+  start = (datetime.datetime.now() + datetime.timedelta(seconds=2)).replace(microsecond=0)
+  body = [{'businessID': 'business', 'topic': 'cluster', 'networkID': 1, 'tenantID': 'tenant', 'resourceID': 'resource', 'referenceID': 'reference' + str(config),
+           'timestampStart': start.isoformat(), 'metrics': [{'metricName': 'c' + str(config) + 'm' + str(metric), 'metricType': 'float', 'step': str(STEP) + 's'} for metric in range(metrics)]}
+          for config in range(configs)]
+  response = requests.post(node.url + '/settings/batch', json=body, timeout=30)
+  assert response.status_code == 201
+  return response.json()
+
+def wait_balanced(nodes, total, timeout=60):
+  deadline = time.time() + timeout
+  while True:
+    owned = [node.leases()['owned'] for node in nodes]
+    if sum(owned) == total and max(owned) - min(owned) <= 1 and all(node.leases()['nodes'] == len(nodes) for node in nodes):
+      return owned
+    assert time.time() < deadline, owned
+    time.sleep(0.5)
+
+def test_leases_are_shared_and_exclusive(nodes):
+  first = nodes('node-a')
+  create_configs(first, 4, 5)
+  assert wait_balanced([first], 20) == [20]
+  second, third = nodes('node-b'), nodes('node-c')
+  assert sorted(wait_balanced([first, second, third], 20)) == [6, 7, 7]
+  # Every metric leased to exactly one node, the one scheduling it
+  owners = collections.Counter(row[0] for row in query("SELECT owner FROM metric WHERE status = 1;"))
+  assert owners == dict((node.leases()['node'], node.leases()['owned']) for node in [first, second, third])
+
+# Ticks are fetched once each, without gaps, while nodes join and leave
+def test_no_tick_is_lost_or_repeated_across_joins_and_leaves(nodes):
+  first = nodes('node-a')
+  create_configs(first, 2, 5)
+  wait_balanced([first], 10)
+  time.sleep(3)
+  second = nodes('node-b')
+  wait_balanced([first, second], 10)
+  time.sleep(3)
+  first.stop()
+  wait_balanced([second], 10)
+  time.sleep(3)
+  second.stop()
+  with OSMStub.lock:
+    ticks = dict((name, sorted(start for start, fetched in fetches)) for name, fetches in OSMStub.ticks.items())
+  assert len(ticks) == 10
+  for name, starts in ticks.items():
+    assert len(starts) == len(set(starts)), name + ' fetched twice'
+    expected = int((starts[-1] - starts[0]).total_seconds()) // STEP + 1
+    assert len(starts) == expected, name + ' has gaps'
+
+# Disabled through a node not owning every metric: the owners stop at once, not at their next renewal
+def test_disable_on_another_node_stops_the_owner(nodes):
+  # Renewals far apart, a missed change would keep the owner ticking for seconds
+  first, second = nodes('node-a', 5), nodes('node-b', 5)
+  created = create_configs(first, 1, 10)
+  wait_balanced([first, second], 10)
+  time.sleep(2)
+  assert requests.put(second.url + '/settings/' + created[0]['config']['id'] + '/disable', timeout=10).status_code == 200
+  disabled = time.time()
+  time.sleep(3)
+  with OSMStub.lock:
+    late = [(name, fetched - disabled) for name, fetches in OSMStub.ticks.items() for start, fetched in fetches if fetched > disabled + 0.5]
+  assert late == []
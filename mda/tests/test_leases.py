@@ -0,0 +1,106 @@
+import datetime, threading, time
+from app.lease import LeaseManager
+
+def wait_for(event):
+  assert event.wait(10)
+
+def wait_owned(manager, metric_ids):
+  deadline = time.time() + 10
+  while not manager.owned.issuperset(metric_ids):
+    assert time.time() < deadline
+    time.sleep(0.05)
+
+def lease_manager(mda, node_id, **callbacks):
+  manager = LeaseManager(mda.engine, node_id, ttl=30, interval=0.2, **callbacks)
+  manager.start()
+  return manager
+
+def start_config(mda, metrics=1):
+  start = datetime.datetime.now() + datetime.timedelta(days=1)
+  return mda.Config_Model(businessID='business', topic='topic', networkID=1, tenantID='tenant', resourceID='resource', referenceID='reference', timestampStart=start,
+                          metrics=[mda.Metric_Model(metricName='cpu' + str(metric), metricType='float', step='1m') for metric in range(metrics)])
+
+# Config changed on node b: node a, scheduling the metrics, drops them as the change commits
+def test_owner_drops_the_metrics_changed_by_another_node(mda, monkeypatch):
+  from app import database
+  created = database.add_config(start_config(mda, 2))
+  metric_ids = [row[0] for row in database.db_session.execute("SELECT _id FROM metric WHERE config_id = :config_id;", {'config_id': created['id']})]
+  lost = []
+  notified = threading.Event()
+  manager = lease_manager(mda, 'a', on_claim=lambda ids: None, on_stop=lambda ids: None, on_release=lambda ids: None,
+                          on_lost=lambda ids: (lost.extend(ids), notified.set()), on_renew=lambda rows: None)
+  try:
+    # Only node: every active metric is leased to it
+    wait_owned(manager, metric_ids)
+    monkeypatch.setattr(database, 'CLUSTER_MODE', 'lease')
+    monkeypatch.setattr(database, 'NODE_ID', 'b')
+    assert database.disable_config(created['id']) != -1
+    wait_for(notified)
+    assert sorted(lost) == sorted(metric_ids)
+    assert manager.owned.isdisjoint(metric_ids)
+  finally:
+    manager.stopped.set()
+    manager.thread.join()
+    manager.listener.join()
+
+def test_end_update_reaches_the_other_nodes(mda, monkeypatch):
+  from app import database
+  created = database.add_config(start_config(mda))
+  ended = []
+  notified = threading.Event()
+  manager = lease_manager(mda, 'a', on_claim=lambda ids: None, on_stop=lambda ids: None, on_release=lambda ids: None,
+                          on_lost=lambda ids: None, on_renew=lambda rows: None, on_end=lambda config_id, end: (ended.append((config_id, end)), notified.set()))
+  try:
+    monkeypatch.setattr(database, 'CLUSTER_MODE', 'lease')
+    monkeypatch.setattr(database, 'NODE_ID', 'b')
+    end = datetime.datetime.now() + datetime.timedelta(days=2)
+    assert database.update_config(created['id'], mda.Update_Config_Model(timestampEnd=end)) != -1
+    wait_for(notified)
+    assert ended == [(created['id'], end)]
+  finally:
+    manager.stopped.set()
+    manager.thread.join()
+    manager.listener.join()
+
+# Database reachable only while `blocked` is not set
+class Blockable(object):
+  def __init__(self, engine):
+    self.engine = engine
+    self.blocked = False
+
+  def raw_connection(self):
+    if self.blocked:
+      raise Exception('database unreachable')
+    return self.engine.raw_connection()
+
+# Node cut from the database: it stops its metrics before the leases can expire, and loads them again once it renews
+def test_node_unable_to_renew_stops_before_its_leases_expire(mda):
+  from app import database
+  created = database.add_config(start_config(mda, 2))
+  metric_ids = [row[0] for row in database.db_session.execute("SELECT _id FROM metric WHERE config_id = :config_id;", {'config_id': created['id']})]
+  engine = Blockable(mda.engine)
+  lost = []
+  claimed = []
+  stopped = threading.Event()
+  reloaded = threading.Event()
+  manager = LeaseManager(engine, 'a', ttl=3, interval=0.2, margin=1.0,
+                         on_claim=lambda ids: (claimed.extend(ids), reloaded.set() if stopped.is_set() else None), on_stop=lambda ids: None,
+                         on_release=lambda ids: None, on_lost=lambda ids: (lost.extend(ids), stopped.set()), on_renew=lambda rows: None)
+  manager.start()
+  try:
+    wait_owned(manager, metric_ids)
+    renewed_at = manager.renewed_at
+    engine.blocked = True
+    wait_for(stopped)
+    # Within ttl - margin of the last renewal, before any other node may claim the metrics
+    assert time.monotonic() - renewed_at < 3
+    assert set(metric_ids).issubset(lost) and manager.stats()['fenced']
+    del claimed[:]
+    engine.blocked = False
+    wait_for(reloaded)
+    assert set(metric_ids).issubset(claimed) and not manager.stats()['fenced']
+  finally:
+    manager.stopped.set()
+    manager.thread.join()
+    manager.listener.join()
+    manager.watchdog.join()
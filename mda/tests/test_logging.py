@@ -0,0 +1,17 @@
+import logging
+from app.logger import EventSampler
+
+# Default LOG_LEVEL=INFO: payloads and sampled per-tick events are written
+def test_events_without_status_are_logged_at_info(mda, monkeypatch):
+  records = []
+  handler = logging.Handler()
+  handler.emit = records.append
+  monkeypatch.setattr(mda, 'log_sampler', EventSampler({'fetch': 1.0}))
+  mda.logger.addHandler(handler)
+  try:
+    mda.info_log(None, 'Response from OSM: {}', 'payload')
+    mda.info_log(None, 'Start Fetching Values of Metrics: []', 'fetch')
+  finally:
+    mda.logger.removeHandler(handler)
+  assert mda.logger.getEffectiveLevel() == logging.INFO
+  assert [(record.getMessage(), record.levelno) for record in records] == [('Response from OSM: {}', logging.INFO), ('Start Fetching Values of Metrics: []', logging.INFO)]
@@ -0,0 +1,68 @@
+import datetime, threading, time, uuid
+from app.jobs import MetricRecord, ScheduledJob
+from app.osm_client import OSMClient, ReplayBuffer
+
+class Response(object):
+  status_code = 200
+
+# First request of each tick answers after `slow` seconds, its hedge at once
+class SlowFirstSession(object):
+  def __init__(self, slow):
+    self.slow = slow
+    self.seen = set()
+    self.lock = threading.Lock()
+
+  def get(self, endpoint, params=None, timeout=None):
+    with self.lock:
+      first = params not in self.seen
+      self.seen.add(params)
+    if first:
+      time.sleep(self.slow)
+    return Response()
+
+# Every caller blocked on a slow first request still gets its hedge sent on time
+def test_hedges_do_not_queue_behind_the_first_requests():
+  callers = 8
+  client = OSMClient('http://osm', SlowFirstSession(1.0), timeout=5, deadline=5, hedge_after=0.05, hedge_workers=2 * callers)
+  elapsed = []
+  def fetch(tick):
+    started = time.time()
+    client.fetch(tick)
+    elapsed.append(time.time() - started)
+  threads = [threading.Thread(target=fetch, args=(tick,)) for tick in range(callers)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  client.close()
+  assert len(elapsed) == callers and max(elapsed) < 0.5
+
+def test_replayed_ticks_stay_pending_until_done():
+  metric = MetricRecord(uuid.uuid4(), 'cpu', 'AVG', '1m', '1h', None)
+  tick = datetime.datetime(2026, 1, 1, 10, 30)
+  replay = ReplayBuffer()
+  replay.add(([metric], None, tick))
+  assert replay.pending(metric.metric_id, datetime.datetime(2026, 1, 1, 11))
+  assert not replay.pending(metric.metric_id, datetime.datetime(2026, 1, 1, 10))
+  entry = replay.pop()
+  assert replay.pending(metric.metric_id, datetime.datetime(2026, 1, 1, 11))
+  replay.done(entry)
+  assert not replay.pending(metric.metric_id, datetime.datetime(2026, 1, 1, 11))
+
+class Queued(list):
+  put = list.append
+
+# The bucket of a failed tick is published once the tick is replayed
+def test_aggregation_waits_for_the_replay(mda, monkeypatch):
+  queued = Queued()
+  monkeypatch.setattr(mda, 'wait_queue', queued)
+  monkeypatch.setattr(mda, 'osm_replay', ReplayBuffer())
+  metric = MetricRecord(uuid.uuid4(), 'cpu', 'AVG', '1m', '1h', None)
+  bucket = datetime.datetime(2026, 1, 1, 11)
+  item = ScheduledJob(bucket, bucket, 1, metric)
+  assert not mda.aggregation_held(item)
+  mda.osm_replay.add(([metric], None, datetime.datetime(2026, 1, 1, 10, 30)))
+  assert mda.aggregation_held(item)
+  assert [(job.aggregation, job.next_aggregation, job.metric) for job in queued] == [(1, bucket, metric)]
+  mda.osm_replay.done(mda.osm_replay.pop())
+  assert not mda.aggregation_held(item)
@@ -0,0 +1,26 @@
+import datetime, uuid
+from app.jobs import MetricRecord, config_record
+
+def records(mda, topic):
+  mda.publisher.flush()
+  return [value for key, value, headers in mda.publisher.start().topics.get(topic, [])]
+
+def test_raw_value_carries_config_identity(mda):
+  config = config_record(uuid.uuid4(), 'business1', 'topic-raw', 'network1', 'tenant1', 'resource1', 'reference1', datetime.datetime(2021, 1, 1), None)
+  metric = MetricRecord(uuid.uuid4(), 'cpu_utilization', None, '1m', None, config)
+  mda.publish_metric_value(metric, 0.5, config, datetime.datetime(2021, 1, 1, 0, 1))
+  sent = records(mda, 'topic-raw')
+  assert len(sent) == 1
+  assert b'"operatorID": "tenant1"' in sent[0]
+  assert b'"businessID": "business1"' in sent[0]
+  assert b'"networkID": "network1"' in sent[0]
+
+def test_aggregation_carries_config_identity(mda, monkeypatch):
+  config = config_record(uuid.uuid4(), 'business2', 'topic-aggregation', 'network2', 'tenant2', 'resource2', 'reference2', datetime.datetime(2021, 1, 1), None)
+  metric = MetricRecord(uuid.uuid4(), 'cpu_utilization', 'AVG', '1m', '5m', config)
+  monkeypatch.setattr(mda, 'compute_aggregation', lambda *args: 0.25)
+  assert mda.aggregation_publish(metric, config, datetime.datetime(2021, 1, 1, 0, 5)) == 1
+  sent = records(mda, 'topic-aggregation')
+  assert len(sent) == 1
+  assert b'"operatorID": "tenant2"' in sent[0]
+  assert b'"aggregationMethod": "AVG"' in sent[0]
@@ -0,0 +1,35 @@
+import datetime
+from fastapi.testclient import TestClient
+from prometheus_client.parser import text_string_to_metric_families
+
+def config(step='1m', step_aggregation='5m'):
+  start = datetime.datetime.now() + datetime.timedelta(days=1)
+  return {'businessID': 'business', 'topic': 'topic', 'networkID': 1, 'tenantID': 'tenant', 'resourceID': 'resource', 'referenceID': 'reference',
+          'timestampStart': start.isoformat(), 'metrics': [{'metricName': 'cpu', 'metricType': 'float', 'step': step,
+                                                             'aggregationMethod': 'AVG', 'step_aggregation': step_aggregation}]}
+
+# Steps not parsed by convert_to_seconds are errors of their item, the rest of the batch is created
+def test_batch_reports_invalid_steps_per_item(mda):
+  client = TestClient(mda.app)
+  response = client.post('/settings/batch', json=[config(), config(step_aggregation='1hour'), config(step='0s'), config(step='m')])
+  assert response.status_code == 201
+  results = response.json()
+  assert results[0]['status'] == 'Success'
+  assert [result['status'] for result in results[1:]] == ['Error'] * 3
+  assert all('Step and step aggregation' in result['message'] for result in results[1:])
+
+def test_invalid_step_is_rejected(mda):
+  client = TestClient(mda.app)
+  response = client.post('/settings', json=config(step='5x'))
+  assert response.status_code == 404 and 'Step and step aggregation' in response.json()['message']
+
+def api_writes(client):
+  text = client.get('/metrics').text
+  return sum(sample.value for family in text_string_to_metric_families(text) for sample in family.samples
+             if sample.name == 'mda_db_commit_seconds_count' and sample.labels.get('operation') == 'api')
+
+def test_rest_writes_are_timed(mda):
+  client = TestClient(mda.app)
+  before = api_writes(client)
+  assert client.post('/settings', json=config()).status_code == 201
+  assert api_writes(client) == before + 1
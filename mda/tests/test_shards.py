@@ -0,0 +1,53 @@
+import datetime, queue, uuid
+from app.jobs import MetricRecord, ScheduledJob, config_record, config_records
+from app.shards import ShardRing, ShardRouter
+
+def drain(commands):
+  received = []
+  while True:
+    try:
+      received.append(commands.get(timeout=1))
+    except queue.Empty:
+      return received
+
+def test_ring_spreads_metrics_over_every_shard():
+  ring = ShardRing(4)
+  owners = [ring.owner(uuid.uuid4()) for i in range(4000)]
+  for shard in range(4):
+    assert 700 < owners.count(shard) < 1300
+
+def test_end_update_reaches_every_shard(mda, monkeypatch):
+  from app import database
+  start = datetime.datetime.now() + datetime.timedelta(days=1)
+  config = mda.Config_Model(businessID='business', topic='topic', networkID=1, tenantID='tenant', resourceID='resource', referenceID='reference',
+                            timestampStart=start, metrics=[mda.Metric_Model(metricName='cpu', metricType='float', step='1m')])
+  created = database.add_config(config)
+  router = ShardRouter(2)
+  monkeypatch.setattr(database, 'wait_queue', router)
+  monkeypatch.setattr(database, 'api_process', True)
+  end = start + datetime.timedelta(hours=1)
+  assert database.update_config(created['id'], mda.Update_Config_Model(timestampEnd=end)) != -1
+  for commands in router.commands:
+    assert ('config_end', (created['id'], end)) in drain(commands)
+
+def test_shard_applies_the_end_to_its_record(mda):
+  config_id = uuid.uuid4()
+  record = config_record(config_id, 'business', 'topic', 1, 'tenant', 'resource', 'reference', datetime.datetime(2021, 1, 1), None)
+  job = ScheduledJob(datetime.datetime(2021, 1, 1), None, 0, MetricRecord(uuid.uuid4(), 'cpu', None, '1m', None, record))
+  end = datetime.datetime(2021, 1, 2)
+  mda.apply_shard_command('config_end', (config_id, end))
+  assert config_records[config_id].timestamp_end == end
+  assert job.metric.config.timestamp_end == end
+
+def test_metrics_of_every_process_are_labelled():
+  from prometheus_client import CollectorRegistry, Counter, generate_latest
+  from prometheus_client.parser import text_string_to_metric_families
+  from app.telemetry import merged_payload
+  payloads = []
+  for process, count in [('api', 0), ('0', 3), ('1', 4)]:
+    registry = CollectorRegistry()
+    Counter('mda_ticks_total', 'Ticks', registry=registry).inc(count)
+    payloads.append((process, generate_latest(registry).decode('utf-8')))
+  content, content_type = merged_payload(payloads)
+  samples = [sample for family in text_string_to_metric_families(content.decode('utf-8')) for sample in family.samples if sample.name == 'mda_ticks_total']
+  assert dict((sample.labels['process'], sample.value) for sample in samples) == {'api': 0, '0': 3, '1': 4}
@@ -0,0 +1,80 @@
+import copy
+import pytest
+import rsa
+from app.merkle import merkle_levels, merkle_proof, verify_proof
+from app.signing import BatchSigner, RecordSigner, record_digest, verify_batch_record, verify_record
+
+@pytest.fixture(scope="module")
+def signer():
+  public, private = rsa.newkeys(1024)
+  signer = RecordSigner(private.save_pkcs1().decode('utf-8'))
+  yield signer
+  signer.close()
+
+def records(count):
+  return [{"data": {"metricName": "cpu", "metricValue": str(value), "resourceID": "resource", "referenceID": "reference", "timestamp": "2026-01-01 10:00:0" + str(value)}}
+          for value in range(count)]
+
+# Batch of records as published: (record, key, value)
+def signed_batch(signer, count=5):
+  published = []
+  batch_signer = BatchSigner(signer, lambda topic, key=None, value=None: published.append((key, value)), window=60)
+  batch = records(count)
+  for record in batch:
+    batch_signer.add('topic', record, {"monitoringData": record["data"]})
+  batch_signer.close()
+  return [(record, key, value) for record, (key, value) in zip(batch, published)]
+
+def test_single_record_signature(signer):
+  record = records(1)[0]
+  digest, signature = signer.sign(record)
+  assert verify_record(record, signature, signer.public_key)
+  tampered = copy.deepcopy(record)
+  tampered["data"]["metricValue"] = "9"
+  assert not verify_record(tampered, signature, signer.public_key)
+
+def test_batch_records_verify_and_have_their_own_key(signer):
+  batch = signed_batch(signer)
+  for record, key, value in batch:
+    assert verify_batch_record(record, value, signer.public_key)
+    assert key == record_digest(record)
+  assert len(set(key for record, key, value in batch)) == len(batch)
+
+def test_tampered_record_is_rejected(signer):
+  record, key, value = signed_batch(signer)[2]
+  tampered = copy.deepcopy(record)
+  tampered["data"]["metricValue"] = "9"
+  assert not verify_batch_record(tampered, value, signer.public_key)
+
+def test_tampered_proof_is_rejected(signer):
+  record, key, value = signed_batch(signer)[2]
+  side, sibling = value["signature"]["merkleProof"][0]
+  value["signature"]["merkleProof"][0] = [side, ('0' if sibling[0] != '0' else '1') + sibling[1:]]
+  assert not verify_batch_record(record, value, signer.public_key)
+
+def test_record_of_another_batch_is_rejected(signer):
+  record, key, value = signed_batch(signer)[4]
+  other_record, other_key, other_value = signed_batch(signer, 3)[0]
+  # Proof and root of another batch, correctly signed
+  assert not verify_batch_record(record, other_value, signer.public_key)
+
+def test_tampered_root_is_rejected(signer):
+  record, key, value = signed_batch(signer)[1]
+  # Root rebuilt over other records, with the proof of this record against it
+  levels = merkle_levels([record_digest(record)] + [record_digest(other) for other in records(3)])
+  value["signature"]["merkleRoot"] = levels[-1][0].hex()
+  value["signature"]["merkleProof"] = merkle_proof(levels, 0)
+  assert verify_proof(record_digest(record), value["signature"]["merkleProof"], levels[-1][0])
+  assert not verify_batch_record(record, value, signer.public_key)
+
+@pytest.mark.parametrize("proof", [None, 5, [None], [['l']], [['l', 5]], [['l', 'zz']], 'lr'])
+def test_malformed_proof_is_rejected(signer, proof):
+  record, key, value = signed_batch(signer, 2)[0]
+  value["signature"]["merkleProof"] = proof
+  assert not verify_batch_record(record, value, signer.public_key)
+
+def test_missing_signature_is_rejected(signer):
+  record, key, value = signed_batch(signer, 1)[0]
+  del value["signature"]
+  assert not verify_batch_record(record, value, signer.public_key)
+  assert not verify_batch_record(record, {"signature": {"merkleRoot": 5, "merkleProof": [], "rootSignature": None}}, signer.public_key)
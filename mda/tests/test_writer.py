@@ -0,0 +1,91 @@
+import datetime, time
+from app.writer import ValueWriter
+
+# Connection whose writes fail while `down` is set, committed rows are kept
+class Database(object):
+  def __init__(self):
+    self.down = False
+    self.unreachable = False
+    self.rows = []
+
+  def raw_connection(self):
+    if self.unreachable:
+      raise Exception('could not connect to server')
+    return Connection(self)
+
+class Connection(object):
+  def __init__(self, database):
+    self.database = database
+    self.pending = []
+    # Cursor and connection in one, as execute_values uses them
+    self.connection = self
+    self.encoding = 'UTF8'
+
+  def cursor(self):
+    return self
+
+  def mogrify(self, template, args):
+    self.pending.append(args)
+    return b'()'
+
+  def execute(self, sql, args=None):
+    if self.database.down:
+      raise Exception('database is down')
+
+  def commit(self):
+    self.database.rows.extend(self.pending)
+
+  def rollback(self):
+    self.pending = []
+
+  def close(self):
+    return
+
+def add(writer, count, offset=0):
+  for index in range(offset, offset + count):
+    writer.add('metric', float(index), datetime.datetime(2026, 1, 1) + datetime.timedelta(seconds=index))
+
+def test_failed_rows_are_written_by_the_next_flush():
+  database = Database()
+  writer = ValueWriter(database, max_rows=100, flush_rows=1000, interval=3600)
+  database.down = True
+  add(writer, 10)
+  writer.flush()
+  assert database.rows == [] and writer.stats() == {'buffered': 10, 'written': 0, 'dropped': 0}
+  add(writer, 5, 10)
+  database.down = False
+  writer.flush()
+  # Oldest first
+  assert [row[2] for row in database.rows] == [float(index) for index in range(15)]
+  assert writer.stats() == {'buffered': 0, 'written': 15, 'dropped': 0}
+  writer.close()
+
+def test_oldest_rows_are_dropped_past_max_rows_while_failing():
+  database = Database()
+  writer = ValueWriter(database, max_rows=100, flush_rows=1000, interval=3600)
+  database.down = True
+  add(writer, 80)
+  writer.flush()
+  add(writer, 70, 80)
+  assert writer.stats() == {'buffered': 100, 'written': 0, 'dropped': 50}
+  database.down = False
+  writer.flush()
+  assert [row[2] for row in database.rows] == [float(index) for index in range(50, 150)]
+  writer.close()
+
+def test_rows_are_kept_and_the_flusher_survives_when_the_database_is_unreachable():
+  database = Database()
+  writer = ValueWriter(database, max_rows=100, flush_rows=1000, interval=0.05)
+  database.unreachable = True
+  add(writer, 10)
+  writer.flush()
+  assert writer.stats() == {'buffered': 10, 'written': 0, 'dropped': 0}
+  # Flushes of the background thread fail as well
+  time.sleep(0.3)
+  assert writer.thread.is_alive()
+  database.unreachable = False
+  deadline = time.time() + 5
+  while writer.stats()['written'] < 10 and time.time() < deadline:
+    time.sleep(0.05)
+  assert [row[2] for row in database.rows] == [float(index) for index in range(10)]
+  writer.close()